@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+"""
+Benchmarks for the corpus building and evaluation pipeline.
+
+A synthetic repository is built with dulwich, then each stage of the
+pipeline is timed on it. Results are written as JSON so that runs can be
+compared:
+
+    $ python -m benchmarks.bench run --commits 500 --output before.json
+    $ python -m benchmarks.bench run --commits 500 --output after.json
+    $ python -m benchmarks.bench compare before.json after.json
+
+Run from the top of the repository, the stop word lists are read from data/.
+"""
+
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import tempfile
+import threading
+import time
+
+import click
+import dulwich.repo
+from dulwich.objects import Blob, Tree, Commit
+from gensim.corpora import MalletCorpus, Dictionary
+from gensim.models import LdaModel
+
+from src import utils
+from src.corpora import (MultiTextCorpus, ChangesetCorpus, CommitLogCorpus,
+                         get_stop_filter)
+from src.preprocessing import split, split_reference, tokenize
+from src.sparsecorpus import SparseCorpus
+
+import logging
+logger = logging.getLogger('mct.bench')
+
+WORDS = ['abstract', 'buffer', 'cache', 'config', 'connection', 'context',
+         'data', 'default', 'entry', 'event', 'factory', 'file', 'graph',
+         'handler', 'index', 'input', 'item', 'key', 'list', 'listener',
+         'manager', 'map', 'message', 'model', 'node', 'object', 'output',
+         'parser', 'path', 'reader', 'request', 'response', 'result',
+         'server', 'session', 'state', 'stream', 'string', 'table', 'task',
+         'tree', 'type', 'user', 'value', 'view', 'writer', 'xml', 'http']
+
+# seconds between samples of the resident set while a stage runs
+RSS_INTERVAL = 0.01
+
+
+def current_rss():
+    """ Resident set size of this process right now, in kilobytes, or None
+    where /proc is not there to tell. Unlike the peak from getrusage, which
+    only ever grows over the whole run, this can be sampled for each stage.
+
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return None
+
+    return pages * resource.getpagesize() // 1024
+
+
+def make_identifier(rand):
+    words = [rand.choice(WORDS) for _ in range(rand.randint(1, 4))]
+    style = rand.random()
+    if style < 0.5:
+        return words[0] + ''.join(word.capitalize() for word in words[1:])
+    elif style < 0.8:
+        return ''.join(word.capitalize() for word in words)
+    else:
+        return '_'.join(word.upper() for word in words)
+
+
+def make_line(rand):
+    return '%s.%s(%s);' % (make_identifier(rand), make_identifier(rand),
+                           make_identifier(rand))
+
+
+def make_repo(path, commits, files, lines, seed):
+    """ Builds a repository of `commits` commits over `files` Java-ish
+    files of about `lines` lines each. Each commit edits a few lines of a
+    few files.
+
+    """
+    rand = random.Random(seed)
+    repo = dulwich.repo.Repo.init(path)
+
+    contents = dict()
+    blobs = dict()  # file number => blob id of its contents
+    parents = []
+    for i in range(commits):
+        if i == 0:
+            changed = range(files)
+        else:
+            changed = rand.sample(range(files), min(files, rand.randint(1, 3)))
+
+        for f in changed:
+            if f not in contents:
+                contents[f] = [make_line(rand) for _ in range(lines)]
+            else:
+                for _ in range(rand.randint(1, 5)):
+                    contents[f][rand.randrange(lines)] = make_line(rand)
+
+            blob = Blob.from_string('\n'.join(contents[f]) + '\n')
+            repo.object_store.add_object(blob)
+            blobs[f] = blob.id
+
+        tree = Tree()
+        for f, blob_id in blobs.items():
+            tree.add('File%d.java' % f, 0o100644, blob_id)
+
+        repo.object_store.add_object(tree)
+
+        commit = Commit()
+        commit.tree = tree.id
+        commit.parents = parents
+        commit.author = commit.committer = 'Bench <bench@example.com>'
+        commit.commit_time = commit.author_time = 1400000000 + i
+        commit.commit_timezone = commit.author_timezone = 0
+        commit.message = 'Update %s for %s' % (make_identifier(rand),
+                                               make_identifier(rand))
+        repo.object_store.add_object(commit)
+        parents = [commit.id]
+
+    repo.refs['refs/heads/master'] = parents[0]
+    return repo
+
+
+class Stage(object):
+    """ Times a stage of the pipeline and counts the documents, tokens and
+    lines that went through it, lines standing in for tokens in the stages
+    before tokenizing. A thread samples the resident set while the stage
+    runs, for the peak it reached.
+
+    """
+
+    def __init__(self, results, name):
+        self.results = results
+        self.name = name
+        self.docs = 0
+        self.tokens = 0
+        self.lines = 0
+
+    def __enter__(self):
+        self.start_rss = self.peak_rss = current_rss()
+        self.done = threading.Event()
+        self.sampler = threading.Thread(target=self._sample)
+        self.sampler.daemon = True
+        self.sampler.start()
+
+        self.start = time.time()
+        self.start_cpu = time.clock()
+        return self
+
+    def _sample(self):
+        while not self.done.is_set():
+            rss = current_rss()
+            if rss is not None:
+                self.peak_rss = max(self.peak_rss, rss)
+
+            self.done.wait(RSS_INTERVAL)
+
+    def __exit__(self, *exc_info):
+        wall = time.time() - self.start
+        cpu = time.clock() - self.start_cpu
+        self.done.set()
+        self.sampler.join()
+
+        rss = current_rss()
+        result = dict(seconds=wall,
+                      cpu_seconds=cpu,
+                      docs=self.docs,
+                      tokens=self.tokens,
+                      lines=self.lines,
+                      rss_kb=rss)
+
+        if rss is not None and self.start_rss is not None:
+            peak = max(self.peak_rss, rss)
+            result['peak_rss_kb'] = peak
+            result['peak_rss_growth_kb'] = peak - self.start_rss
+
+        if wall > 0:
+            result['docs_per_sec'] = self.docs / wall
+            result['tokens_per_sec'] = self.tokens / wall
+            result['lines_per_sec'] = self.lines / wall
+
+        self.results[self.name] = result
+        logger.info('%s: %.3fs, %d docs, %d tokens, %d lines' %
+                    (self.name, wall, self.docs, self.tokens, self.lines))
+
+
+def run_benchmarks(repo, workdir, num_topics, passes):
+    results = dict()
+
+    with Stage(results, 'walk') as stage:
+        for walk_entry in repo.get_walker():
+            stage.docs += 1
+
+    with Stage(results, 'diff') as stage:
+        corpus = ChangesetCorpus(repo, lazy_dict=True)
+        for walk_entry in repo.get_walker():
+            for parent, changes in corpus._get_changes(walk_entry.commit):
+                stage.docs += 1
+                stage.lines += sum(1 for _ in
+                                   corpus._iter_diff_lines(changes))
+
+    # a sample of raw tokens for the splitters
+    raw_tokens = list()
+    for entry in repo.object_store.iter_tree_contents(repo['HEAD'].tree):
+        raw_tokens.extend(tokenize(repo.object_store[entry.sha].data))
+
+    for name, splitter in [('split', split),
+                           ('split_reference', split_reference)]:
+        with Stage(results, name) as stage:
+            stage.docs = 1
+            stage.tokens = sum(1 for _ in splitter(raw_tokens))
+
+    words = [word.lower() for word in split(raw_tokens)]
+    with Stage(results, 'remove_stops') as stage:
+        stage.docs = 1
+        stage.tokens = sum(1 for _ in get_stop_filter()(words))
+
+    texts = dict()
+    for Kind in [MultiTextCorpus, ChangesetCorpus, CommitLogCorpus]:
+        name = 'tokenize_' + Kind.__name__
+        with Stage(results, name) as stage:
+            corpus = Kind(repo, lazy_dict=True)
+            texts[Kind] = [list(text) for text in corpus.get_texts()]
+            stage.docs = len(texts[Kind])
+            stage.tokens = sum(len(text) for text in texts[Kind])
+
+    kind = ChangesetCorpus
+    with Stage(results, 'doc2bow') as stage:
+        id2word = Dictionary()
+        docs = [id2word.doc2bow(text, allow_update=True)
+                for text in texts[kind]]
+        stage.docs = len(docs)
+        stage.tokens = sum(len(text) for text in texts[kind])
+
+    mallet_fname = os.path.join(workdir, 'bench.mallet')
+    with Stage(results, 'serialize_mallet') as stage:
+        MalletCorpus.serialize(mallet_fname, docs, id2word=id2word)
+        stage.docs = len(docs)
+
+    sparse_fname = os.path.join(workdir, 'bench.sparse')
+    with Stage(results, 'serialize_sparse') as stage:
+        SparseCorpus.serialize(sparse_fname, docs)
+        stage.docs = len(docs)
+
+    for name, corpus in [
+            ('read_mallet', MalletCorpus(mallet_fname, id2word=id2word)),
+            ('read_sparse', SparseCorpus(sparse_fname, id2word=id2word))]:
+        with Stage(results, name) as stage:
+            for doc in corpus:
+                stage.docs += 1
+                stage.tokens += sum(count for _, count in doc)
+
+    with Stage(results, 'train') as stage:
+        model = LdaModel(docs, id2word=id2word, num_topics=num_topics,
+                         passes=passes)
+        stage.docs = len(docs) * passes
+
+    with Stage(results, 'evaluate_perplexity') as stage:
+        model.log_perplexity(docs)
+        stage.docs = len(docs)
+
+    for fn in [utils.kullback_leibler_divergence,
+               utils.hellinger_distance,
+               utils.cosine_distance,
+               utils.jensen_shannon_divergence,
+               utils.total_variation_distance]:
+        with Stage(results, 'evaluate_' + fn.__name__) as stage:
+            utils.score(model, fn)
+            stage.docs = num_topics
+
+    return results
+
+
+@click.group()
+@click.option('--verbose', is_flag=True)
+def bench(verbose):
+    """
+    Benchmarks for Modeling Changeset Topics
+    """
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : ' +
+                        '%(name)s : %(funcName)s : %(message)s')
+
+    if verbose:
+        logging.root.setLevel(level=logging.DEBUG)
+    else:
+        logging.root.setLevel(level=logging.INFO)
+        logging.getLogger('gensim').setLevel(level=logging.WARNING)
+
+
+@bench.command()
+@click.option('--commits', default=200)
+@click.option('--files', default=50)
+@click.option('--lines', default=100, help="Lines in each file")
+@click.option('--num-topics', default=20)
+@click.option('--passes', default=1)
+@click.option('--seed', default=0)
+@click.option('--output', default='bench-results.json',
+              help="File to write the JSON results to")
+def run(commits, files, lines, num_topics, passes, seed, output):
+    """
+    Builds a synthetic repository and times each stage on it
+    """
+    workdir = tempfile.mkdtemp()
+    try:
+        repo_path = os.path.join(workdir, 'repo')
+        os.mkdir(repo_path)
+
+        start = time.time()
+        repo = make_repo(repo_path, commits, files, lines, seed)
+        logger.info('Built synthetic repository in %.3fs' %
+                    (time.time() - start))
+
+        stages = run_benchmarks(repo, workdir, num_topics, passes)
+    finally:
+        shutil.rmtree(workdir)
+
+    results = dict(
+        timestamp=time.time(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        parameters=dict(commits=commits, files=files, lines=lines,
+                        num_topics=num_topics, passes=passes, seed=seed),
+        stages=stages,
+    )
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    logger.info('Wrote results to %s' % output)
+
+
+@bench.command()
+@click.argument('before', type=click.File('r'))
+@click.argument('after', type=click.File('r'))
+def compare(before, after):
+    """
+    Compares the stage timings of two result files
+    """
+    before = json.load(before)
+    after = json.load(after)
+
+    if before['parameters'] != after['parameters']:
+        click.echo('Warning: the runs used different parameters')
+
+    click.echo('%-40s %10s %10s %8s' % ('stage', 'before', 'after', 'speedup'))
+    for name in sorted(set(before['stages']) | set(after['stages'])):
+        if name not in before['stages'] or name not in after['stages']:
+            continue
+
+        a = before['stages'][name]['seconds']
+        b = after['stages'][name]['seconds']
+        speedup = a / b if b > 0 else float('inf')
+        click.echo('%-40s %9.3fs %9.3fs %7.2fx' % (name, a, b, speedup))
+
+
+if __name__ == '__main__':
+    bench()
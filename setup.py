@@ -43,5 +43,7 @@ setup(
     entry_points='''
         [console_scripts]
         mct=src:main
+        mct-serve=src.service:serve
+        mct-batch=src.batch:batch
     ''',
 )
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+"""
+Code for storing built corpora and models by the inputs that made them.
+
+Each artifact lives in a directory named by a hash of every input that
+affects it, so any change to those inputs builds a new artifact instead of
+reusing a stale one, and identical inputs share an artifact across runs and
+projects. The inputs are kept alongside, in `artifact.json`, which is also
+touched whenever the artifact is used so that garbage collection can evict
+the least recently used artifacts first.
+"""
+
+import hashlib
+import json
+import os
+import os.path
+import shutil
+
+import logging
+logger = logging.getLogger('mct.artifacts')
+
+# bump when a change to the code changes what the same inputs build
+FORMAT_VERSION = 2
+
+INFO_FNAME = 'artifact.json'
+
+
+def file_digest(fnames):
+    """ Returns a digest of the contents of the files. """
+    digest = hashlib.sha1()
+    for fname in fnames:
+        with open(fname, 'rb') as f:
+            digest.update(hashlib.sha1(f.read()).hexdigest())
+
+    return digest.hexdigest()
+
+
+class ArtifactStore(object):
+    """
+    Directory of artifacts, each a directory of files named by the hash of
+    its inputs, a JSON-able dict.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.used = set()
+
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.root)
+
+    def key(self, inputs):
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True)).hexdigest()
+
+    def path(self, inputs, fname, meta=None, create=False):
+        """ Returns the path of `fname` within the artifact of these inputs.
+        A missing artifact is only created, ready to be written to, when
+        `create` is set, so that looking up what is not built yet leaves
+        nothing behind. `meta` is kept with the inputs, but not hashed.
+
+        """
+        inputs = dict(inputs, version=FORMAT_VERSION)
+        key = self.key(inputs)
+        artifact = os.path.join(self.root, key)
+        info_fname = os.path.join(artifact, INFO_FNAME)
+
+        if not os.path.exists(info_fname):
+            if not create:
+                return os.path.join(artifact, fname)
+
+            if not os.path.isdir(artifact):
+                os.makedirs(artifact)
+
+            with open(info_fname, 'w') as f:
+                json.dump(dict(inputs=inputs, meta=meta or dict()), f,
+                          indent=2, sort_keys=True)
+        elif key not in self.used:
+            os.utime(info_fname, None)
+
+        self.used.add(key)
+        return os.path.join(artifact, fname)
+
+    def artifacts(self):
+        """ Returns (directory, inputs, meta) for every artifact. """
+        for key in sorted(os.listdir(self.root)):
+            info_fname = os.path.join(self.root, key, INFO_FNAME)
+            if not os.path.exists(info_fname):
+                continue
+
+            with open(info_fname) as f:
+                info = json.load(f)
+
+            yield os.path.join(self.root, key), info['inputs'], info['meta']
+
+    def find(self, match):
+        """ Returns the directories of the artifacts built by this version
+        whose inputs and meta satisfy match(inputs, meta), most recently
+        used first.
+
+        """
+        found = list()
+        for artifact, inputs, meta in self.artifacts():
+            if inputs.pop('version', None) == FORMAT_VERSION and \
+                    match(inputs, meta):
+                found.append(artifact)
+
+        return sorted(found, key=last_used, reverse=True)
+
+    def size(self):
+        return sum(artifact_size(artifact)
+                   for artifact, _, _ in self.artifacts())
+
+    def gc(self, max_bytes):
+        """ Removes the least recently used artifacts until the store holds
+        no more than `max_bytes`, never removing those used by this process.
+        Returns the number of artifacts removed.
+
+        """
+        artifacts = [(last_used(artifact), artifact_size(artifact), artifact)
+                     for artifact, _, _ in self.artifacts()]
+        total = sum(size for _, size, _ in artifacts)
+
+        removed = 0
+        for _, size, artifact in sorted(artifacts):
+            if total <= max_bytes:
+                break
+
+            if os.path.basename(artifact) in self.used:
+                continue
+
+            logger.info('Removing artifact %s (%d bytes)' % (artifact, size))
+            shutil.rmtree(artifact)
+            total -= size
+            removed += 1
+
+        if total > max_bytes:
+            logger.warning('Artifacts in use take %d bytes, over the %d '
+                           'allowed' % (total, max_bytes))
+
+        return removed
+
+
+def last_used(artifact):
+    return os.path.getmtime(os.path.join(artifact, INFO_FNAME))
+
+
+def artifact_size(artifact):
+    total = 0
+    for dirpath, _, fnames in os.walk(artifact):
+        for fname in fnames:
+            total += os.path.getsize(os.path.join(dirpath, fname))
+
+    return total
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+"""
+Runs the whole study over many projects at once.
+
+Each project's corpora, models and evaluations are jobs in a dependency
+graph: a model waits for its corpus, and an evaluation for the corpora and
+models it reads. Ready jobs are run in separate processes, as many at once
+as `--jobs` and the `--memory` budget allow. Jobs whose outputs already
+exist are skipped, so an interrupted batch picks up where it stopped.
+"""
+
+import csv
+import multiprocessing
+import os.path
+import time
+
+import click
+
+from main import (Config, setup_config, read_projects, create_corpus,
+                  create_model, create_evaluation_distinctiveness,
+                  create_evaluation_corpora_cosine,
+                  create_evaluation_perplexity, create_evaluation_log)
+
+import logging
+logger = logging.getLogger('mct.batch')
+
+MB = 1024 * 1024
+
+# rough memory needed to build a corpus, and to hold a model on top of the
+# size of its topic-word matrices
+CORPUS_MEMORY = 512 * MB
+MODEL_MEMORY = 256 * MB
+
+
+class Job(object):
+    """
+    A step of the study, run as fn(*args) once every job in `deps` is done.
+
+    `outputs` says whether the job's results already exist, and `memory`
+    estimates the bytes it needs. Both are functions, called only once the
+    dependencies are done, so that they can look at what those wrote.
+    """
+
+    def __init__(self, name, fn, args=(), deps=(), outputs=None, memory=None):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.deps = list(deps)
+        self.outputs = outputs or (lambda: False)
+        self.memory = memory or (lambda: 0)
+
+    def __repr__(self):
+        return 'Job(%r)' % self.name
+
+
+def _run_job(job):
+    logging.getLogger('mct').info('Starting %s' % job.name)
+    job.fn(*job.args)
+
+
+class Scheduler(object):
+    """
+    Runs jobs in dependency order, each in its own process, with at most
+    `max_jobs` running and, if given, their memory estimates summing to no
+    more than `memory` bytes. A job over the budget on its own still runs,
+    alone.
+
+    A failed job fails every job depending on it, the rest carry on.
+    """
+
+    def __init__(self, jobs, max_jobs=1, memory=None, poll=0.1):
+        self.jobs = list(jobs)
+        self.max_jobs = max(1, max_jobs)
+        self.memory = memory
+        self.poll = poll
+
+        names = set(job.name for job in self.jobs)
+        for job in self.jobs:
+            for dep in job.deps:
+                if dep not in names:
+                    raise ValueError('%s depends on unknown job %s' %
+                                     (job.name, dep))
+
+    def run(self):
+        """ Runs every job, returning a dict of job names to their outcome:
+        'done', 'skipped' (outputs existed), or 'failed'.
+
+        """
+        status = dict()
+        pending = list(self.jobs)
+        running = dict()  # name => (job, process, memory, start time)
+        estimates = dict()
+        total = len(self.jobs)
+
+        def finish(job, outcome, elapsed=0.0):
+            status[job.name] = outcome
+            logger.info('[%d/%d] %s %s (%.1fs)' %
+                        (len(status), total, job.name, outcome, elapsed))
+
+        while pending or running:
+            finished = len(status)
+
+            # reap finished processes
+            for name, (job, process, memory, start) in list(running.items()):
+                if not process.is_alive():
+                    process.join()
+                    del running[name]
+                    outcome = 'done' if process.exitcode == 0 else 'failed'
+                    finish(job, outcome, time.time() - start)
+
+            started = False
+            for job in list(pending):
+                dep_status = [status.get(dep) for dep in job.deps]
+                if 'failed' in dep_status:
+                    pending.remove(job)
+                    finish(job, 'failed')
+                    continue
+
+                if not all(s in ('done', 'skipped') for s in dep_status):
+                    continue
+
+                if job.outputs():
+                    pending.remove(job)
+                    finish(job, 'skipped')
+                    continue
+
+                if len(running) >= self.max_jobs:
+                    break
+
+                if job.name not in estimates:
+                    estimates[job.name] = job.memory()
+
+                memory = estimates[job.name]
+                used = sum(m for _, _, m, _ in running.values())
+                if (self.memory is not None and running and
+                        used + memory > self.memory):
+                    continue
+
+                pending.remove(job)
+                process = multiprocessing.Process(target=_run_job,
+                                                  args=(job,))
+                process.start()
+                running[job.name] = (job, process, memory, time.time())
+                started = True
+
+            if running and not started:
+                time.sleep(self.poll)
+            elif not running and not started and len(status) == finished:
+                raise ValueError('Jobs depend on each other in a cycle: %s' %
+                                 ', '.join(job.name for job in pending))
+
+        return status
+
+
+def has_row(fname, key):
+    """ Whether a results file has a row starting with `key`. """
+    if not os.path.exists(fname):
+        return False
+
+    with open(fname) as f:
+        return any(row and row[0] == key for row in csv.reader(f))
+
+
+def model_memory(config, Kind):
+    """ Estimates the memory needed to train or evaluate a model of a built
+    corpus, from the size of its Dictionary.
+
+    """
+    from gensim.corpora import Dictionary
+
+    num_terms = len(Dictionary.load(config.get_corpus_fname(Kind) +
+                                    '.dict'))
+
+    # lambda, sstats and expElogbeta are all num_topics x num_terms doubles,
+    # and each training worker has its own copy
+    size = 3 * 8 * config.num_topics * num_terms
+    return MODEL_MEMORY + size * max(1, config.workers)
+
+
+def make_jobs(config):
+    """ Returns the jobs of the whole study for the project of `config`. """
+    from corpora import MultiTextCorpus, ChangesetCorpus, CommitLogCorpus
+
+    name = config.project.name
+    kinds = [MultiTextCorpus, ChangesetCorpus, CommitLogCorpus]
+    jobs = list()
+
+    def job_name(step, Kind=None):
+        if Kind is None:
+            return '%s:%s' % (name, step)
+
+        return '%s:%s:%s' % (name, step, Kind.__name__)
+
+    for Kind in kinds:
+        corpus_fname = config.get_corpus_fname(Kind)
+        model_fname = config.get_model_fname(Kind)
+        corpus = job_name('corpus', Kind)
+        model = job_name('model', Kind)
+
+        jobs.append(Job(corpus, create_corpus, (config, Kind),
+                        outputs=(lambda f=corpus_fname:
+                                 os.path.exists(f + '.dict')),
+                        memory=lambda: CORPUS_MEMORY))
+
+        memory = (lambda Kind=Kind: model_memory(config, Kind))
+        jobs.append(Job(model, create_model, (config, Kind),
+                        deps=[corpus],
+                        outputs=lambda f=model_fname: os.path.exists(f),
+                        memory=memory))
+
+        results_fname = config.path + 'evaluate-results.csv'
+        jobs.append(Job(job_name('distinctiveness', Kind),
+                        create_evaluation_distinctiveness, (config, Kind),
+                        deps=[corpus, model],
+                        outputs=(lambda f=results_fname, k=model_fname:
+                                 has_row(f, k)),
+                        memory=memory))
+
+        results_fname = config.path + 'evaluate-perplexity-results.csv'
+        jobs.append(Job(job_name('perplexity', Kind),
+                        create_evaluation_perplexity, (config, Kind),
+                        deps=[corpus, model],
+                        outputs=(lambda f=results_fname, k=model_fname:
+                                 has_row(f, k)),
+                        memory=memory))
+
+    results_fname = config.path + 'evaluate-hellinger-results.csv'
+    key = config.get_corpus_fname(MultiTextCorpus)
+    jobs.append(Job(job_name('corpora'), create_evaluation_corpora_cosine,
+                    (config, MultiTextCorpus, ChangesetCorpus),
+                    deps=[job_name('corpus', MultiTextCorpus),
+                          job_name('corpus', ChangesetCorpus)],
+                    outputs=lambda: has_row(results_fname, key),
+                    memory=lambda: CORPUS_MEMORY))
+
+    model_fname = config.get_model_fname(ChangesetCorpus)
+    jobs.append(Job(job_name('log'), create_evaluation_log, (config,),
+                    deps=[job_name('corpus', ChangesetCorpus),
+                          job_name('corpus', CommitLogCorpus),
+                          job_name('model', ChangesetCorpus)],
+                    outputs=(lambda: has_row('data/evaluate-log-results.csv',
+                                             model_fname)),
+                    memory=lambda: model_memory(config, ChangesetCorpus)))
+
+    return jobs
+
+
+@click.command()
+@click.argument('projects', nargs=-1)
+@click.option('--path', default='data/',
+              help="Set the directory to work within")
+@click.option('--num-topics', default=100)
+@click.option('--jobs', default=multiprocessing.cpu_count(),
+              help="Number of jobs to run at once")
+@click.option('--memory', default=None, type=int,
+              help="Memory budget of the running jobs, in megabytes")
+@click.option('--artifacts', default=None,
+              help="Directory to keep corpora and models in, named by the "
+                   "hash of everything they are built from")
+@click.option('--verbose', is_flag=True)
+def batch(projects, path, num_topics, jobs, memory, artifacts, verbose):
+    """
+    Runs the study over several projects, all of them by default
+    """
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : ' +
+                        '%(name)s : %(funcName)s : %(message)s')
+
+    if verbose:
+        logging.root.setLevel(level=logging.DEBUG)
+    else:
+        logging.root.setLevel(level=logging.INFO)
+        logging.getLogger('gensim').setLevel(level=logging.WARNING)
+
+    if not projects:
+        projects = [project.name for project in read_projects()]
+
+    store = None
+    if artifacts is not None:
+        from artifacts import ArtifactStore
+        store = ArtifactStore(artifacts)
+
+    all_jobs = list()
+    for project in projects:
+        config = Config()
+        setup_config(config, project, path)
+        config.num_topics = num_topics
+        config.artifacts = store
+        all_jobs.extend(make_jobs(config))
+
+    logger.info('Running %d jobs for %d projects' %
+                (len(all_jobs), len(projects)))
+
+    if memory is not None:
+        memory *= MB
+
+    status = Scheduler(all_jobs, max_jobs=jobs, memory=memory).run()
+
+    failed = sorted(name for name, outcome in status.items()
+                    if outcome == 'failed')
+    if failed:
+        logger.error('%d jobs failed: %s' % (len(failed), ', '.join(failed)))
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    batch()
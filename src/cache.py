@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+"""
+Code for caching preprocessed tokens on disk.
+"""
+
+import sqlite3
+import time
+
+import logging
+logger = logging.getLogger('mct.cache')
+
+
+class TokenCache(object):
+    """
+    Persistent mapping of cache keys (object SHAs plus the preprocessing
+    options used) to the list of words they preprocess into.
+
+    A value of None is allowed, and is used to remember that an object is
+    binary. Once the cache grows past `max_bytes`, the least recently used
+    entries are evicted on `sync()`.
+
+    The cache is backed by sqlite, so several processes can share one file.
+    Only the filename and size cap are pickled, each process opens its own
+    connection.
+    """
+
+    def __init__(self, fname, max_bytes=1024 * 1024 * 1024):
+        self.fname = fname
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._pending = 0
+        self._last_used = 0.0
+
+    def __repr__(self):
+        return '%s(%r, max_bytes=%d)' % (self.__class__.__name__,
+                                         self.fname, self.max_bytes)
+
+    def __getstate__(self):
+        return dict(fname=self.fname, max_bytes=self.max_bytes)
+
+    def __setstate__(self, state):
+        self.__init__(state['fname'], state['max_bytes'])
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.fname, timeout=60)
+            self._conn.text_factory = str
+            self._conn.execute('CREATE TABLE IF NOT EXISTS tokens ('
+                               'key TEXT PRIMARY KEY, '
+                               'words BLOB, '
+                               'size INTEGER, '
+                               'used REAL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS tokens_used '
+                               'ON tokens (used)')
+            self._conn.commit()
+
+        return self._conn
+
+    def __getitem__(self, key):
+        row = self.conn.execute('SELECT words FROM tokens WHERE key = ?',
+                                (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+
+        self.conn.execute('UPDATE tokens SET used = ? WHERE key = ?',
+                          (self._now(), key))
+        self._touch()
+
+        words = row[0]
+        if words is None:
+            return None
+
+        return words.decode('utf-8').split()
+
+    def __setitem__(self, key, words):
+        if words is not None:
+            words = u' '.join(words).encode('utf-8')
+            size = len(key) + len(words)
+        else:
+            size = len(key)
+
+        self.conn.execute('INSERT OR REPLACE INTO tokens '
+                          '(key, words, size, used) VALUES (?, ?, ?, ?)',
+                          (key, words, size, self._now()))
+        self._touch()
+
+    def __contains__(self, key):
+        row = self.conn.execute('SELECT 1 FROM tokens WHERE key = ?',
+                                (key,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM tokens').fetchone()[0]
+
+    def _now(self):
+        # strictly increasing, so recency is never a tie within a process
+        self._last_used = max(time.time(), self._last_used + 1e-6)
+        return self._last_used
+
+    def _touch(self):
+        # commit in batches, a transaction per word list is far too slow
+        self._pending += 1
+        if self._pending >= 1000:
+            self.sync()
+
+    def size(self):
+        total = self.conn.execute('SELECT SUM(size) FROM tokens').fetchone()[0]
+        return total or 0
+
+    def sync(self):
+        """ Commits pending changes, evicting the least recently used entries
+        if the cache has grown past its size cap.
+
+        """
+        self._pending = 0
+        total = self.size()
+        if total > self.max_bytes:
+            evict = list()
+            cursor = self.conn.execute('SELECT key, size FROM tokens '
+                                       'ORDER BY used')
+            for key, size in cursor:
+                if total <= self.max_bytes:
+                    break
+
+                evict.append((key,))
+                total -= size
+            cursor.close()
+
+            logger.info('Evicting %d entries from token cache %s' %
+                        (len(evict), self.fname))
+            self.conn.executemany('DELETE FROM tokens WHERE key = ?', evict)
+
+        self.conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self.sync()
+            self._conn.close()
+            self._conn = None
+
+
+class LRUCache(object):
+    """
+    In-memory mapping that holds at most `max_size` entries, dropping the
+    least recently used ones when a new entry would go over. Given a
+    `sizeof` function, it is the total of sizeof(value) over the entries
+    that is held to `max_size` instead, and values larger than that on
+    their own are not kept at all.
+    """
+
+    # fields of each link in the circular list of entries
+    PREV, NEXT, KEY, VALUE, SIZE = 0, 1, 2, 3, 4
+
+    def __init__(self, max_size=2 ** 16, sizeof=None):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.clear()
+
+    def clear(self):
+        self._links = dict()
+        self._root = root = list()
+        root[:] = [root, root, None, None, 0]
+        self.size = 0
+
+    def __len__(self):
+        return len(self._links)
+
+    def __contains__(self, key):
+        return key in self._links
+
+    def __getitem__(self, key):
+        link = self._links[key]
+
+        # move the link to the most recently used end
+        link_prev, link_next = link[self.PREV], link[self.NEXT]
+        link_prev[self.NEXT] = link_next
+        link_next[self.PREV] = link_prev
+
+        root = self._root
+        last = root[self.PREV]
+        last[self.NEXT] = root[self.PREV] = link
+        link[self.PREV] = last
+        link[self.NEXT] = root
+        return link[self.VALUE]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        size = 1 if self.sizeof is None else self.sizeof(value)
+        if key in self._links:
+            self._unlink(self._links[key])
+
+        if size > self.max_size:
+            return
+
+        root = self._root
+        while self._links and self.size + size > self.max_size:
+            self._unlink(root[self.NEXT])  # the least recently used entry
+
+        last = root[self.PREV]
+        link = [last, root, key, value, size]
+        last[self.NEXT] = root[self.PREV] = link
+        self._links[key] = link
+        self.size += size
+
+    def _unlink(self, link):
+        link[self.PREV][self.NEXT] = link[self.NEXT]
+        link[self.NEXT][self.PREV] = link[self.PREV]
+        del self._links[link[self.KEY]]
+        self.size -= link[self.SIZE]
@@ -11,23 +11,83 @@
 Code for generating the corpora.
 """
 
-from StringIO import StringIO
+from array import array
+import fnmatch
+import hashlib
+import itertools
+import multiprocessing
+import os.path
 import re
+import string
 
 import gensim
 import dulwich
 import dulwich.repo
 import dulwich.patch
+from dulwich.diff_tree import RenameDetector, RENAME_THRESHOLD
+from dulwich.objects import Blob, Commit, Tag, S_ISGITLINK
+from dulwich.objectspec import parse_commit
 
-from preprocessing import tokenize, split, remove_stops, read_stops, to_unicode
+from cache import LRUCache
+from objectsize import object_size
+from preprocessing import (tokenize, split, split_cached, read_stops,
+                           to_unicode, StopFilter, Vocabulary, BagOfTokens)
+from profiling import NULL_PROFILER
 
 import logging
 logger = logging.getLogger('mct.corpora')
 
-STOPS = read_stops([
+STOP_FILES = [
     'data/english_stops.txt',
     'data/java_reserved.txt',
-])
+]
+
+# how a ChangesetCorpus treats merge commits: diffed against every parent,
+# only the first parent with the walk following first parents alone, only
+# the paths differing from every parent (as `git diff --cc`), or not at all
+MERGES = ['all', 'first-parent', 'combined', 'skip']
+
+# extensions of files that are never text, skipped without reading them
+SKIP_EXTENSIONS = ['.7z', '.a', '.bmp', '.bz2', '.class', '.dll', '.dylib',
+                   '.ear', '.eot', '.exe', '.gif', '.gz', '.ico', '.jar',
+                   '.jpeg', '.jpg', '.mov', '.mp3', '.mp4', '.o', '.otf',
+                   '.pdf', '.png', '.psd', '.pyc', '.rar', '.so', '.tar',
+                   '.tgz', '.tif', '.tiff', '.ttf', '.war', '.wav', '.woff',
+                   '.woff2', '.xz', '.zip']
+
+# bump whenever what the token cache holds for a key changes: entries are
+# lists of words in the order they were produced
+TOKEN_CACHE_VERSION = 2
+
+# a revision as a name followed by its ~N and ^N ancestry steps
+ANCESTRY = re.compile(r'^(.*?)((?:[~^]\d*)*)$', re.DOTALL)
+
+_stops = None
+_stop_filter = None
+
+
+def get_stops():
+    """ Returns the set of stop words, read from STOP_FILES the first time it
+    is needed rather than when this module is imported.
+
+    """
+    global _stops
+    if _stops is None:
+        _stops = read_stops(STOP_FILES)
+
+    return _stops
+
+
+def get_stop_filter():
+    """ Returns a StopFilter of the stop words, built the first time it is
+    needed.
+
+    """
+    global _stop_filter
+    if _stop_filter is None:
+        _stop_filter = StopFilter(get_stops())
+
+    return _stop_filter
 
 
 class GitCorpus(gensim.interfaces.CorpusABC):
@@ -46,7 +106,9 @@ class GitCorpus(gensim.interfaces.CorpusABC):
 
     def __init__(self, repo=None, ref='HEAD', remove_stops=True,
                  split=True, lower=True, min_len=3, max_len=40,
-                 lazy_dict=False):
+                 lazy_dict=False, processes=1, exclude=None, cache=None,
+                 profiler=None, intern_tokens=False, skip_extensions=None,
+                 text_extensions=None, max_blob_bytes=None):
 
         logger.info('Creating %s corpus out of source files for commit %s' % (
             self.__class__.__name__, ref))
@@ -58,6 +120,46 @@ class GitCorpus(gensim.interfaces.CorpusABC):
         self.min_len = min_len
         self.max_len = max_len
         self.lazy_dict = lazy_dict
+        self.processes = processes
+
+        # commits (and their ancestors) to leave out of history walks
+        self.exclude = list(exclude or [])
+
+        # a TokenCache, consulted before preprocessing any object
+        self.cache = cache
+        self._cache_prefix = None
+
+        # the words each token ends up as, since identifiers repeat a lot
+        self._token_words = LRUCache(max_size=2 ** 17)
+
+        # documents as BagOfTokens of interned word ids rather than lists of
+        # words, turned into bag-of-words vectors by _bag2bow
+        self.intern_tokens = intern_tokens
+        self.vocab = Vocabulary()
+        self._token_ids = LRUCache(max_size=2 ** 17)
+        self._bow_ids = dict()  # vocab ids => ids in self._bow_ids_of
+        self._bow_ids_of = None
+
+        # blobs are skipped before being read when their extension is not
+        # in `text_extensions`, if given, or else is in `skip_extensions`
+        # (SKIP_EXTENSIONS by default), when they are larger than
+        # `max_blob_bytes` going by their header, or when an earlier read
+        # found them binary
+        if skip_extensions is None:
+            skip_extensions = SKIP_EXTENSIONS
+
+        self.skip_extensions = list(skip_extensions)
+        self.text_extensions = list(text_extensions or [])
+        self.max_blob_bytes = max_blob_bytes
+        self._skip_extensions = frozenset(ext.lower()
+                                          for ext in self.skip_extensions)
+        self._text_extensions = frozenset(ext.lower()
+                                          for ext in self.text_extensions)
+        self._binary = LRUCache(max_size=2 ** 16)  # blob sha => is binary
+
+        # a Profiler, timing each stage of preprocessing when enabled. Only
+        # this process is timed, worker processes are not profiled.
+        self.profiler = profiler or NULL_PROFILER
 
         self.id2word = gensim.corpora.Dictionary()
         self.metadata = False
@@ -76,28 +178,353 @@ class GitCorpus(gensim.interfaces.CorpusABC):
 
             if not lazy_dict:
                 # build the dict (not lazy)
-                self.id2word.add_documents(self.get_texts())
+                if intern_tokens:
+                    for text in self.get_texts():
+                        self._bag2bow(text, allow_update=True)
+                else:
+                    self.id2word.add_documents(self.get_texts())
 
         super(GitCorpus, self).__init__()
 
-    def preprocess(self, document, info=[]):
+    def _get_walker(self, reverse=False):
+        """ Returns a walker over the history of the ref the corpus is taken
+        at, leaving out the commits of `self.exclude`.
+
+        """
+        return self.repo.get_walker(include=[self._ref_commit()],
+                                    exclude=self.exclude, reverse=reverse)
+
+    def _ref_commit(self):
+        """ Returns the id of the commit the corpus is taken at. """
+        return peel_commit(self.repo, self.ref)
+
+    def _worker_options(self):
+        """ Returns the keyword arguments needed to rebuild this corpus in a
+        worker process, minus the repository itself.
+
+        """
+        return dict(ref=self.ref,
+                    remove_stops=self.remove_stops,
+                    split=self.split,
+                    lower=self.lower,
+                    min_len=self.min_len,
+                    max_len=self.max_len,
+                    lazy_dict=True,
+                    cache=self.cache,
+                    intern_tokens=self.intern_tokens,
+                    skip_extensions=self.skip_extensions,
+                    text_extensions=self.text_extensions,
+                    max_blob_bytes=self.max_blob_bytes)
+
+    def _prefilter(self, path, mode, sha):
+        """ Returns why a blob can be skipped without reading it, or None
+        if it has to be read.
+
+        """
+        with self.profiler.stage('prefilter') as stage:
+            reason = self._skip_reason(path, mode, sha)
+            if reason is not None:
+                stage.add(count=1)
+                logger.debug('Skipping %s: %s' % (path, reason))
+
+        return reason
+
+    def _skip_reason(self, path, mode, sha):
+        if mode is not None and S_ISGITLINK(mode):
+            return 'gitlink'  # a commit of another repository
+
+        ext = os.path.splitext(path)[1].lower()
+        if self._text_extensions:
+            if ext not in self._text_extensions:
+                return 'extension'
+        elif ext in self._skip_extensions:
+            return 'extension'
+
+        if self._binary.get(sha):
+            return 'binary'
+
+        if (self.max_blob_bytes is not None and
+                self._blob_size(sha) > self.max_blob_bytes):
+            return 'size'
+
+        return None
+
+    def _blob_size(self, sha):
+        """ Returns the size of a blob, from its header when possible. """
+        size = object_size(self.repo.object_store, sha)
+        if size is None:
+            size = len(self.repo.object_store.get_raw(sha)[1])
+
+        return size
+
+    def _portable(self, text):
+        """ Returns a text as it can be sent to another process, which has
+        its own Vocabulary: the counts of its words rather than their ids.
+
+        """
+        if isinstance(text, BagOfTokens):
+            return text.counts(self.vocab)
+
+        return text
+
+    def _from_portable(self, text):
+        if isinstance(text, dict):
+            return self.vocab.bag_from_counts(text)
+
+        return text
+
+    def _cache_key(self, key):
+        """ Returns the key prefixed with a digest of the preprocessing
+        options, so corpora built with different options never share
+        entries.
+
+        """
+        if self._cache_prefix is None:
+            stops = set(get_stops())
+            stops.update(string.punctuation)
+            stops.update(string.digits)
+            stops.update(string.whitespace)
+            options = (TOKEN_CACHE_VERSION, self.remove_stops, self.split,
+                       self.lower, self.min_len, self.max_len, sorted(stops))
+            self._cache_prefix = hashlib.sha1(repr(options)).hexdigest()
+
+        return self._cache_prefix + ':' + key
+
+    def _cache_get(self, key):
+        """ Returns the cached list of words for the key, raising KeyError
+        if the cache does not have it.
+
+        """
+        with self.profiler.stage('cache') as stage:
+            words = self.cache[self._cache_key(key)]
+            stage.add(count=1)
+
+        return words
+
+    def _cached(self, key, get_words):
+        """ Returns the list of words for the cache key, calling
+        get_words(ordered) and storing the result if the cache does not have
+        it yet. When interning, a BagOfTokens of them instead.
+
+        The cache always holds the words in the order they were produced, so
+        that they can be clipped to a budget later on.
+
+        """
+        if self.cache is None:
+            return get_words(False)
+
+        try:
+            words = self._cache_get(key)
+        except KeyError:
+            words = get_words(True)
+            if words is not None:
+                words = list(words)
+
+            self.cache[self._cache_key(key)] = words
+
+        if words is not None and self.intern_tokens:
+            return self.vocab.bag(words)
+
+        return words
+
+    def _cached_clip(self, key, get_words, limit):
+        """ Returns at most `limit` of the words for the cache key, taken in
+        the order they were produced, along with whether any were cut off.
+        When interning, the words kept are bagged after clipping.
+
+        Preprocessing stops one word past the limit, so only words that
+        were not cut off are ever stored. A key of None is never cached.
+
+        """
+        if limit is None:
+            if key is None:
+                return get_words(False), False
+
+            return self._cached(key, get_words), False
+
+        cache = self.cache if key is not None else None
+        words = hit = None
+        if cache is not None:
+            try:
+                words, hit = self._cache_get(key), True
+            except KeyError:
+                pass
+
+        if not hit:
+            words = get_words(True)
+
+        cut = False
+        if words is not None:
+            words, cut = _clip(words, limit)
+
+        if cache is not None and not hit and not cut:
+            cache[self._cache_key(key)] = words
+
+        if words is not None and self.intern_tokens:
+            words = self.vocab.bag(words)
+
+        return words, cut
+
+    def _get_blob_words(self, sha, info=[]):
+        """ Returns the words of a whole blob, or None if it is binary.
+
+        """
+        if self._binary.get(sha):
+            return None
+
+        return self._cached('blob:' + sha, self._blob_reader(sha, info))
+
+    def _blob_reader(self, sha, info=[]):
+        """ Returns a get_words(ordered) function reading and preprocessing
+        a whole blob, giving None if it is binary.
+
+        """
+        def get_words(ordered):
+            with self.profiler.stage('read') as stage:
+                document = self.repo.object_store.get_raw(sha)[1]
+                stage.add(count=1, nbytes=len(document))
+
+            self._binary[sha] = binary = dulwich.patch.is_binary(document)
+            if binary:
+                return None
+
+            return self.preprocess(document, info, ordered)
+
+        return get_words
+
+    def preprocess(self, document, info=[], ordered=False):
+        if self.profiler.enabled:
+            return self._profile_preprocess([document], info, ordered)
+
         document = to_unicode(document, info)
         words = tokenize(document)
+        return self._process_words(words, ordered)
+
+    def preprocess_lines(self, lines, info=[], ordered=False):
+        """ Preprocesses a document given as an iterable of lines, one line
+        at a time, so the whole document is never held in memory.
+
+        """
+        if self.profiler.enabled:
+            return self._profile_preprocess(lines, info, ordered)
+
+        words = (word for line in lines
+                 for word in tokenize(to_unicode(line, info)))
+        return self._process_words(words, ordered)
+
+    def _profile_preprocess(self, lines, info=[], ordered=False):
+        """ Preprocesses the lines one whole stage at a time, rather than
+        as a chain of generators, so that each stage can be timed on its
+        own. Only used when profiling.
+
+        """
+        profiler = self.profiler
+
+        with profiler.stage('to_unicode') as stage:
+            lines = list(lines)
+            stage.add(count=len(lines), nbytes=sum(len(x) for x in lines))
+            lines = [to_unicode(line, info) for line in lines]
+
+        with profiler.stage('tokenize') as stage:
+            words = [word for line in lines for word in tokenize(line)]
+            stage.add(count=len(words))
 
         if self.split:
-            words = split(words)
+            with profiler.stage('split') as stage:
+                words = list(split(words))
+                stage.add(count=len(words))
 
         if self.lower:
-            words = (word.lower() for word in words)
+            with profiler.stage('lower') as stage:
+                words = [word.lower() for word in words]
+                stage.add(count=len(words))
 
         if self.remove_stops:
-            words = remove_stops(words, STOPS)
+            with profiler.stage('stops') as stage:
+                words = list(get_stop_filter()(words))
+                stage.add(count=len(words))
+
+        with profiler.stage('length') as stage:
+            words = [word for word in words
+                     if self.min_len <= len(word) <= self.max_len]
+            stage.add(count=len(words))
+
+        if self.intern_tokens and not ordered:
+            with profiler.stage('intern') as stage:
+                stage.add(count=len(words))
+                words = self.vocab.bag(words)
 
-        def include(word):
-            return len(word) >= self.min_len and len(word) <= self.max_len
-        words = (word for word in words if include(word))
         return words
 
+    def _process_words(self, tokens, ordered=False):
+        """ Splits, lowercases, length filters and stop filters the tokens
+        in a single pass, giving a generator of the words, or a BagOfTokens
+        of them when interning, unless the words are wanted in order.
+
+        """
+        if self.intern_tokens and not ordered:
+            return self._count_tokens(tokens)
+
+        return self._iter_words(tokens)
+
+    def _iter_words(self, tokens):
+        """ Yields the words of the tokens, remembering what each token
+        ended up as.
+
+        """
+        memo = self._token_words
+        for token in tokens:
+            try:
+                words = memo[token]
+            except KeyError:
+                words = self._process_token(token)
+                memo[token] = words
+
+            for word in words:
+                yield word
+
+    def _count_tokens(self, tokens):
+        """ Returns a BagOfTokens of the words of the tokens, remembering
+        the interned ids each token ended up as, so no word is ever held
+        more than once.
+
+        """
+        memo = self._token_ids
+        intern = self.vocab.intern
+        bag = BagOfTokens()
+        for token in tokens:
+            try:
+                ids = memo[token]
+            except KeyError:
+                ids = tuple(intern(word) for word in
+                            self._process_token(token))
+                memo[token] = ids
+
+            bag.add(ids)
+
+        return bag
+
+    def _process_token(self, token):
+        """ Returns the words a single token ends up as. """
+        words = split_cached(token) if self.split else (token,)
+        stops = get_stop_filter() if self.remove_stops else None
+        min_len, max_len, lower = self.min_len, self.max_len, self.lower
+
+        kept = list()
+        for word in words:
+            if lower:
+                word = word.lower()
+
+            if not min_len <= len(word) <= max_len:
+                continue
+
+            if stops is not None and word in stops:
+                continue
+
+            kept.append(word)
+
+        return tuple(kept)
+
     def __iter__(self):
         """
         The function that defines a corpus.
@@ -109,10 +536,63 @@ class GitCorpus(gensim.interfaces.CorpusABC):
             if self.metadata:
                 meta = text[1]
                 text = text[0]
-                yield (self.id2word.doc2bow(text, allow_update=self.lazy_dict),
-                       meta)
+
+            with self.profiler.stage('doc2bow') as stage:
+                doc = self.doc2bow(text, allow_update=self.lazy_dict)
+                stage.add(count=1)
+
+            if self.metadata:
+                yield doc, meta
             else:
-                yield self.id2word.doc2bow(text, allow_update=self.lazy_dict)
+                yield doc
+
+    def doc2bow(self, text, allow_update=False):
+        """ Returns the bag-of-words vector of a text from get_texts(),
+        whether a list of words or a BagOfTokens.
+
+        """
+        if isinstance(text, BagOfTokens):
+            return self._bag2bow(text, allow_update)
+
+        return self.id2word.doc2bow(text, allow_update=allow_update)
+
+    def _bag2bow(self, bag, allow_update=False):
+        """ Dictionary.doc2bow for a BagOfTokens: the same vector, and the
+        same updates to the Dictionary, without spelling out the words.
+
+        """
+        id2word = self.id2word
+        if self._bow_ids_of is not id2word:
+            self._bow_ids = dict()
+            self._bow_ids_of = id2word
+
+        bow_ids = self._bow_ids
+        token2id = id2word.token2id
+        words = self.vocab.words
+
+        result = dict()
+        missing = list()
+        for i, count in bag.iteritems():
+            bow_id = bow_ids.get(i)
+            if bow_id is None:
+                bow_id = token2id.get(words[i])
+                if bow_id is None:
+                    missing.append((words[i], count, i))
+                    continue
+
+                bow_ids[i] = bow_id
+
+            result[bow_id] = count
+
+        if allow_update:
+            # new ids go to the missing words in sorted order, as doc2bow
+            for word, count, i in sorted(missing):
+                bow_ids[i] = token2id[word] = len(token2id)
+                result[bow_ids[i]] = count
+
+            count_document(id2word, result.iteritems())
+
+        return sorted(result.iteritems())
 
     def get_texts(self):
         """
@@ -130,17 +610,81 @@ class GitCorpus(gensim.interfaces.CorpusABC):
         return self.length  # will throw if corpus not initialized
 
 
+def count_document(id2word, bow):
+    """ Counts one more document with the bag-of-words vector in the
+    Dictionary's statistics, as doc2bow(allow_update=True) would.
+
+    """
+    nnz = 0
+    for bow_id, count in bow:
+        id2word.num_pos += count
+        id2word.cfs[bow_id] = id2word.cfs.get(bow_id, 0) + count
+        id2word.dfs[bow_id] = id2word.dfs.get(bow_id, 0) + 1
+        nnz += 1
+
+    id2word.num_docs += 1
+    id2word.num_nnz += nnz
+
+
+def peel_commit(repo, ref):
+    """ Returns the id of the commit a ref, tag or (short) commit id names,
+    followed by any number of ~N and ^N, the Nth first-parent ancestor and
+    the Nth parent as git reads them. Raises KeyError if it names no commit.
+
+    """
+    if isinstance(ref, unicode):
+        ref = ref.encode('utf-8')
+
+    name, steps = ANCESTRY.match(ref).groups()
+    try:
+        obj = parse_commit(repo, name)
+    except ValueError:
+        raise KeyError(ref)
+
+    while isinstance(obj, Tag):
+        obj = repo[obj.object[1]]
+
+    if not isinstance(obj, Commit):
+        raise KeyError(ref)
+
+    for step, n in re.findall(r'([~^])(\d*)', steps):
+        n = int(n) if n else 1
+        if step == '~':
+            parents = [0] * n
+        else:
+            parents = [n - 1] if n else []
+
+        for parent in parents:
+            if parent >= len(obj.parents):
+                raise KeyError(ref)
+
+            obj = repo[obj.parents[parent]]
+
+    return obj.id
+
+
+def tag_refs(repo):
+    """ Returns the names of every tag of the repository, oldest commit
+    first.
+
+    """
+    return sorted(repo.refs.keys(b'refs/tags'), key=lambda name: (
+        repo[peel_commit(repo, b'refs/tags/' + name)].commit_time, name))
+
+
 class MultiTextCorpus(GitCorpus):
     def get_texts(self):
         length = 0
 
         for entry in self.repo.object_store.iter_tree_contents(self.ref_tree):
             fname = entry.path
-            document = self.repo.object_store.get_raw(entry.sha)[1]
-            if dulwich.patch.is_binary(document):
+            if self._prefilter(fname, entry.mode, entry.sha) is not None:
                 continue
 
-            words = self.preprocess(document, [fname, self.ref])
+            words = self._get_blob_words(entry.sha, [fname, self.ref])
+            if words is None:
+                continue  # binary
+
             length += 1
 
             if self.metadata:
@@ -148,112 +692,745 @@ class MultiTextCorpus(GitCorpus):
             else:
                 yield words
 
+        if self.cache is not None:
+            self.cache.sync()
+
         self.length = length  # only reset after iteration is done.
 
 
-class ChangesetCorpus(GitCorpus):
-    def _get_diff(self, changeset):
-        """ Return a text representing a `git diff` for the files in the
-        changeset.
+class SnapshotCorpus(MultiTextCorpus):
+    """
+    The MultiTextCorpus at each of several refs, as one corpus over them
+    all, each document's id prefixed by its ref, or one ref at a time
+    through `iter_ref`. All of them share one Dictionary.
+
+    Releases share most of their files, so each distinct blob is tokenized
+    only once, and its bag-of-words vector reused by every snapshot that
+    has it. With more than one process, the blobs new to a snapshot are
+    read and tokenized in worker processes. The Dictionary is always built
+    lazily, while iterating.
+    """
+    chunksize = 64  # blobs handed to a worker process at a time
+
+    def __init__(self, repo=None, refs=(), **kwargs):
+        self.refs = [ref.encode('utf-8') if isinstance(ref, unicode) else ref
+                     for ref in refs]
+
+        # blob sha => (term ids, counts) of its vector, or None if binary
+        self._blob_bows = dict()
+
+        kwargs['lazy_dict'] = True
+        if repo is not None and self.refs:
+            kwargs.setdefault('ref', peel_commit(repo, self.refs[-1]))
+
+        super(SnapshotCorpus, self).__init__(repo, **kwargs)
+
+    def _blob_bow(self, sha, info=[], read=None):
+        """ Returns the bag-of-words vector of a blob, or None if it is
+        binary, counting it as one more document in the Dictionary. `read`
+        is the (sha, words) pair of the blob if a worker already read it.
 
         """
-        patch_file = StringIO()
-        dulwich.patch.write_object_diff(patch_file,
-                                        self.repo.object_store,
-                                        changeset.old, changeset.new)
-        return patch_file.getvalue()
+        try:
+            ids, counts = self._blob_bows[sha]
+        except KeyError:
+            if read is None:
+                words = self._get_blob_words(sha, info)
+            else:
+                words = read[1]
+
+            if words is None:
+                self._blob_bows[sha] = (None, None)
+                return None
+
+            with self.profiler.stage('doc2bow') as stage:
+                bow = self.doc2bow(words, allow_update=True)
+                stage.add(count=1)
+
+            self._blob_bows[sha] = (array('l', (i for i, _ in bow)),
+                                    array('l', (c for _, c in bow)))
+            return bow
+
+        if ids is None:
+            return None
 
-    def _walk_changes(self, reverse=False):
-        """ Returns one file change at a time, not the entire diff.
+        with self.profiler.stage('reuse') as stage:
+            bow = zip(ids, counts)
+            count_document(self.id2word, bow)
+            stage.add(count=1)
+
+        return bow
+
+    def _iter_bows(self, ref):
+        """ Yields (path, bag-of-words vector) for the files of the ref. """
+        tree = self.repo[peel_commit(self.repo, ref)].tree
+        entries = [entry for entry
+                   in self.repo.object_store.iter_tree_contents(tree)
+                   if self._prefilter(entry.path, entry.mode,
+                                      entry.sha) is None]
+
+        # blobs not seen in earlier snapshots, in the order first met
+        blobs = list()
+        if self.processes > 1:
+            unseen = set()
+            for entry in entries:
+                if entry.sha not in self._blob_bows and \
+                        entry.sha not in unseen:
+                    unseen.add(entry.sha)
+                    blobs.append((entry.sha, [entry.path, ref]))
+
+        read = self._read_blobs(blobs)
+        for entry in entries:
+            if blobs and entry.sha not in self._blob_bows:
+                bow = self._blob_bow(entry.sha, read=next(read))
+            else:
+                bow = self._blob_bow(entry.sha, [entry.path, ref])
+
+            if bow is not None:
+                yield entry.path, bow
+
+    def _read_blobs(self, blobs):
+        """ Yields (sha, words) for each of the (sha, info) pairs in order,
+        reading and preprocessing them in worker processes.
 
         """
+        if not blobs:
+            return
 
-        for walk_entry in self.repo.get_walker(reverse=reverse):
-            commit = walk_entry.commit
+        options = self._worker_options()
+        tasks = ((self.repo.path, options, blobs[i:i + self.chunksize])
+                 for i in range(0, len(blobs), self.chunksize))
 
-            # initial revision, has no parent
-            if len(commit.parents) == 0:
-                for changes in dulwich.diff_tree.tree_changes(
-                        self.repo.object_store, None, commit.tree
-                ):
-                    diff = self._get_diff(changes)
-                    yield commit.id, None, diff
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            # imap keeps the results in the order of the blobs
+            for results in pool.imap(_blob_worker, tasks):
+                for sha, words in results:
+                    yield sha, self._from_portable(words)
 
-            for parent in commit.parents:
-                # do I need to know the parent id?
+            pool.close()
+            pool.join()
+        finally:
+            pool.terminate()
 
-                for changes in dulwich.diff_tree.tree_changes(
-                    self.repo.object_store, self.repo[parent].tree, commit.tree
-                ):
-                    diff = self._get_diff(changes)
-                    yield commit.id, parent, diff
+    def iter_ref(self, ref):
+        """ Iterates over the documents of a single ref, with (path, u'en')
+        metadata when asked for.
 
-    def get_texts(self):
+        """
         length = 0
-        unified = re.compile(r'^[+ -].*')
-        current = None
-        low = list()  # collecting the list of words
-
-        for commit, parent, diff in self._walk_changes():
-            # write out once all diff lines for commit have been collected
-            # this is over all parents and all files of the commit
-            if current is None:
-                # set current for the first commit, clear low
-                current = commit
-                low = list()
-            elif current != commit:
-                # new commit seen, yield the collected low
+        for fname, bow in self._iter_bows(ref):
+            length += 1
+            if self.metadata:
+                yield bow, (fname, u'en')
+            else:
+                yield bow
+
+        if self.cache is not None:
+            self.cache.sync()
+
+        self.length = length
+
+    def __iter__(self):
+        length = 0
+        for ref in self.refs:
+            for fname, bow in self._iter_bows(ref):
+                length += 1
                 if self.metadata:
-                    yield low, (current, u'en')
+                    yield bow, (ref + ':' + fname, u'en')
                 else:
-                    yield low
+                    yield bow
+
+        if self.cache is not None:
+            self.cache.sync()
+
+        self.length = length
+
+    def get_texts(self):
+        """ Yields the words of every document of every ref. Unlike
+        iterating over the corpus, this does not share the work between
+        snapshots, other than through the token cache.
+
+        """
+        length = 0
+        for ref in self.refs:
+            tree = self.repo[peel_commit(self.repo, ref)].tree
+            for entry in self.repo.object_store.iter_tree_contents(tree):
+                fname = entry.path
+                if self._prefilter(fname, entry.mode, entry.sha) is not None:
+                    continue
+
+                words = self._get_blob_words(entry.sha, [fname, ref])
+                if words is None:
+                    continue  # binary
 
                 length += 1
-                current = commit
-                low = list()
-
-            # to process out whitespace only changes, the rest of this
-            # loop will need to be structured differently. possibly need
-            # to actually parse the diff to gain structure knowledge
-            # (ie, line numbers of the changes).
-
-            diff_lines = filter(lambda x: unified.match(x),
-                                diff.splitlines())
-            if len(diff_lines) < 2:
-                continue  # useful for not worrying with binary files
-
-            # sanity?
-            assert diff_lines[0].startswith('--- '), diff_lines[0]
-            assert diff_lines[1].startswith('+++ '), diff_lines[1]
-            # parent_fn = diff_lines[0][4:]
-            # commit_fn = diff_lines[1][4:]
-
-            lines = diff_lines[2:]  # chop off file names hashtag rebel
-            lines = [line[1:] for line in lines]  # remove unified markers
-            document = ' '.join(lines)
-
-            # call the tokenizer
-            words = self.preprocess(document,
-                                    [commit, str(parent), diff_lines[0]])
+                if self.metadata:
+                    yield words, (ref + ':' + fname, u'en')
+                else:
+                    yield words
+
+        if self.cache is not None:
+            self.cache.sync()
+
+        self.length = length
+
+
+class ChangesetCorpus(GitCorpus):
+    chunksize = 64  # commits handed to a worker process at a time
+    unified = re.compile(r'^[+ -].*')
+
+    def __init__(self, repo=None, ref='HEAD', merges='all',
+                 diff_cache_size=2 ** 20, renames=None, copies=False,
+                 rename_limit=200, max_diff_bytes=None, max_file_tokens=None,
+                 max_commit_tokens=None, include_paths=None,
+                 exclude_paths=None, **kwargs):
+        if merges not in MERGES:
+            raise ValueError('Unknown merge strategy %r, expected one of %s' %
+                             (merges, ', '.join(MERGES)))
+
+        self.merges = merges
+
+        # renames and copies with at least `renames` percent similar content
+        # are diffed against their source rather than tokenized whole. Only
+        # commits with up to `rename_limit` adds and deletes are searched for
+        # inexact renames, as each add is compared with each delete.
+        # `copies` also looks for sources among the unmodified files.
+        self.renames = renames
+        self.copies = copies
+        self.rename_limit = rename_limit
+
+        # budgets against huge commits, such as vendored imports. File
+        # changes whose blobs add up to over `max_diff_bytes` are skipped
+        # before diffing, and the words of a file change, and of a whole
+        # commit, are cut off at `max_file_tokens` and `max_commit_tokens`.
+        # Only paths matching a glob of `include_paths`, if given, and none
+        # of `exclude_paths` are used. Globs match across directories.
+        self.max_diff_bytes = max_diff_bytes
+        self.max_file_tokens = max_file_tokens
+        self.max_commit_tokens = max_commit_tokens
+        self.include_paths = list(include_paths or [])
+        self.exclude_paths = list(exclude_paths or [])
+
+        # commit ids => the budgets they went over, for the last walk
+        self.clipped = dict()
+
+        # words of the file changes seen last, by their (old, new) blobs, so
+        # a change reached again through a merge is not diffed twice. Holds
+        # up to `diff_cache_size` words in all, about 8 bytes each as the
+        # strings themselves are shared, so 8MB by default; a single change
+        # with more words than that is never remembered.
+        self.diff_cache_size = diff_cache_size
+        self._change_words = None
+        if diff_cache_size:
+            self._change_words = LRUCache(max_size=diff_cache_size,
+                                          sizeof=_memo_size)
+
+        super(ChangesetCorpus, self).__init__(repo, ref, **kwargs)
+
+    def _worker_options(self):
+        options = super(ChangesetCorpus, self)._worker_options()
+        options.update(merges=self.merges,
+                       diff_cache_size=self.diff_cache_size,
+                       renames=self.renames,
+                       copies=self.copies,
+                       rename_limit=self.rename_limit,
+                       max_diff_bytes=self.max_diff_bytes,
+                       max_file_tokens=self.max_file_tokens,
+                       max_commit_tokens=self.max_commit_tokens,
+                       include_paths=self.include_paths,
+                       exclude_paths=self.exclude_paths)
+        return options
+
+    def _rename_detector(self):
+        """ Returns a RenameDetector as configured, or None when renames are
+        not to be detected.
+
+        """
+        if self.renames is None and not self.copies:
+            return None
+
+        threshold = self.renames
+        if threshold is None:
+            threshold = RENAME_THRESHOLD
+
+        return RenameDetector(self.repo.object_store,
+                              rename_threshold=threshold,
+                              max_files=self.rename_limit,
+                              find_copies_harder=self.copies)
+
+    def _get_walker(self, reverse=False):
+        walker = super(ChangesetCorpus, self)._get_walker(reverse=reverse)
+        if self.merges != 'first-parent':
+            return walker
+
+        mainline = self._first_parents()
+        return (walk_entry for walk_entry in walker
+                if walk_entry.commit.id in mainline)
+
+    def _first_parents(self):
+        """ Returns the set of commits reached from the ref, where the walk
+        starts, by following first parents only.
+
+        """
+        mainline = set()
+        commit_id = self._ref_commit()
+        while commit_id is not None and commit_id not in mainline:
+            mainline.add(commit_id)
+            parents = self.repo[commit_id].parents
+            commit_id = parents[0] if parents else None
+
+        return mainline
+
+    def _iter_diff_lines(self, changes):
+        """ Yields the added, removed and context lines of a file change,
+        without their unified markers, straight off of the diff as it is
+        generated. Yields nothing for binary files.
+
+        """
+        def content(mode, hexsha):
+            if hexsha is None:
+                return Blob.from_string(b'')
+            elif S_ISGITLINK(mode):
+                return Blob.from_string(b"Subproject commit " + hexsha + b"\n")
+            else:
+                return self.repo.object_store[hexsha]
+
+        (old_path, old_mode, old_sha) = changes.old
+        (new_path, new_mode, new_sha) = changes.new
+        if self._binary.get(old_sha) or self._binary.get(new_sha):
+            return
+
+        old_content = content(old_mode, old_sha)
+        new_content = content(new_mode, new_sha)
+
+        binary = False
+        for mode, sha, blob in [(old_mode, old_sha, old_content),
+                                (new_mode, new_sha, new_content)]:
+            is_binary = dulwich.patch.is_binary(blob.data)
+            if sha is not None and not S_ISGITLINK(mode):
+                self._binary[sha] = is_binary
+
+            binary = binary or is_binary
+
+        if binary:
+            return
+
+        diff = dulwich.patch.unified_diff(old_content.splitlines(),
+                                          new_content.splitlines())
+
+        # to process out whitespace only changes, the rest of this
+        # will need to be structured differently. possibly need
+        # to actually parse the diff to gain structure knowledge
+        # (ie, line numbers of the changes).
+
+        headers = 2  # chop off file names hashtag rebel
+        for diff_line in diff:
+            for line in diff_line.splitlines():
+                if not self.unified.match(line):
+                    continue  # hunk headers, no newline markers
+
+                if headers:
+                    headers -= 1
+                    continue
+
+                yield line[1:]  # remove unified markers
+
+    def _get_changes(self, commit):
+        """ Returns one file change at a time for a single commit, over all
+        of its parents.
+
+        """
+        parents = commit.parents
+        detector = self._rename_detector()
+
+        # initial revision, has no parent
+        if len(parents) == 0:
+            for changes in dulwich.diff_tree.tree_changes(
+                    self.repo.object_store, None, commit.tree
+            ):
+                yield None, changes
+
+        if len(parents) > 1:
+            if self.merges == 'skip':
+                return
+
+            elif self.merges == 'first-parent':
+                parents = parents[:1]
+
+            elif self.merges == 'combined':
+                trees = [self.repo[parent].tree for parent in parents]
+                for per_parent in dulwich.diff_tree.tree_changes_for_merge(
+                    self.repo.object_store, trees, commit.tree,
+                    rename_detector=detector
+                ):
+                    # the same path, against the first parent that has it
+                    for parent, changes in zip(parents, per_parent):
+                        if changes is not None:
+                            yield parent, changes
+                            break
+
+                return
+
+        for parent in parents:
+            # do I need to know the parent id?
+
+            for changes in dulwich.diff_tree.tree_changes(
+                self.repo.object_store, self.repo[parent].tree, commit.tree,
+                rename_detector=detector
+            ):
+                yield parent, changes
+
+    def _get_change_words(self, commit, parent, changes, limit=None):
+        """ Returns at most `limit` of the words of the lines touched by a
+        single file change, along with whether any were cut off, remembering
+        the most recent ones in memory.
+
+        Only changes that were read in full are remembered. A bag of them
+        has lost the order to clip it in, so one over the limit is read
+        again.
+
+        """
+        if self._change_words is None:
+            return self._read_change_words(commit, parent, changes, limit)
+
+        key = (changes.old.sha, changes.new.sha)
+        try:
+            with self.profiler.stage('memo') as stage:
+                words = self._change_words[key]
+                stage.add(count=1)
+        except KeyError:
+            pass
+        else:
+            if words is None or limit is None:
+                return words, False
+            elif not isinstance(words, BagOfTokens):
+                return _clip(words, limit)
+            elif words.total() <= limit:
+                return words, False
+
+        words, cut = self._read_change_words(commit, parent, changes, limit)
+        if words is not None and not isinstance(words, BagOfTokens):
+            words = list(words)
+
+        if not cut:
+            self._change_words[key] = words
+
+        return words, cut
+
+    def _read_change_words(self, commit, parent, changes, limit=None):
+        """ Returns at most `limit` of the words of the lines touched by a
+        single file change, along with whether any were cut off.
+
+        Files that were added or deleted outright are tokenized as whole
+        blobs, which gives the same words as their diff and shares them with
+        the MultiTextCorpus through the cache. Detected renames and copies
+        have both blobs, so only their edits are tokenized.
+
+        """
+        (old_path, old_mode, old_sha) = changes.old
+        (new_path, new_mode, new_sha) = changes.new
+        gitlink = (old_mode is not None and S_ISGITLINK(old_mode) or
+                   new_mode is not None and S_ISGITLINK(new_mode))
+
+        if not gitlink:
+            if old_sha is None:
+                return self._cached_clip('blob:' + new_sha, self._blob_reader(
+                    new_sha, [commit, new_path]), limit)
+            elif new_sha is None:
+                return self._cached_clip('blob:' + old_sha, self._blob_reader(
+                    old_sha, [commit, old_path]), limit)
+
+        def get_words(ordered):
+            lines = self._iter_diff_lines(changes)
+            if self.profiler.enabled:
+                with self.profiler.stage('diff') as stage:
+                    lines = list(lines)
+                    stage.add(count=1, nbytes=sum(len(x) for x in lines))
+
+            return self.preprocess_lines(lines, [commit, str(parent)], ordered)
+
+        key = None if gitlink else 'diff:%s:%s' % (old_sha, new_sha)
+        return self._cached_clip(key, get_words, limit)
+
+    def _get_commit_words(self, commit):
+        """ Returns the list of words collected over all parents and all
+        files of the commit, or None if the commit changed no files. When
+        interning, a BagOfTokens of them instead.
+
+        Words over a budget are clipped in the order they were produced, and
+        commits that go over one are noted in `self.clipped`.
+
+        """
+        low = None
+        used = 0
+        clipped = set()
+
+        for parent, changes in self._get_changes(commit):
+            if not self._wanted(changes):
+                continue
+
+            if low is None:
+                # collecting the list of words
+                low = BagOfTokens() if self.intern_tokens else list()
+
+            if self._prefilter_change(changes) is not None:
+                continue
+
+            if (self.max_diff_bytes is not None and
+                    self._change_size(changes) > self.max_diff_bytes):
+                clipped.add('diff-bytes')
+                continue
+
+            if (self.max_commit_tokens is not None and
+                    used >= self.max_commit_tokens):
+                clipped.add('commit-tokens')
+                break
+
+            limit = self.max_file_tokens
+            if self.max_commit_tokens is not None:
+                remaining = self.max_commit_tokens - used
+                if limit is None or remaining < limit:
+                    limit = remaining
+
+            words, cut = self._get_change_words(commit.id, parent, changes,
+                                                limit)
+            if words is None:
+                continue
+
+            if cut:
+                if limit == self.max_file_tokens:
+                    clipped.add('file-tokens')
+                else:
+                    clipped.add('commit-tokens')
+
+            if self.max_commit_tokens is not None:
+                used += _count(words)
+
             low.extend(words)
 
-        length += 1
-        if self.metadata:
-            # have reached the end, yield whatever was collected last
-            yield low, (current, u'en')
+        if clipped:
+            self.clipped[commit.id] = sorted(clipped)
+
+        return low
+
+    def _wanted(self, changes):
+        """ Whether the path of a file change passes the path globs. """
+        if not self.include_paths and not self.exclude_paths:
+            return True
+
+        path = changes.new.path or changes.old.path
+        if self.include_paths and not any(fnmatch.fnmatch(path, glob)
+                                          for glob in self.include_paths):
+            return False
+
+        return not any(fnmatch.fnmatch(path, glob)
+                       for glob in self.exclude_paths)
+
+    def _prefilter_change(self, changes):
+        """ Returns why a file change can be skipped without reading its
+        blobs, or None. Submodule updates are kept, as the diff of their
+        commit ids.
+
+        """
+        for path, mode, sha in [changes.old, changes.new]:
+            if sha is None or S_ISGITLINK(mode):
+                continue
+
+            reason = self._prefilter(path, mode, sha)
+            if reason is not None:
+                return reason
+
+        return None
+
+    def _change_size(self, changes):
+        """ Returns the bytes of the old and new blobs of a file change. """
+        size = 0
+        for mode, sha in [(changes.old.mode, changes.old.sha),
+                          (changes.new.mode, changes.new.sha)]:
+            if sha is not None and not S_ISGITLINK(mode):
+                size += self._blob_size(sha)
+
+        return size
+
+    def get_commit_texts(self, commit_ids):
+        """ Returns (commit id, list of words) pairs for only the given
+        commits, skipping any that changed no files.
+
+        """
+        for commit_id in commit_ids:
+            words = self._get_commit_words(self.repo[commit_id])
+            if words is not None:
+                yield commit_id, words
+
+    def _walk_commit_ids(self):
+        """ Returns the commit ids of the walk in chunks, for handing out to
+        the worker processes.
+
+        """
+        chunk = list()
+        for walk_entry in self._get_walker():
+            chunk.append(walk_entry.commit.id)
+            if len(chunk) == self.chunksize:
+                yield chunk
+                chunk = list()
+
+        if chunk:
+            yield chunk
+
+    def _walk_commit_words(self):
+        """ Returns (commit id, list of words) pairs in walk order, diffing
+        the commits in worker processes if asked to.
+
+        """
+        if self.processes > 1:
+            options = self._worker_options()
+            tasks = ((self.repo.path, options, chunk)
+                     for chunk in self._walk_commit_ids())
+
+            pool = multiprocessing.Pool(self.processes)
+            try:
+                # imap keeps the results in the order of the walk
+                for results in pool.imap(_changeset_worker, tasks):
+                    for commit_id, low, clipped in results:
+                        if clipped:
+                            self.clipped[commit_id] = clipped
+
+                        yield commit_id, self._from_portable(low)
+
+                pool.close()
+                pool.join()
+            finally:
+                pool.terminate()
         else:
-            yield low
+            for walk_entry in self._get_walker():
+                commit = walk_entry.commit
+                yield commit.id, self._get_commit_words(commit)
+
+    def get_texts(self):
+        length = 0
+        self.clipped = dict()
+
+        for commit, low in self._walk_commit_words():
+            if low is None:
+                continue  # nothing changed, nothing to write out
+
+            length += 1
+            if self.metadata:
+                yield low, (commit, u'en')
+            else:
+                yield low
+
+        if self.cache is not None:
+            self.cache.sync()
+
+        if self.clipped:
+            logger.warning('Clipped %d commits over their budgets' %
+                           len(self.clipped))
+            for commit, budgets in sorted(self.clipped.items()):
+                logger.info('Clipped %s: %s' % (commit, ', '.join(budgets)))
 
         self.length = length  # only reset after iteration is done.
 
 
+def _clip(words, limit):
+    """ Returns at most `limit` of the words, taken in order from any
+    iterable, as a list, along with whether any were cut off. Reads no
+    more than one word past the limit.
+
+    """
+    words = list(itertools.islice(words, limit + 1))
+    if len(words) > limit:
+        return words[:limit], True
+
+    return words, False
+
+
+def _memo_size(words):
+    """ Returns how many words a remembered change holds: distinct ones for
+    a BagOfTokens, which keeps one count per word.
+
+    """
+    if words is None:
+        return 1
+
+    return len(words)
+
+
+def _count(words):
+    if isinstance(words, BagOfTokens):
+        return words.total()
+
+    return len(words)
+
+
+# worker processes keep their repo and corpus around between chunks
+_worker_corpora = dict()
+
+
+def _changeset_worker(args):
+    """ Diffs and preprocesses a chunk of commits in a worker process,
+    returning (commit id, list of words, budgets gone over) triples in the
+    order given.
+
+    """
+    path, options, commit_ids = args
+    key = (path, repr(sorted(options.items())))
+    if key not in _worker_corpora:
+        corpus = ChangesetCorpus(**options)
+        corpus.repo = dulwich.repo.Repo(path)
+        _worker_corpora[key] = corpus
+
+    corpus = _worker_corpora[key]
+    results = list()
+    for commit_id in commit_ids:
+        low = corpus._get_commit_words(corpus.repo[commit_id])
+        results.append((commit_id, corpus._portable(low),
+                        corpus.clipped.pop(commit_id, None)))
+
+    if corpus.cache is not None:
+        corpus.cache.sync()
+
+    return results
+
+
+def _blob_worker(args):
+    """ Reads and preprocesses a chunk of blobs in a worker process,
+    returning (sha, list of words) pairs in the order given, with None for
+    the words of binary blobs.
+
+    """
+    path, options, blobs = args
+    key = ('blob', path, repr(sorted(options.items())))
+    if key not in _worker_corpora:
+        corpus = MultiTextCorpus(**options)
+        corpus.repo = dulwich.repo.Repo(path)
+        _worker_corpora[key] = corpus
+
+    corpus = _worker_corpora[key]
+    results = list()
+    for sha, info in blobs:
+        words = corpus._get_blob_words(sha, info)
+        if words is not None and not isinstance(words, BagOfTokens):
+            words = list(words)  # read lazily otherwise
+
+        results.append((sha, corpus._portable(words)))
+
+    if corpus.cache is not None:
+        corpus.cache.sync()
+
+    return results
+
+
 class CommitLogCorpus(GitCorpus):
     def get_texts(self):
         length = 0
 
-        for walk_entry in self.repo.get_walker():
+        for walk_entry in self._get_walker():
             commit = walk_entry.commit
-            words = self.preprocess(commit.message, [commit.id])
+            words = self._cached('commit:' + commit.id,
+                                 lambda ordered: self.preprocess(
+                                     commit.message, [commit.id], ordered))
 
             length += 1
             if self.metadata:
@@ -262,4 +1439,7 @@ class CommitLogCorpus(GitCorpus):
             else:
                 yield words
 
+        if self.cache is not None:
+            self.cache.sync()
+
         self.length = length  # only reset after iteration is done.
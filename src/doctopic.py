@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+"""
+Code for inferring and storing the topics of each document of a corpus.
+
+The document-topic matrix (theta) of a corpus under a model is stored next
+to the model, one row per document id, so that evaluations can be re-run
+without repeating inference. A store is thrown away when the model file it
+was inferred with changes, and only documents missing from it are inferred
+when the corpus grows.
+"""
+
+import os
+import time
+
+import numpy
+
+from corpora import peel_commit
+
+import logging
+logger = logging.getLogger('mct.doctopic')
+
+THETA_DTYPE = numpy.float32
+
+
+def model_signature(model_fname):
+    """ Identifies the saved state of a model by its file's size and
+    modification time.
+
+    """
+    stat = os.stat(model_fname)
+    return numpy.array([stat.st_size, stat.st_mtime], dtype=numpy.float64)
+
+
+def infer(model, docs, chunksize=256):
+    """ Returns the normalized topic distributions of a list of documents,
+    running inference a chunk of documents at a time.
+
+    """
+    theta = numpy.zeros((len(docs), model.num_topics), dtype=THETA_DTYPE)
+    for start in range(0, len(docs), chunksize):
+        gamma, _ = model.inference(docs[start:start + chunksize])
+        theta[start:start + len(gamma)] = gamma / gamma.sum(axis=1)[:, None]
+
+    return theta
+
+
+def resolve_commits(repo, revisions):
+    """
+    Returns the commit ids named by a list of revisions, without duplicates.
+    A revision is anything `corpora.peel_commit` reads, such as a short
+    ref, abbreviated commit id, tag or HEAD~2, or a range `A..B` of the
+    commits reachable from B but not from A, which are listed oldest first.
+    """
+    commit_ids = list()
+    seen = set()
+
+    for revision in revisions:
+        if isinstance(revision, unicode):
+            revision = revision.encode('utf-8')
+
+        if '..' in revision:
+            start, end = revision.split('..', 1)
+            walker = repo.get_walker(
+                include=[peel_commit(repo, end or 'HEAD')],
+                exclude=[peel_commit(repo, start or 'HEAD')], reverse=True)
+            ids = [walk_entry.commit.id for walk_entry in walker]
+        else:
+            ids = [peel_commit(repo, revision)]
+
+        for commit_id in ids:
+            if commit_id not in seen:
+                seen.add(commit_id)
+                commit_ids.append(commit_id)
+
+    return commit_ids
+
+
+def infer_commits(model, corpus, commit_ids, batch_size=256):
+    """
+    Preprocesses the given commits as the ChangesetCorpus `corpus` would,
+    and infers their topics a batch at a time. Words missing from the
+    corpus' Dictionary are dropped.
+
+    Yields the commit ids and theta matrix of each batch, logging the
+    throughput of each. Commits that changed no files are skipped.
+    """
+    for start in range(0, len(commit_ids), batch_size):
+        batch = commit_ids[start:start + batch_size]
+        began = time.time()
+
+        ids, docs = list(), list()
+        for commit_id, words in corpus.get_commit_texts(batch):
+            ids.append(commit_id)
+            docs.append(corpus.doc2bow(words))
+
+        preprocessed = time.time()
+        theta = infer(model, docs, chunksize=batch_size)
+        done = time.time()
+
+        elapsed = done - began
+        logger.info('Inferred topics of %d commits in %.3fs '
+                    '(%.3fs preprocessing, %.1f commits/s)' %
+                    (len(ids), elapsed, preprocessed - began,
+                     len(ids) / elapsed if elapsed > 0 else 0.0))
+
+        yield ids, theta
+
+
+def write_theta(f, ids, theta):
+    """ Writes one `id<TAB>p0<TAB>p1...` line of topic proportions per
+    document.
+
+    """
+    for id_, row in zip(ids, theta):
+        f.write('\t'.join([id_] + ['%.6f' % p for p in row]) + '\n')
+
+
+class DocTopicStore(object):
+    """
+    Document-topic matrix of a corpus under a model, kept in `fname`.
+    """
+
+    def __init__(self, fname, model_fname):
+        self.fname = fname
+        self.model_fname = model_fname
+        self.ids = list()
+        self.theta = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.fname):
+            return
+
+        with numpy.load(self.fname) as data:
+            signature = data['signature']
+            if not numpy.array_equal(signature,
+                                     model_signature(self.model_fname)):
+                logger.info('Model changed since %s, inferring again' %
+                            self.fname)
+                return
+
+            self.ids = [unicode(id_) for id_ in data['ids']]
+            self.theta = data['theta']
+
+    def save(self):
+        tmp_fname = self.fname + '.tmp'
+        with open(tmp_fname, 'wb') as f:
+            numpy.savez(f,
+                        signature=model_signature(self.model_fname),
+                        ids=numpy.array(self.ids, dtype=numpy.unicode_),
+                        theta=self.theta)
+
+        os.rename(tmp_fname, self.fname)
+
+    def update(self, model, corpus, chunksize=256):
+        """ Infers the topics of every document of the corpus not yet in the
+        store, saving it if any were added. Returns the ids and theta matrix
+        of the whole store.
+
+        """
+        known = set(self.ids)
+        ids, docs = list(), list()
+
+        corpus.metadata = True
+        for doc, meta in corpus:
+            id_ = meta[0]
+            if not isinstance(id_, unicode):
+                id_ = unicode(str(id_), 'utf-8')
+
+            if id_ not in known:
+                known.add(id_)
+                ids.append(id_)
+                docs.append(doc)
+
+        corpus.metadata = False
+
+        if docs:
+            logger.info('Inferring topics of %d documents for %s' %
+                        (len(docs), self.fname))
+            theta = infer(model, docs, chunksize=chunksize)
+            if self.theta is not None:
+                theta = numpy.vstack([self.theta, theta])
+
+            self.ids.extend(ids)
+            self.theta = theta
+            self.save()
+        elif self.theta is None:
+            self.theta = numpy.zeros((0, model.num_topics), dtype=THETA_DTYPE)
+
+        return self.ids, self.theta
+
+
+def topic_ranks(theta, minimum_probability=0.01):
+    """
+    Returns the rank of each topic in each row of theta, ordered by
+    decreasing probability with ties broken towards the higher topic id, as
+    in reversed(sorted(model[doc])). Topics below `minimum_probability` are
+    not ranked and get -1.
+    """
+    theta = numpy.asarray(theta)
+    order = numpy.argsort(theta, axis=1, kind='mergesort')[:, ::-1]
+
+    ranks = numpy.empty(theta.shape, dtype=numpy.int64)
+    rows = numpy.arange(theta.shape[0])[:, None]
+    ranks[rows, order] = numpy.arange(theta.shape[1])[None, :]
+
+    ranks[theta < minimum_probability] = -1
+    return ranks
+
+
+def first_shared(theta1, theta2, minimum_probability=0.01, maximum=101):
+    """
+    For each pair of rows of theta1 and theta2, returns the lowest rank by
+    which a topic ranked in both rows has appeared in both, or `maximum`
+    when the rows share no topic.
+    """
+    ranks1 = topic_ranks(theta1, minimum_probability)
+    ranks2 = topic_ranks(theta2, minimum_probability)
+
+    shared = (ranks1 >= 0) & (ranks2 >= 0)
+    rank = numpy.where(shared, numpy.maximum(ranks1, ranks2), maximum)
+    return numpy.minimum(rank.min(axis=1), maximum)
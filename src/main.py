@@ -10,37 +10,177 @@
 import csv
 import sys
 import os.path
-import random
+import copy
+import glob
+import multiprocessing
+import shutil
 from collections import namedtuple
 
-import numpy
 import click
-import dulwich
-import dulwich.repo
-from gensim.corpora import MalletCorpus, Dictionary
-from gensim.models import LdaModel
 
-import utils
-from corpora import MultiTextCorpus, ChangesetCorpus, CommitLogCorpus
+from profiling import Profiler, NULL_PROFILER
 
+# gensim, numpy, dulwich and the modules built on them are slow to import,
+# so they are imported by the commands that use them, keeping the CLI quick
+# to start.
 
 import logging
 
 logger = logging.getLogger('mct')
 
 
-class Config:
+class Config(object):
     def __init__(self):
         self.path = './'
         self.project = None
-        self.repo = None
+        self._repo = None
         self.corpus_fname = ''
         self.model_fname = ''
         self.passes = 10
         self.num_topics = 100
         self.alpha = 'symmetric'  # or can set a float
+        self.workers = 1
+        self.cache = None
+        self.folds = 10  # one fold is held out for perplexity
+        self.cross_validate = False
+        self.seed = 0
+        self.profiler = NULL_PROFILER
+        self.artifacts = None  # an ArtifactStore, to name files by inputs
+        # options of every corpus built, handed to the corpus classes
+        self.corpus_options = dict(remove_stops=True, split=True, lower=True,
+                                   min_len=3, max_len=40,
+                                   max_blob_bytes=None, text_extensions=[],
+                                   skip_extensions=None)
+        # options only changeset corpora take: how to treat merges, rename
+        # detection, and the budgets and paths of the changes used
+        self.changeset_options = dict(merges='all', renames=None,
+                                      copies=False, rename_limit=200,
+                                      max_diff_bytes=None,
+                                      max_file_tokens=None,
+                                      max_commit_tokens=None,
+                                      include_paths=[], exclude_paths=[])
+        self.intern_tokens = False  # documents as counts of interned ids
+        self.snapshot_refs = []  # refs the snapshot corpora are taken at
         # set all possible config options here
 
+    @property
+    def repo(self):
+        """ The project's repository, opened when first needed. """
+        if self._repo is None and self.project is not None:
+            import dulwich.errors
+            import dulwich.repo
+
+            git_path = self.path + self.project.name
+            try:
+                self._repo = dulwich.repo.Repo(git_path)
+            except dulwich.errors.NotGitRepository:
+                error('Repository not cloned yet! Clone command: '
+                      'git clone %s %s' % (self.project.url, git_path))
+
+        return self._repo
+
+    @repo.setter
+    def repo(self, repo):
+        self._repo = repo
+
+    def corpus_kwargs(self, Kind):
+        """ Options handed to the class of a corpus of this kind. """
+        from corpora import ChangesetCorpus, SnapshotCorpus
+
+        kwargs = dict(self.corpus_options, intern_tokens=self.intern_tokens)
+        if issubclass(Kind, ChangesetCorpus):
+            kwargs.update(self.changeset_options)
+
+        if issubclass(Kind, SnapshotCorpus):
+            kwargs.update(refs=list(self.snapshot_refs))
+
+        return kwargs
+
+    def kind_name(self, Kind):
+        """ Name of a corpus of this kind within plain file names. """
+        kwargs = self.corpus_kwargs(Kind)
+        name = Kind.__name__
+
+        merges = kwargs.get('merges', 'all')
+        if merges != 'all':
+            name += '-' + merges
+
+        if kwargs.get('renames') is not None:
+            name += '-renames%d' % kwargs['renames']
+
+        if kwargs.get('copies'):
+            name += '-copies'
+
+        budgets = [kwargs.get(key) for key in ['max_diff_bytes',
+                                               'max_file_tokens',
+                                               'max_commit_tokens',
+                                               'include_paths',
+                                               'exclude_paths']]
+        if any(budgets):
+            import hashlib
+            name += '-budget' + hashlib.sha1(repr(budgets)).hexdigest()[:8]
+
+        if kwargs.get('refs'):
+            import hashlib
+            name += '-' + hashlib.sha1(repr(kwargs['refs'])).hexdigest()[:8]
+
+        return name
+
+    def corpus_inputs(self, Kind):
+        """ Everything that affects what a corpus of this kind holds. """
+        from corpora import STOP_FILES, SKIP_EXTENSIONS, peel_commit
+        import artifacts
+
+        # interning changes how documents are held, not what they hold
+        options = self.corpus_kwargs(Kind)
+        del options['intern_tokens']
+
+        if options.get('skip_extensions') is None:
+            options['skip_extensions'] = SKIP_EXTENSIONS
+
+        commit = self.project.commit
+        if options.get('refs'):
+            # tags can be moved, what they point at is what counts
+            commit = [peel_commit(self.repo, ref) for ref in options['refs']]
+
+        return dict(artifact='corpus',
+                    kind=Kind.__name__,
+                    commit=commit,
+                    options=options,
+                    stops=artifacts.file_digest(STOP_FILES))
+
+    def model_inputs(self, Kind):
+        """ Everything that affects a model trained on a corpus of this
+        kind.
+
+        """
+        return dict(artifact='model',
+                    corpus=self.artifacts.key(self.corpus_inputs(Kind)),
+                    passes=self.passes,
+                    alpha=self.alpha,
+                    num_topics=self.num_topics)
+
+    def get_corpus_fname(self, Kind, create=False):
+        """ Name of the corpus file of this kind. With an artifact store,
+        its artifact is only created when `create` is set, to write it.
+
+        """
+        if self.artifacts is None:
+            return self.corpus_fname % self.kind_name(Kind)
+
+        return self.artifacts.path(self.corpus_inputs(Kind), 'corpus.mallet',
+                                   meta=dict(project=self.project.name),
+                                   create=create)
+
+    def get_model_fname(self, Kind, create=False):
+        """ Name of the model file of this kind, see get_corpus_fname. """
+        if self.artifacts is None:
+            return self.model_fname % self.kind_name(Kind)
+
+        return self.artifacts.path(self.model_inputs(Kind), 'model.lda',
+                                   meta=dict(project=self.project.name),
+                                   create=create)
+
 
 def error(msg, errorno=1):
     logger.error(msg)
@@ -52,12 +192,66 @@ pass_config = click.make_pass_decorator(Config, ensure=True)
 
 @click.group()
 @click.option('--num-topics', default=100)
+@click.option('--workers', default=1,
+              help="Number of processes to spread the work over")
+@click.option('--token-cache', default=None,
+              help="File to cache preprocessed tokens in between runs")
+@click.option('--token-cache-size', default=1024,
+              help="Size cap of the token cache, in megabytes")
+@click.option('--profile', is_flag=True,
+              help="Time each stage of corpus building and report it")
+@click.option('--profile-output', default=None,
+              help="File to also write the profile to, as JSON")
+@click.option('--artifacts', default=None,
+              help="Directory to keep corpora and models in, named by the "
+                   "hash of everything they are built from")
+@click.option('--artifacts-size', default=None, type=int,
+              help="Size cap of the artifacts directory, in megabytes")
+@click.option('--merges', default='all',
+              type=click.Choice(['all', 'first-parent', 'combined', 'skip']),
+              help="How changesets treat merge commits: diffed against all "
+                   "parents, the first parent only (walking first parents "
+                   "alone), only paths differing from every parent, or "
+                   "skipped. Changes are remembered for when a merge "
+                   "reaches them again, which costs up to about 8MB per "
+                   "process")
+@click.option('--renames', default=None, type=click.IntRange(0, 100),
+              help="Diff files renamed with at least this percent of their "
+                   "content kept against their old selves")
+@click.option('--copies', is_flag=True,
+              help="Also diff copies against the files they were copied "
+                   "from, unmodified ones included")
+@click.option('--rename-limit', default=200,
+              help="Most adds or deletes in a commit to search for renames "
+                   "among")
+@click.option('--max-diff-bytes', default=None, type=int,
+              help="Skip file changes whose old and new contents are larger "
+                   "than this, together")
+@click.option('--max-file-tokens', default=None, type=int,
+              help="Cut the words of a file change off at this many")
+@click.option('--max-commit-tokens', default=None, type=int,
+              help="Cut the words of a commit off at this many")
+@click.option('--include-path', multiple=True,
+              help="Glob of the paths to use changes of, may be repeated")
+@click.option('--exclude-path', multiple=True,
+              help="Glob of the paths to ignore changes of, may be repeated")
+@click.option('--max-blob-bytes', default=None, type=int,
+              help="Skip files larger than this, going by the object header")
+@click.option('--text-extension', multiple=True,
+              help="Only read files with this extension, may be repeated")
+@click.option('--intern-tokens', is_flag=True,
+              help="Hold documents as counts of interned word ids rather "
+                   "than lists of words, to save memory on large commits")
 @click.option('--verbose', is_flag=True)
 @click.option('--path', default='data/',
               help="Set the directory to work within")
 @click.argument('project')
 @pass_config
-def main(config, verbose, path, project, num_topics):
+def main(config, verbose, path, project, num_topics, workers,
+         token_cache, token_cache_size, profile, profile_output,
+         artifacts, artifacts_size, merges, renames, copies, rename_limit,
+         max_diff_bytes, max_file_tokens, max_commit_tokens, include_path,
+         exclude_path, max_blob_bytes, text_extension, intern_tokens):
     """
     Modeling Changeset Topics
     """
@@ -71,35 +265,106 @@ def main(config, verbose, path, project, num_topics):
         logging.root.setLevel(level=logging.INFO)
 
     # Only set config items here, this function is unused otherwise.
+    setup_config(config, project, path)
+
+    config.num_topics = num_topics
+    config.workers = workers
+    config.changeset_options.update(merges=merges,
+                                    renames=renames,
+                                    copies=copies,
+                                    rename_limit=rename_limit,
+                                    max_diff_bytes=max_diff_bytes,
+                                    max_file_tokens=max_file_tokens,
+                                    max_commit_tokens=max_commit_tokens,
+                                    include_paths=list(include_path),
+                                    exclude_paths=list(exclude_path))
+    config.intern_tokens = intern_tokens
+    config.corpus_options.update(max_blob_bytes=max_blob_bytes,
+                                 text_extensions=list(text_extension))
+
+    if token_cache is not None:
+        from cache import TokenCache
+        config.cache = TokenCache(token_cache,
+                                  max_bytes=token_cache_size * 1024 * 1024)
+
+    if artifacts is not None:
+        from artifacts import ArtifactStore
+        config.artifacts = ArtifactStore(artifacts)
+
+        if artifacts_size is not None:
+            max_bytes = artifacts_size * 1024 * 1024
+            click.get_current_context().call_on_close(
+                lambda: config.artifacts.gc(max_bytes))
+
+    if profile or profile_output:
+        def emit(profiler):
+            logger.info('Profile:\n%s' % profiler.report())
+            if profile_output is not None:
+                profiler.dump(profile_output)
+
+        config.profiler = Profiler(callback=emit)
+        click.get_current_context().call_on_close(config.profiler.emit)
+
+        if workers > 1:
+            logger.warning('Only the main process is profiled, '
+                           'run with --workers 1 for a full profile')
+
+
+def setup_config(config, project, path='data/'):
+    """ Points the config at a project listed in projects.csv, with its files
+    kept under `path`.
+
+    """
     config.path = path
     if not config.path.endswith('/'):
         config.path += '/'
 
-    utils.mkdir(config.path)
+    if not os.path.isdir(config.path):
+        import utils
+        utils.mkdir(config.path)
+
+    config.project = find_project(project)
+    if config.project is None:
+        error("Could not find '%s' in 'projects.csv'!" % project)
+
+    set_filenames(config)
+
 
-    with open("projects.csv", 'r') as f:
+def read_projects(projects_fname='projects.csv'):
+    """ Returns every row of the projects file, each as a Project namedtuple
+    of its columns.
+
+    """
+    with open(projects_fname, 'r') as f:
         reader = csv.reader(f)
         header = next(reader)
         Project = namedtuple('Project',  ' '.join(header))
+        return [Project(*row) for row in reader]
+
 
-        # figure out which column index contains the project name
-        name_idx = header.index("name")
+def find_project(name, projects_fname='projects.csv'):
+    """ Returns the row of the projects file for the named project, as a
+    Project namedtuple of its columns, or None if it is not listed.
+
+    """
+    # find the project in the csv
+    for project in read_projects(projects_fname):
+        if name == project.name:
+            # 🎶  do you believe in magicccccc
+            # in a young girl's heart? 🎶
+            return project
 
-        # find the project in the csv, adding it's info to config
-        for row in reader:
-            if project == row[name_idx]:
-                # 🎶  do you believe in magicccccc
-                # in a young girl's heart? 🎶
-                config.project = Project(*row)
-                break
+    # we can access project info by:
+    #    config.project.url => "http://..."
+    #    config.project.name => "Blah Name"
+    return None
 
-        # we can access project info by:
-        #    config.project.url => "http://..."
-        #    config.project.name => "Blah Name"
 
-        if config.project is None:
-            error("Could not find '%s' in 'projects.csv'!" % project)
+def set_filenames(config):
+    """ Sets the corpus and model filename patterns of the config's project,
+    each with a %s left for the corpus kind.
 
+    """
     config.corpus_fname = (config.path +
                            config.project.name + '-' +
                            config.project.commit[:8] + '-' +
@@ -113,30 +378,48 @@ def main(config, verbose, path, project, num_topics):
                           str(config.num_topics) + 'topics-' +
                           '%s.lda')
 
-    config.num_topics = num_topics
-
-    git_path = config.path + config.project.name
-    # open the repo
-    try:
-        config.repo = dulwich.repo.Repo(git_path)
-    except dulwich.errors.NotGitRepository:
-        error('Repository not cloned yet! Clone command: '
-              'git clone %s %s' % (config.project.url, git_path))
-
 
 @main.command()
+@click.option('--incremental', is_flag=True,
+              help="Only add commits missing from the last built corpora")
 @pass_config
 @click.pass_context
-def corpora(context, config):
+def corpora(context, config, incremental):
     """
     Builds the basic corpora for a project
     """
+    from corpora import MultiTextCorpus, ChangesetCorpus, CommitLogCorpus
 
     logger.info('Creating corpora for: %s' % config.project.name)
 
     create_corpus(config, MultiTextCorpus)
-    create_corpus(config, ChangesetCorpus)
-    create_corpus(config, CommitLogCorpus)
+    create_corpus(config, ChangesetCorpus, incremental=incremental)
+    create_corpus(config, CommitLogCorpus, incremental=incremental)
+
+
+@main.command()
+@click.argument('refs', nargs=-1)
+@click.option('--combined', is_flag=True,
+              help="Write one corpus of every snapshot, rather than one "
+                   "per ref")
+@pass_config
+@click.pass_context
+def snapshots(context, config, refs, combined):
+    """
+    Builds the source corpus at several refs, every tag by default
+    """
+    from corpora import tag_refs
+
+    if not refs:
+        refs = tag_refs(config.repo)
+        if not refs:
+            error('No refs given, and the repository has no tags!')
+
+    config.snapshot_refs = list(refs)
+    logger.info('Creating snapshot corpora of %s at %d refs' %
+                (config.project.name, len(refs)))
+
+    create_snapshots(config, combined=combined)
 
 
 @main.command()
@@ -146,11 +429,11 @@ def model(context, config):
     """
     Builds a model for the corpora
     """
+    from corpora import MultiTextCorpus, ChangesetCorpus, CommitLogCorpus
     logger.info('Building topic models for: %s' % config.project.name)
 
-    create_model(config, MultiTextCorpus)
-    create_model(config, ChangesetCorpus)
-    create_model(config, CommitLogCorpus)
+    run_kinds(config, create_model,
+              [MultiTextCorpus, ChangesetCorpus, CommitLogCorpus])
 
 
 @main.command()
@@ -160,6 +443,7 @@ def evaluate_distinctiveness(context, config):
     """
     Evalutates the models
     """
+    from corpora import MultiTextCorpus, ChangesetCorpus, CommitLogCorpus
     logger.info('Evalutating distinctiveness for: %s' % config.project.name)
 
     create_evaluation_distinctiveness(config, MultiTextCorpus)
@@ -171,6 +455,7 @@ def evaluate_distinctiveness(context, config):
 @pass_config
 @click.pass_context
 def evaluate_corpora(context, config):
+    from corpora import MultiTextCorpus, ChangesetCorpus
     logger.info('Evaluating corpus for: %s' % config.project.name)
 
     # create_evaluation_corpora(config, MultiTextCorpus)
@@ -181,14 +466,24 @@ def evaluate_corpora(context, config):
 
 
 @main.command()
+@click.option('--folds', default=10,
+              help="Number of folds, one of which is held out")
+@click.option('--cross-validate', is_flag=True,
+              help="Hold out each of the folds in turn")
+@click.option('--seed', default=0,
+              help="Seed for assigning documents to folds")
 @pass_config
 @click.pass_context
-def evaluate_perplexity(context, config):
+def evaluate_perplexity(context, config, folds, cross_validate, seed):
+    from corpora import MultiTextCorpus, ChangesetCorpus, CommitLogCorpus
     logger.info('Evalutating perplexity for: %s' % config.project.name)
 
-    create_evaluation_perplexity(config, MultiTextCorpus)
-    create_evaluation_perplexity(config, ChangesetCorpus)
-    create_evaluation_perplexity(config, CommitLogCorpus)
+    config.folds = folds
+    config.cross_validate = cross_validate
+    config.seed = seed
+
+    run_kinds(config, create_evaluation_perplexity,
+              [MultiTextCorpus, ChangesetCorpus, CommitLogCorpus])
 
 
 @main.command()
@@ -197,17 +492,21 @@ def evaluate_perplexity(context, config):
 def evaluate_log(context, config):
     logger.info('Evalutating models for: %s' % config.project.name)
 
-    model_fname = config.model_fname % ChangesetCorpus.__name__
-    changeset_fname = config.corpus_fname % ChangesetCorpus.__name__
-    commit_fname = config.corpus_fname % CommitLogCorpus.__name__
+    create_evaluation_log(config)
+
+
+def create_evaluation_log(config):
+    from gensim.models import LdaModel
+    import doctopic
+    from corpora import ChangesetCorpus, CommitLogCorpus
+
+    model_fname = config.get_model_fname(ChangesetCorpus)
+    changeset_fname = config.get_corpus_fname(ChangesetCorpus)
+    commit_fname = config.get_corpus_fname(CommitLogCorpus)
 
     try:
-        commit_id2word = Dictionary.load(commit_fname + '.dict')
-        commit_corpus = MalletCorpus(commit_fname,
-                                     id2word=commit_id2word)
-        changeset_id2word = Dictionary.load(changeset_fname + '.dict')
-        changeset_corpus = MalletCorpus(changeset_fname,
-                                        id2word=changeset_id2word)
+        commit_corpus = load_corpus(commit_fname)
+        changeset_corpus = load_corpus(changeset_fname)
     except:
         error('Corpora not built yet -- cannot evaluate')
 
@@ -217,36 +516,29 @@ def evaluate_log(context, config):
     except:
         error('Cannot evalutate LDA models not built yet!')
 
-    changeset_doc_topic = get_doc_topic(changeset_corpus, model)
-    commit_doc_topic = get_doc_topic(commit_corpus, model)
-
-    first_shared = dict()
-    for id_ in commit_doc_topic:
-        i = 0
-        commit_topics = [topic[0] for topic in commit_doc_topic[id_]]
-        try:
-            changeset_topics = [topic[0] for topic in changeset_doc_topic[id_]]
-        except:
-            continue
-
-        maximum = 101
-        minimum = maximum
-
-        for i, topic in enumerate(commit_topics):
-            if topic in changeset_topics:
-                j = changeset_topics.index(topic)
-                minimum = min(minimum, max(i, j))
+    commit_ids, commit_theta = get_doc_topic(commit_corpus, CommitLogCorpus,
+                                             model, model_fname)
+    changeset_ids, changeset_theta = get_doc_topic(changeset_corpus,
+                                                   ChangesetCorpus,
+                                                   model, model_fname)
 
-        for i, topic in enumerate(changeset_topics):
-            if topic in commit_topics:
-                j = commit_topics.index(topic)
-                minimum = min(minimum, max(i, j))
+    changeset_index = dict((id_, i) for i, id_ in enumerate(changeset_ids))
+    pairs = [(id_, i, changeset_index[id_])
+             for i, id_ in enumerate(commit_ids) if id_ in changeset_index]
 
-        first_shared[id_] = minimum
+    maximum = 101
+    minimum_probability = max(model.minimum_probability, 1e-8)
+    ranks = doctopic.first_shared(
+        commit_theta[[i for _, i, _ in pairs]],
+        changeset_theta[[j for _, _, j in pairs]],
+        minimum_probability=minimum_probability, maximum=maximum)
 
+    first_shared = dict()
+    for (id_, _, _), minimum in zip(pairs, ranks.tolist()):
         if minimum == maximum:
             logger.info('No common topics found for %s' % str(id_))
-            del first_shared[id_]
+        else:
+            first_shared[id_] = minimum
 
     mean = sum(first_shared.values()) / len(first_shared)
 
@@ -255,15 +547,68 @@ def evaluate_log(context, config):
         w.writerow([model_fname, mean] + list(first_shared.values()))
 
 
-def get_doc_topic(corpus, model):
-    doc_topic = dict()
-    corpus.metadata = True
-    for doc, meta in corpus:
-        id_ = meta[0]
-        doc_topic[id_] = list(reversed(sorted(model[doc], key=lambda x: x[1])))
+def get_doc_topic(corpus, Kind, model, model_fname):
+    """ Returns the document ids of a corpus and their topic distributions
+    under the model, inferring only those not already in the store kept
+    next to the model.
+
+    """
+    import doctopic
 
-    corpus.metadata = False
-    return doc_topic
+    store_fname = model_fname + '.' + Kind.__name__ + '.theta.npz'
+    store = doctopic.DocTopicStore(store_fname, model_fname)
+    return store.update(model, corpus)
+
+
+@main.command()
+@click.argument('revisions', nargs=-1)
+@click.option('--output', type=click.File('w'), default='-',
+              help="File to write the topics to, stdout by default")
+@click.option('--batch-size', default=256,
+              help="Number of commits to infer topics for at a time")
+@pass_config
+@click.pass_context
+def infer(context, config, revisions, output, batch_size):
+    """
+    Infers the topics of commits with the changeset model
+
+    Takes commit ids, refs, or ranges like A..B, reading one per line from
+    stdin when none are given. Writes a line of topic proportions per commit.
+    """
+    from gensim.corpora import Dictionary
+    from gensim.models import LdaModel
+    import doctopic
+    from corpora import ChangesetCorpus
+
+    model_fname = config.get_model_fname(ChangesetCorpus)
+    corpus_fname = config.get_corpus_fname(ChangesetCorpus)
+
+    try:
+        model = LdaModel.load(model_fname)
+        id2word = Dictionary.load(corpus_fname + '.dict')
+    except:
+        error('Cannot infer topics, the changeset model is not built yet!')
+
+    if not revisions:
+        revisions = [line.strip() for line in sys.stdin if line.strip()]
+
+    try:
+        commit_ids = doctopic.resolve_commits(config.repo, revisions)
+    except KeyError as e:
+        error('Unknown revision: %s' % e)
+
+    logger.info('Inferring topics of %d commits' % len(commit_ids))
+
+    corpus = ChangesetCorpus(config.repo, config.project.commit,
+                             lazy_dict=True, cache=config.cache,
+                             profiler=config.profiler,
+                             **config.corpus_kwargs(ChangesetCorpus))
+    corpus.id2word = id2word
+
+    for ids, theta in doctopic.infer_commits(model, corpus, commit_ids,
+                                             batch_size=batch_size):
+        doctopic.write_theta(output, ids, theta)
+        output.flush()
 
 
 @main.command()
@@ -283,41 +628,355 @@ def run_all(context, config):
     context.forward(evaluate_log)
 
 
-def create_corpus(config, Kind):
-    corpus_fname = config.corpus_fname % Kind.__name__
+def create_corpus(config, Kind, incremental=False):
+    from gensim.corpora import MalletCorpus
+    import sparsecorpus
+    from sparsecorpus import SparseCorpus, SparseCorpusWriter
+
+    corpus_fname = config.get_corpus_fname(Kind)
+
+    if incremental:
+        if not os.path.exists(corpus_fname):
+            previous_fname = find_previous_corpus(config, Kind)
+            if previous_fname is None:
+                logger.info('No previous %s to extend, building it all' %
+                            Kind.__name__)
+            else:
+                logger.info('Extending previous corpus: %s' % previous_fname)
+                exts = ['', '.index', '.dict']
+                if SparseCorpus.exists(previous_fname):
+                    exts.extend(sparsecorpus.EXTENSIONS)
+
+                if os.path.exists(previous_fname + '.clipped'):
+                    exts.append('.clipped')
+
+                corpus_fname = config.get_corpus_fname(Kind, create=True)
+                for ext in exts:
+                    shutil.copyfile(previous_fname + ext, corpus_fname + ext)
+
+        if os.path.exists(corpus_fname):
+            extend_corpus(config, Kind, corpus_fname)
+            return
 
     if not os.path.exists(corpus_fname):
-        corpus = Kind(config.repo, config.project.commit, lazy_dict=True)
+        corpus = Kind(config.repo, config.project.commit, lazy_dict=True,
+                      processes=config.workers, cache=config.cache,
+                      profiler=config.profiler,
+                      **config.corpus_kwargs(Kind))
         corpus.metadata = True
-        MalletCorpus.serialize(corpus_fname, corpus,
+        corpus_fname = config.get_corpus_fname(Kind, create=True)
+        writer = SparseCorpusWriter(corpus_fname)
+        MalletCorpus.serialize(corpus_fname, write_sparse(corpus, writer),
                                id2word=corpus.id2word, metadata=True)
+        writer.close()
         corpus.metadata = False
         corpus.id2word.save(corpus_fname + '.dict')
+        write_clipped(corpus, corpus_fname)
+
+
+def snapshot_fname(corpus_fname, ref):
+    """ Name of the corpus of a single ref, next to the combined one. """
+    base, ext = os.path.splitext(corpus_fname)
+    return '%s-%s%s' % (base, ref.replace('/', '_'), ext)
+
+
+def create_snapshots(config, combined=False):
+    """ Builds the corpus of every snapshot ref, either combined, its
+    document ids prefixed by their ref, or one corpus per ref. The corpora
+    of single refs all share the Dictionary of the whole.
+
+    """
+    from gensim.corpora import MalletCorpus
+    from corpora import SnapshotCorpus
+
+    corpus_fname = config.get_corpus_fname(SnapshotCorpus)
+    fnames = [snapshot_fname(corpus_fname, ref)
+              for ref in config.snapshot_refs]
+    if combined:
+        fnames = [corpus_fname]
+
+    if all(os.path.exists(fname + '.dict') for fname in fnames):
+        return
+
+    corpus = SnapshotCorpus(config.repo, processes=config.workers,
+                            cache=config.cache, profiler=config.profiler,
+                            **config.corpus_kwargs(SnapshotCorpus))
+    corpus.metadata = True
+    config.get_corpus_fname(SnapshotCorpus, create=True)
+
+    if combined:
+        MalletCorpus.serialize(corpus_fname, corpus, id2word=corpus.id2word,
+                               metadata=True)
+    else:
+        for ref, fname in zip(config.snapshot_refs, fnames):
+            MalletCorpus.serialize(fname, corpus.iter_ref(ref),
+                                   id2word=corpus.id2word, metadata=True)
+
+    # ids are never reassigned, so the final Dictionary suits every ref
+    for fname in fnames:
+        corpus.id2word.save(fname + '.dict')
+
+
+def write_clipped(corpus, corpus_fname, append=False):
+    """ Writes which commits went over a budget of the corpus, if any did,
+    to a CSV file next to the corpus.
+
+    """
+    clipped = getattr(corpus, 'clipped', None)
+    if not clipped:
+        return
+
+    fname = corpus_fname + '.clipped'
+    header = not (append and os.path.exists(fname))
+    with open(fname, 'a' if append else 'w') as f:
+        writer = csv.writer(f)
+        if header:
+            writer.writerow(['commit', 'budgets'])
+
+        for commit, budgets in sorted(clipped.items()):
+            writer.writerow([commit, ' '.join(budgets)])
+
+    logger.info('Wrote the %d clipped commits to %s' % (len(clipped), fname))
+
+
+def write_sparse(corpus, writer):
+    """ Passes the (document, metadata) pairs of a corpus through, adding
+    each to the sparse corpus writer on the way, so that both formats are
+    written in a single pass over the repository.
+
+    """
+    for doc, meta in corpus:
+        writer.add(doc, meta)
+        yield doc, meta
+
+
+def load_corpus(corpus_fname):
+    """ Opens a built corpus along with its Dictionary, reading the
+    memory-mapped sparse arrays when they exist instead of parsing the
+    MalletCorpus text.
+
+    """
+    from gensim.corpora import MalletCorpus, Dictionary
+    from sparsecorpus import SparseCorpus
+
+    id2word = Dictionary.load(corpus_fname + '.dict')
+    if SparseCorpus.exists(corpus_fname):
+        return SparseCorpus(corpus_fname, id2word=id2word)
+
+    return MalletCorpus(corpus_fname, id2word=id2word)
+
+
+def find_previous_corpus(config, Kind):
+    """ Returns the most recently built corpus of this kind for the project
+    at any other commit, or None.
+
+    """
+    if config.artifacts is not None:
+        inputs = config.corpus_inputs(Kind)
+        name = config.project.name
+
+        def previous(other, meta):
+            return (meta.get('project') == name and
+                    other['commit'] != inputs['commit'] and
+                    dict(other, commit=inputs['commit']) == inputs)
+
+        fnames = [os.path.join(artifact, 'corpus.mallet')
+                  for artifact in config.artifacts.find(previous)]
+        fnames = [fname for fname in fnames
+                  if os.path.exists(fname + '.index') and
+                  os.path.exists(fname + '.dict')]
+        return fnames[0] if fnames else None
+
+    pattern = (config.path +
+               config.project.name + '-' +
+               '[0-9a-f]' * 8 + '-' +
+               config.kind_name(Kind) + '.mallet')
+
+    fnames = [fname for fname in glob.glob(pattern)
+              if os.path.exists(fname + '.index') and
+              os.path.exists(fname + '.dict')]
+    if not fnames:
+        return None
+
+    return max(fnames, key=os.path.getmtime)
+
+
+def read_corpus_ids(corpus_fname):
+    """ Returns the document ids serialized in a MalletCorpus file, which are
+    commit ids for the changeset and commit log corpora.
+
+    """
+    with open(corpus_fname) as f:
+        return [line.split(None, 1)[0] for line in f if line.strip()]
+
+
+def extend_corpus(config, Kind, corpus_fname):
+    """ Appends the commits not yet in the corpus file to it, extending its
+    Dictionary and index as well.
+
+    The extended files are all written next to the corpus first, and only
+    renamed over it once every one of them is complete, so that a failure
+    part way leaves the corpus as it was rather than its formats out of
+    step with each other.
+
+    """
+    from gensim import utils as gensim_utils
+    from gensim.corpora import MalletCorpus, Dictionary
+    import sparsecorpus
+    from sparsecorpus import SparseCorpus, SparseCorpusWriter
+
+    known = read_corpus_ids(corpus_fname)
+    id2word = Dictionary.load(corpus_fname + '.dict')
+
+    corpus = Kind(config.repo, config.project.commit, lazy_dict=True,
+                  processes=config.workers, exclude=known,
+                  cache=config.cache, profiler=config.profiler,
+                  **config.corpus_kwargs(Kind))
+    corpus.id2word = id2word
+
+    tmp_fname = corpus_fname + '.tmp'
+    new_fname = corpus_fname + '.new'
+    exts = ['', '.index', '.dict', '.clipped'] + sparsecorpus.EXTENSIONS
+    has_sparse = SparseCorpus.exists(corpus_fname)
+
+    try:
+        # the index and Dictionary are rewritten whole, the rest appended to
+        for ext in ['', '.clipped'] + sparsecorpus.EXTENSIONS:
+            if os.path.exists(corpus_fname + ext):
+                shutil.copyfile(corpus_fname + ext, tmp_fname + ext)
+
+        docs = corpus
+        if has_sparse:
+            writer = SparseCorpusWriter(tmp_fname, append=True)
+            docs = write_sparse(corpus, writer)
+
+        corpus.metadata = True
+        MalletCorpus.serialize(new_fname, docs,
+                               id2word=corpus.id2word, metadata=True)
+        corpus.metadata = False
+        write_clipped(corpus, tmp_fname, append=True)
+
+        if has_sparse:
+            writer.close()
+
+        offsets = gensim_utils.unpickle(corpus_fname + '.index')
+        new_offsets = gensim_utils.unpickle(new_fname + '.index')
+        logger.info('Appending %d new documents to %d in %s' %
+                    (len(new_offsets), len(offsets), corpus_fname))
+
+        # offsets of the new documents shift by what is already in the file
+        size = os.path.getsize(tmp_fname)
+        offsets = list(offsets) + [offset + size for offset in new_offsets]
+
+        with open(tmp_fname, 'ab') as f:
+            with open(new_fname, 'rb') as new_f:
+                shutil.copyfileobj(new_f, f)
+
+        gensim_utils.pickle(offsets, tmp_fname + '.index')
+        corpus.id2word.save(tmp_fname + '.dict')
+
+        if not has_sparse:
+            # built before the sparse format, convert the whole thing
+            mallet = MalletCorpus(tmp_fname, id2word=corpus.id2word)
+            mallet.metadata = True
+            SparseCorpus.serialize(tmp_fname, mallet, metadata=True)
+
+        # the Dictionary goes last, as it marks the corpus as built
+        for ext in sorted(exts, key=lambda ext: ext == '.dict'):
+            if os.path.exists(tmp_fname + ext):
+                os.rename(tmp_fname + ext, corpus_fname + ext)
+    finally:
+        for fname in [tmp_fname + ext for ext in exts] + \
+                [new_fname, new_fname + '.index']:
+            if os.path.exists(fname):
+                os.remove(fname)
 
 
 def create_model(config, Kind):
-    model_fname = config.model_fname % Kind.__name__
-    corpus_fname = config.corpus_fname % Kind.__name__
+    model_fname = config.get_model_fname(Kind)
+    corpus_fname = config.get_corpus_fname(Kind)
 
     if not os.path.exists(model_fname):
         try:
-            id2word = Dictionary.load(corpus_fname + '.dict')
-            corpus = MalletCorpus(corpus_fname, id2word=id2word)
+            corpus = load_corpus(corpus_fname)
             logger.info('Opened previously created corpus: %s' % corpus_fname)
         except:
             error('Corpora for building file models not found!')
 
-        file_model = LdaModel(corpus,
-                              id2word=corpus.id2word,
-                              alpha=config.alpha,
-                              passes=config.passes,
-                              num_topics=config.num_topics)
+        file_model = train_model(config, corpus, corpus.id2word)
+        file_model.save(config.get_model_fname(Kind, create=True))
+
+
+def train_model(config, corpus, id2word):
+    """ Trains an LDA model on the corpus, spreading the training over
+    worker processes with LdaMulticore when there is more than one worker.
+    LdaMulticore is an LdaModel, so LdaModel.load reads either back.
+
+    """
+    from gensim.models import LdaModel, LdaMulticore
+
+    if config.workers > 1:
+        # the master process does work too
+        return LdaMulticore(corpus,
+                            id2word=id2word,
+                            alpha=config.alpha,
+                            passes=config.passes,
+                            num_topics=config.num_topics,
+                            workers=config.workers - 1)
+
+    return LdaModel(corpus,
+                    id2word=id2word,
+                    alpha=config.alpha,
+                    passes=config.passes,
+                    num_topics=config.num_topics)
+
+
+def run_kinds(config, fn, kinds):
+    """ Calls fn(config, Kind) for each of the kinds. With more than one
+    worker, each kind runs in its own process, with no more kinds at a time
+    than there are workers. Each kind gets an even share of the workers,
+    the first ones one more each when they do not divide evenly.
+
+    """
+    if config.workers <= 1:
+        for Kind in kinds:
+            fn(config, Kind)
+        return
+
+    shares = [config.workers // len(kinds) + (i < config.workers % len(kinds))
+              for i in range(len(kinds))]
+
+    running = list()
+    failed = list()
+
+    def join(Kind, process):
+        process.join()
+        if process.exitcode != 0:
+            failed.append(Kind.__name__)
+
+    for Kind, share in zip(kinds, shares):
+        if len(running) == config.workers:
+            join(*running.pop(0))
 
-        file_model.save(model_fname)
+        kind_config = copy.copy(config)
+        kind_config.workers = max(1, share)
+        process = multiprocessing.Process(target=fn, args=(kind_config, Kind))
+        process.start()
+        running.append((Kind, process))
+
+    for Kind, process in running:
+        join(Kind, process)
+
+    if failed:
+        error('%s failed for %s' % (fn.__name__, ', '.join(failed)))
 
 
 def create_evaluation_distinctiveness(config, Kind):
-    model_fname = config.model_fname % Kind.__name__
+    import numpy
+    from gensim.models import LdaModel
+    import utils
+
+    model_fname = config.get_model_fname(Kind)
 
     try:
         model = LdaModel.load(model_fname)
@@ -349,11 +1008,10 @@ def create_evaluation_distinctiveness(config, Kind):
 
 
 def create_evaluation_corpora(config, Kind):
-    corpus_fname = config.corpus_fname % Kind.__name__
+    corpus_fname = config.get_corpus_fname(Kind)
 
     try:
-        id2word = Dictionary.load(corpus_fname + '.dict')
-        corpus = MalletCorpus(corpus_fname, id2word=id2word)
+        corpus = load_corpus(corpus_fname)
     except:
         error('Corpora not built yet -- cannot evaluate')
 
@@ -363,16 +1021,12 @@ def create_evaluation_corpora(config, Kind):
 
 
 def get_word_freq(corpus):
-    word_freq = dict()
-    for doc in corpus:
-        for word_id, count in doc:
-            word = corpus.id2word[word_id]
-            if word not in word_freq:
-                word_freq[word] = 0
-
-            word_freq[word] += count
+    import numpy
+    import wordfreq
 
-    return word_freq
+    counts = wordfreq.count_terms(corpus)
+    return dict((corpus.id2word[word_id], int(counts[word_id]))
+                for word_id in numpy.flatnonzero(counts))
 
 
 def count_words(corpus):
@@ -381,77 +1035,64 @@ def count_words(corpus):
 
 
 def create_evaluation_corpora_cosine(config, Kind, Kind2):
-    corpus1_fname = config.corpus_fname % Kind.__name__
-    corpus2_fname = config.corpus_fname % Kind2.__name__
+    import wordfreq
+
+    corpus1_fname = config.get_corpus_fname(Kind)
+    corpus2_fname = config.get_corpus_fname(Kind2)
 
     try:
-        id2word1 = Dictionary.load(corpus1_fname + '.dict')
-        corpus1 = MalletCorpus(corpus1_fname, id2word=id2word1)
-        id2word2 = Dictionary.load(corpus2_fname + '.dict')
-        corpus2 = MalletCorpus(corpus2_fname, id2word=id2word2)
+        corpus1 = load_corpus(corpus1_fname)
+        corpus2 = load_corpus(corpus2_fname)
     except:
         error('Corpora not built yet -- cannot evaluate')
 
-    word_freq1 = get_word_freq(corpus1)
-    word_freq2 = get_word_freq(corpus2)
-
-    total1 = float(sum(x[1] for x in word_freq1.items()))
-    total2 = float(sum(x[1] for x in word_freq2.items()))
-
-    all_words = set(word_freq1.keys()) | set(word_freq2.keys())
-    for word in all_words:
-        if word not in word_freq1:
-            word_freq1[word] = 0
-            if word not in word_freq2:
-                word_freq2[word] = 0
-
-    dist1 = [x[1]/total1 for x in sorted(word_freq1.items())]
-    dist2 = [x[1]/total2 for x in sorted(word_freq2.items())]
-    rdist = numpy.random.random_sample(len(all_words))
-
-    res = utils.hellinger_distance(dist1, dist2, filter_by=0.0)
-    res1 = utils.hellinger_distance(dist1, rdist, filter_by=0.0)
-    res2 = utils.hellinger_distance(dist2, rdist, filter_by=0.0)
-    logger.info("Cosine distance between corpora: %f" % res)
+    results = wordfreq.compare_corpora(corpus1, corpus2)
+    res, res1, res2 = results['hellinger']
+    cos, cos1, cos2 = results['cosine']
+    logger.info("Hellinger distance between corpora: %f" % res)
+    logger.info("Cosine distance between corpora: %f" % cos)
     with open(config.path + 'evaluate-hellinger-results.csv', 'a') as f:
         w = csv.writer(f)
-        w.writerow([corpus1_fname, corpus2_fname, res, res1, res2])
+        w.writerow([corpus1_fname, corpus2_fname, res, res1, res2,
+                    cos, cos1, cos2])
 
 
 def create_evaluation_perplexity(config, Kind):
-    model_fname = config.model_fname % Kind.__name__
-    corpus_fname = config.corpus_fname % Kind.__name__
+    import utils
+
+    model_fname = config.get_model_fname(Kind)
+    corpus_fname = config.get_corpus_fname(Kind)
 
     try:
-        id2word = Dictionary.load(corpus_fname + '.dict')
-        corpus = MalletCorpus(corpus_fname, id2word=id2word)
+        corpus = load_corpus(corpus_fname)
     except:
         error('Corpora not built yet -- cannot evaluate')
 
-    held_out = list()
-    training = list()
-    target_len = int(0.1 * len(corpus))
-    logger.info('Calculating perplexity with held-out %d of %d documents' %
-                (target_len, len(corpus)))
+    if config.cross_validate:
+        folds = range(config.folds)
+    else:
+        folds = [0]
 
-    ids = set()
-    while len(ids) < target_len:
-        ids.add(random.randint(0, len(corpus)))
+    # the corpus is streamed for every fold, never held in memory
+    results = list()
+    for fold in folds:
+        training = utils.CorpusFold(corpus, fold, config.folds,
+                                    held_out=False, seed=config.seed)
+        held_out = utils.CorpusFold(corpus, fold, config.folds,
+                                    held_out=True, seed=config.seed)
 
-    for doc_id, doc in enumerate(corpus):
-        if doc_id in ids:
-            held_out.append(doc)
-        else:
-            training.append(doc)
+        logger.info('Calculating perplexity with held-out %d of %d documents'
+                    ' (fold %d of %d)' % (len(held_out), len(corpus),
+                                          fold + 1, config.folds))
 
-    model = LdaModel(training,
-                     id2word=corpus.id2word,
-                     alpha=config.alpha,
-                     passes=config.passes,
-                     num_topics=config.num_topics)
+        model = train_model(config, training, corpus.id2word)
+        results.append(model.log_perplexity(held_out))
 
-    pwb = model.log_perplexity(held_out)
+    if config.cross_validate:
+        row = [model_fname, sum(results) / len(results)] + results
+    else:
+        row = [model_fname] + results
 
     with open(config.path + 'evaluate-perplexity-results.csv', 'a') as f:
         w = csv.writer(f)
-        w.writerow([model_fname, pwb])
+        w.writerow(row)
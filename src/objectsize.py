@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+"""
+Code for finding the size of git objects from their headers alone.
+
+Reading a blob through dulwich inflates all of it, which is wasted on large
+binaries that are only going to be skipped. A loose object starts with a
+header giving its size, and a packed one with its size or, for a delta,
+with the size of what the delta builds, so only the first few bytes need
+inflating.
+"""
+
+import os.path
+import zlib
+
+from dulwich.object_store import DiskObjectStore
+from dulwich.objects import hex_to_filename
+from dulwich.pack import OFS_DELTA, REF_DELTA
+
+import logging
+logger = logging.getLogger('mct.objectsize')
+
+# bytes of compressed data inflated at a time when looking for a header
+CHUNK_SIZE = 64
+
+
+def object_size(object_store, sha):
+    """ Returns the size of the object's contents, read from its header, or
+    None if that cannot be done for this object or store.
+
+    """
+    if not isinstance(object_store, DiskObjectStore):
+        return None
+
+    for pack in object_store.packs:
+        try:
+            offset = pack.index.object_index(sha)
+        except KeyError:
+            continue
+
+        # a file of our own, rather than the one dulwich keeps privately
+        with open(pack.data.path, 'rb') as f:
+            return _packed_size(f, offset)
+
+    path = hex_to_filename(object_store.path, sha)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return _loose_size(f)
+
+    return None
+
+
+def _loose_size(f):
+    """ Returns the size from the header of a loose object, which is
+    "<type> <size>\\0" at the start of the inflated file.
+
+    """
+    inflate = zlib.decompressobj()
+    data = b''
+    try:
+        while b'\0' not in data:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return None
+
+            data += inflate.decompress(chunk)
+    except zlib.error:
+        return None  # the legacy format, not deflated as a whole
+
+    header = data.split(b'\0', 1)[0]
+    try:
+        return int(header.split(b' ', 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _read_varint(read):
+    """ Reads a little-endian base 128 number, as used in pack headers
+    and delta headers, from a function returning one more byte at a time.
+
+    """
+    value = shift = 0
+    while True:
+        byte = read()
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value
+
+
+def _packed_size(f, offset):
+    """ Returns the size of the object at the offset of a pack file. """
+    f.seek(offset)
+    byte = ord(f.read(1))
+    type_num = (byte >> 4) & 0x07
+    size = byte & 0x0f
+    shift = 4
+    while byte & 0x80:
+        byte = ord(f.read(1))
+        size |= (byte & 0x7f) << shift
+        shift += 7
+
+    if type_num not in (OFS_DELTA, REF_DELTA):
+        return size
+
+    if type_num == OFS_DELTA:
+        while ord(f.read(1)) & 0x80:
+            pass  # the offset of the base
+    else:
+        f.read(20)  # the sha of the base
+
+    # the delta starts with the size of its base, then of what it builds
+    inflate = zlib.decompressobj()
+    data = bytearray()
+
+    def read():
+        while not data:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                raise EOFError
+
+            data.extend(inflate.decompress(chunk))
+
+        return data.pop(0)
+
+    try:
+        _read_varint(read)
+        return _read_varint(read)
+    except (EOFError, zlib.error):
+        return None
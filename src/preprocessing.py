@@ -11,11 +11,24 @@
 Code for splitting the terms.
 """
 
+import re
 import string
 
+from cache import LRUCache
+
 import logging
 logger = logging.getLogger('mct.preprocessing')
 
+# tokens that split() would give back whole, e.g. 'word' or 'Word'. \Z as
+# $ also matches before a trailing newline, which split() does not keep
+SIMPLE_TOKEN = re.compile(r'^(?:[A-Z]?[a-z]+|[A-Z])\Z')
+
+# identifiers repeat a lot, so remember how each token was split
+SPLIT_CACHE = LRUCache(max_size=2 ** 17)
+
+# words int() would parse, which are dropped along with the stop words
+NUMERIC = re.compile(r'^\s*[+-]?\d+\s*$', re.UNICODE)
+
 
 def tokenize(s):
     return s.split()
@@ -35,6 +48,94 @@ def to_unicode(document, info=[]):
 
 
 def split(iterator):
+    for token in iterator:
+        for word in split_cached(token):
+            yield word
+
+
+def split_cached(token):
+    """ Returns the words of a single token, as `split_token`, remembering
+    them in SPLIT_CACHE.
+
+    """
+    try:
+        return SPLIT_CACHE[token]
+    except KeyError:
+        words = split_token(token)
+        SPLIT_CACHE[token] = words
+        return words
+
+
+def split_token(token):
+    """ Splits a single token in one pass, giving the same words as
+    `split_reference`. Instead of rescanning the word built so far on every
+    character, it keeps track of whether that word is all uppercase, has any
+    lowercase, and is all digits.
+
+    """
+    if SIMPLE_TOKEN.match(token):
+        return (u'' + token,)
+
+    words = list()
+    word = u''
+    all_upper = True  # all of an empty word is uppercase, and digits
+    any_lower = False
+    all_digit = True
+
+    for char in token:
+        if char.isupper() and all_upper:
+            # keep building if word is currently all uppercase
+            word += char
+            all_digit = False
+
+        elif char.islower() and all_upper:
+            # stop building if word is currently all uppercase,
+            # but be sure to take the first letter back
+            if len(word) > 1:
+                words.append(word[:-1])
+                word = word[-1]
+
+            word += char
+            all_upper, any_lower, all_digit = False, True, False
+
+        elif char.islower() and any_lower:
+            # keep building if the word is has any lowercase
+            word += char
+
+        elif char.isdigit() and all_digit:
+            # keep building if all of the word is a digit so far
+            word += char
+            all_upper = False
+
+        elif char in string.punctuation:
+            if len(word) > 0:
+                words.append(word)
+                word = u''
+
+            # always yield punctuation as a single token
+            words.append(char)
+            all_upper, any_lower, all_digit = True, False, True
+
+        else:
+            if len(word) > 0:
+                words.append(word)
+
+            word = char
+            all_upper = char.isupper()
+            any_lower = char.islower()
+            all_digit = char.isdigit()
+
+    if len(word) > 0:
+        words.append(word)
+
+    return tuple(words)
+
+
+def split_reference(iterator):
+    """ The original, character by character splitter. Kept as the
+    reference that `split` must agree with.
+
+    """
     for token in iterator:
         word = u''
         for char in token:
@@ -78,20 +179,111 @@ def split(iterator):
             yield word
 
 
-def remove_stops(iterator, stopwords=set()):
-    if not isinstance(stopwords, set):
+class StopFilter(object):
+    """
+    The stop words, along with punctuation, digits, whitespace and integer
+    literals, built once into an immutable set and a compiled pattern so
+    that it can be reused for every document.
+    """
+
+    def __init__(self, stopwords=()):
         stopwords = set(stopwords)
+        stopwords.update(string.punctuation)
+        stopwords.update(string.digits)
+        stopwords.update(string.whitespace)
+        stopwords.update([''])
+        self.stopwords = frozenset(stopwords)
+
+    def __contains__(self, word):
+        return word in self.stopwords or NUMERIC.match(word) is not None
+
+    def __call__(self, iterator):
+        stopwords = self.stopwords
+        numeric = NUMERIC.match
+        for word in iterator:
+            if word not in stopwords and numeric(word) is None:
+                yield word
+
+
+def remove_stops(iterator, stopwords=()):
+    """ Drops the stop words, punctuation, digits, whitespace and integer
+    literals. Pass a StopFilter to avoid building one on every call.
+
+    """
+    if not isinstance(stopwords, StopFilter):
+        stopwords = StopFilter(stopwords)
 
-    stopwords.update(string.punctuation)
-    stopwords.update(string.digits)
-    stopwords.update(string.whitespace)
-    stopwords.update([''])
-    for word in filter(lambda x: x not in stopwords, iterator):
+    return stopwords(iterator)
+
+
+class Vocabulary(object):
+    """
+    Interns words into small integer ids, in the order they are first seen,
+    so each distinct word is kept only once.
+    """
+
+    def __init__(self):
+        self.ids = dict()
+        self.words = list()
+
+    def __len__(self):
+        return len(self.words)
+
+    def intern(self, word):
         try:
-            int(word)
-            float(word)
-        except ValueError:
-            yield word
+            return self.ids[word]
+        except KeyError:
+            self.ids[word] = i = len(self.words)
+            self.words.append(word)
+            return i
+
+    def bag(self, words):
+        """ Returns a BagOfTokens counting the words. """
+        bag = BagOfTokens()
+        bag.add(self.intern(word) for word in words)
+        return bag
+
+    def bag_from_counts(self, counts):
+        """ Returns a BagOfTokens of a mapping of words to their counts. """
+        bag = BagOfTokens()
+        for word, count in counts.iteritems():
+            bag[self.intern(word)] = count
+
+        return bag
+
+
+class BagOfTokens(dict):
+    """
+    The words of a document as a mapping of their Vocabulary ids to their
+    counts, standing in for the list of the words themselves.
+    """
+
+    __slots__ = ()
+
+    def add(self, ids):
+        for i in ids:
+            self[i] = self.get(i, 0) + 1
+
+    def extend(self, other):
+        """ Adds the counts of another bag, as list.extend would the words.
+
+        """
+        for i, count in other.iteritems():
+            self[i] = self.get(i, 0) + count
+
+    def total(self):
+        return sum(self.itervalues())
+
+    def counts(self, vocab):
+        """ Returns the counts keyed by the words themselves. """
+        words = vocab.words
+        return dict((words[i], count) for i, count in self.iteritems())
+
+    def expand(self, vocab):
+        """ Returns the list of words, each repeated by its count. """
+        words = vocab.words
+        return [words[i] for i, count in self.iteritems()
+                for _ in xrange(count)]
 
 
 def read_stops(l):
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+"""
+Code for timing the stages of building a corpus.
+"""
+
+import json
+import time
+
+import logging
+logger = logging.getLogger('mct.profiling')
+
+
+class Profiler(object):
+    """
+    Collects wall time, CPU time, item counts and byte volumes per stage.
+
+    Stages are timed with `with profiler.stage(name) as stage:`, and the
+    counts added through `stage.add(count, nbytes)`. When done, `emit()`
+    hands the profiler to `callback`, or logs a report if there is none.
+    """
+
+    enabled = True
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.stages = dict()
+
+    def stage(self, name):
+        return StageTimer(self, name)
+
+    def record(self, name, wall, cpu, count=0, nbytes=0):
+        if name not in self.stages:
+            self.stages[name] = dict(calls=0, wall=0.0, cpu=0.0,
+                                     count=0, bytes=0)
+
+        stats = self.stages[name]
+        stats['calls'] += 1
+        stats['wall'] += wall
+        stats['cpu'] += cpu
+        stats['count'] += count
+        stats['bytes'] += nbytes
+
+    def to_dict(self):
+        return dict((name, dict(stats)) for name, stats in self.stages.items())
+
+    def report(self):
+        lines = ['%-12s %10s %10s %10s %12s %14s' %
+                 ('stage', 'calls', 'wall (s)', 'cpu (s)', 'count', 'bytes')]
+        for name, stats in sorted(self.stages.items(),
+                                  key=lambda x: -x[1]['wall']):
+            lines.append('%-12s %10d %10.3f %10.3f %12d %14d' %
+                         (name, stats['calls'], stats['wall'], stats['cpu'],
+                          stats['count'], stats['bytes']))
+
+        return '\n'.join(lines)
+
+    def emit(self):
+        if self.callback is not None:
+            self.callback(self)
+        else:
+            logger.info('Profile:\n%s' % self.report())
+
+    def dump(self, fname):
+        """ Writes the collected stages to a JSON file. """
+        with open(fname, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+
+
+class StageTimer(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.count = 0
+        self.nbytes = 0
+
+    def add(self, count=0, nbytes=0):
+        self.count += count
+        self.nbytes += nbytes
+
+    def __enter__(self):
+        self.start = time.time()
+        self.start_cpu = time.clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name,
+                             time.time() - self.start,
+                             time.clock() - self.start_cpu,
+                             self.count, self.nbytes)
+
+
+class NullProfiler(object):
+    """
+    Profiler that does nothing, used when profiling is off. Callers check
+    `enabled` before doing any extra work to feed a profiler.
+    """
+
+    enabled = False
+
+    def stage(self, name):
+        return NULL_TIMER
+
+    def record(self, name, wall, cpu, count=0, nbytes=0):
+        pass
+
+    def emit(self):
+        pass
+
+
+class NullTimer(object):
+    def add(self, count=0, nbytes=0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+NULL_TIMER = NullTimer()
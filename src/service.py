@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+"""
+A long-running HTTP service answering topic queries about projects.
+
+Each project's repository, Dictionaries, models and term counts are loaded
+once, when first asked about, and kept in memory for the projects used
+most recently. Requests are GETs answered with JSON:
+
+    /projects/<name>/infer?rev=<commit, ref or A..B>[&rev=...]
+    /projects/<name>/topics?kind=ChangesetCorpus&words=10
+    /projects/<name>/similarity?kind1=MultiTextCorpus&kind2=ChangesetCorpus
+
+Start it with `mct-serve --port 8080`, it only listens on localhost unless
+told otherwise.
+"""
+
+import json
+import os.path
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+import click
+import dulwich.repo
+from gensim.models import LdaModel
+
+import doctopic
+import wordfreq
+from cache import LRUCache
+from corpora import MultiTextCorpus, ChangesetCorpus, CommitLogCorpus
+from main import Config, find_project, set_filenames, load_corpus
+
+import logging
+logger = logging.getLogger('mct.service')
+
+KINDS = dict((Kind.__name__, Kind) for Kind in
+             [MultiTextCorpus, ChangesetCorpus, CommitLogCorpus])
+
+
+class ServiceError(Exception):
+    """ An error to answer a request with, and its HTTP status. """
+
+    def __init__(self, status, message):
+        super(ServiceError, self).__init__(message)
+        self.status = status
+
+
+class ProjectState(object):
+    """
+    A project's repository, along with its corpora, models and term counts,
+    each loaded the first time it is needed.
+    """
+
+    def __init__(self, config, repo=None):
+        self.config = config
+        self.repo = repo or dulwich.repo.Repo(config.path +
+                                              config.project.name)
+        self._corpora = dict()
+        self._models = dict()
+        self._counts = dict()
+        self._changesets = None
+
+    def corpus(self, Kind):
+        if Kind not in self._corpora:
+            corpus_fname = self.config.get_corpus_fname(Kind)
+            if not os.path.exists(corpus_fname + '.dict'):
+                raise ServiceError(404, '%s not built for %s' %
+                                   (Kind.__name__, self.config.project.name))
+
+            self._corpora[Kind] = load_corpus(corpus_fname)
+
+        return self._corpora[Kind]
+
+    def model(self, Kind):
+        if Kind not in self._models:
+            model_fname = self.config.get_model_fname(Kind)
+            if not os.path.exists(model_fname):
+                raise ServiceError(404, 'No %s model for %s' %
+                                   (Kind.__name__, self.config.project.name))
+
+            self._models[Kind] = LdaModel.load(model_fname)
+
+        return self._models[Kind]
+
+    def term_counts(self, Kind):
+        if Kind not in self._counts:
+            self._counts[Kind] = wordfreq.count_terms(self.corpus(Kind))
+
+        return self._counts[Kind]
+
+    def changesets(self):
+        """ A ChangesetCorpus over the project, with the Dictionary of the
+        built changeset corpus, for preprocessing new commits.
+
+        """
+        if self._changesets is None:
+            options = self.config.corpus_kwargs(ChangesetCorpus)
+            corpus = ChangesetCorpus(self.repo, self.config.project.commit,
+                                     lazy_dict=True, **options)
+            corpus.id2word = self.corpus(ChangesetCorpus).id2word
+            self._changesets = corpus
+
+        return self._changesets
+
+
+def load_project(name, path='data/', projects_fname='projects.csv',
+                 artifacts=None):
+    """ Loads the state of a project listed in the projects file, with its
+    files kept under `path` as the main command keeps them, or in the
+    ArtifactStore `artifacts` if given.
+
+    """
+    config = Config()
+    config.path = path if path.endswith('/') else path + '/'
+    config.artifacts = artifacts
+    config.project = find_project(name, projects_fname)
+    if config.project is None:
+        raise ServiceError(404, "Could not find '%s' in '%s'" %
+                           (name, projects_fname))
+
+    set_filenames(config)
+
+    try:
+        return ProjectState(config)
+    except dulwich.errors.NotGitRepository:
+        raise ServiceError(404, 'Repository of %s not cloned yet' % name)
+
+
+class TopicService(object):
+    """
+    Answers requests against the projects returned by `loader`, a function
+    of the project name, keeping at most `max_projects` of them loaded.
+    """
+
+    def __init__(self, loader=load_project, max_projects=4):
+        self.loader = loader
+        self.projects = LRUCache(max_size=max_projects)
+
+    def get_project(self, name):
+        try:
+            return self.projects[name]
+        except KeyError:
+            logger.info('Loading project %s' % name)
+            state = self.loader(name)
+            self.projects[name] = state
+            return state
+
+    def handle(self, path, query):
+        """ Returns the HTTP status and JSON-able answer for a request of a
+        path with a dict of query parameter lists.
+
+        """
+        parts = [part for part in path.split('/') if part]
+        if len(parts) != 3 or parts[0] != 'projects':
+            return 404, dict(error='Unknown path: %s' % path)
+
+        _, name, action = parts
+        handler = getattr(self, 'do_' + action, None)
+        if handler is None:
+            return 404, dict(error='Unknown request: %s' % action)
+
+        try:
+            return 200, handler(self.get_project(name), query)
+        except ServiceError as e:
+            return e.status, dict(error=str(e))
+
+    def _get_kind(self, query, key, default):
+        name = query.get(key, [default])[0]
+        if name not in KINDS:
+            raise ServiceError(400, 'Unknown corpus kind: %s' % name)
+
+        return KINDS[name]
+
+    def do_infer(self, state, query):
+        revisions = query.get('rev', [])
+        if not revisions:
+            raise ServiceError(400, 'No revisions given')
+
+        model = state.model(ChangesetCorpus)
+        corpus = state.changesets()
+        try:
+            commit_ids = doctopic.resolve_commits(state.repo, revisions)
+        except KeyError as e:
+            raise ServiceError(404, 'Unknown revision: %s' % e)
+
+        minimum_probability = max(model.minimum_probability, 1e-8)
+
+        commits = list()
+        for ids, theta in doctopic.infer_commits(model, corpus, commit_ids):
+            for id_, row in zip(ids, theta):
+                topics = [(int(topic), float(row[topic])) for topic
+                          in reversed(row.argsort(kind='mergesort'))
+                          if row[topic] >= minimum_probability]
+                commits.append(dict(id=id_, topics=topics))
+
+        return dict(commits=commits)
+
+    def do_topics(self, state, query):
+        Kind = self._get_kind(query, 'kind', ChangesetCorpus.__name__)
+        try:
+            num_words = int(query.get('words', ['10'])[0])
+        except ValueError:
+            raise ServiceError(400, 'Number of words must be an integer')
+
+        model = state.model(Kind)
+        topics = model.show_topics(num_topics=-1, num_words=num_words,
+                                   formatted=False)
+        return dict(topics=[dict(topic=topic,
+                                 words=[(word, float(p)) for word, p in words])
+                            for topic, words in topics])
+
+    def do_similarity(self, state, query):
+        Kind1 = self._get_kind(query, 'kind1', MultiTextCorpus.__name__)
+        Kind2 = self._get_kind(query, 'kind2', ChangesetCorpus.__name__)
+
+        results = wordfreq.compare_counts(
+            state.term_counts(Kind1), state.corpus(Kind1).id2word,
+            state.term_counts(Kind2), state.corpus(Kind2).id2word, seed=0)
+
+        return dict((name, dict(corpora=float(res), random1=float(res1),
+                                random2=float(res2)))
+                    for name, (res, res1, res2) in results.items())
+
+
+class TopicRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        status, answer = self.server.service.handle(
+            url.path, urlparse.parse_qs(url.query))
+
+        body = json.dumps(answer)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def make_server(service, host='127.0.0.1', port=8080):
+    server = HTTPServer((host, port), TopicRequestHandler)
+    server.service = service
+    return server
+
+
+@click.command()
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8080)
+@click.option('--path', default='data/',
+              help="Set the directory the projects are kept in")
+@click.option('--projects', default='projects.csv',
+              help="File listing the projects")
+@click.option('--max-projects', default=4,
+              help="Number of projects to keep loaded at once")
+@click.option('--artifacts', default=None,
+              help="Directory the corpora and models were built into with "
+                   "the same option of the main command")
+@click.option('--verbose', is_flag=True)
+def serve(host, port, path, projects, max_projects, artifacts, verbose):
+    """
+    Serves topic queries about projects over HTTP
+    """
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : ' +
+                        '%(name)s : %(funcName)s : %(message)s')
+
+    if verbose:
+        logging.root.setLevel(level=logging.DEBUG)
+    else:
+        logging.root.setLevel(level=logging.INFO)
+
+    store = None
+    if artifacts is not None:
+        from artifacts import ArtifactStore
+        store = ArtifactStore(artifacts)
+
+    loader = lambda name: load_project(name, path, projects, store)
+    server = make_server(TopicService(loader, max_projects), host, port)
+    logger.info('Serving on %s:%d' % server.server_address)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+"""
+Code for storing corpora as memory-mapped sparse arrays.
+
+A corpus `fname` is kept in four files, which together are the CSR layout
+of the document-term matrix:
+
+    fname.ids          term ids of every document, back to back (uint32)
+    fname.counts       counts of those terms (uint32)
+    fname.offsets.npy  where each document starts in the two files above,
+                       with one extra offset marking the end (int64)
+    fname.meta         one `id<TAB>lang` line of metadata per document
+"""
+
+import io
+import os.path
+
+import numpy
+import gensim
+
+import logging
+logger = logging.getLogger('mct.sparsecorpus')
+
+ID_DTYPE = numpy.uint32
+COUNT_DTYPE = numpy.uint32
+OFFSET_DTYPE = numpy.int64
+
+EXTENSIONS = ['.ids', '.counts', '.offsets.npy', '.meta']
+
+
+class SparseCorpus(gensim.interfaces.CorpusABC):
+    """
+    Corpus read straight out of memory-mapped CSR arrays, with random access
+    to any document and no text parsing on iteration.
+    """
+
+    def __init__(self, fname, id2word=None):
+        self.fname = fname
+        self.id2word = id2word
+        self.metadata = False
+        self._meta = None
+
+        self.offsets = numpy.load(fname + '.offsets.npy', mmap_mode='r')
+        self.ids = self._memmap(fname + '.ids', ID_DTYPE)
+        self.counts = self._memmap(fname + '.counts', COUNT_DTYPE)
+
+    def _memmap(self, fname, dtype):
+        # numpy refuses to map empty files
+        if os.path.getsize(fname) == 0:
+            return numpy.zeros(0, dtype=dtype)
+
+        return numpy.memmap(fname, dtype=dtype, mode='r')
+
+    @staticmethod
+    def exists(fname):
+        return all(os.path.exists(fname + ext) for ext in EXTENSIONS)
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            with io.open(self.fname + '.meta', encoding='utf-8') as f:
+                self._meta = [tuple(line.rstrip(u'\n').split(u'\t', 1))
+                              for line in f]
+
+        return self._meta
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get_arrays(self, docno):
+        """ Returns the term id and count arrays of a document. """
+        start, end = self.offsets[docno], self.offsets[docno + 1]
+        return self.ids[start:end], self.counts[start:end]
+
+    def __getitem__(self, docno):
+        if docno < 0:
+            docno += len(self)
+
+        if not 0 <= docno < len(self):
+            raise IndexError(docno)
+
+        ids, counts = self.get_arrays(docno)
+        doc = list(zip(ids.astype(int).tolist(),
+                       counts.astype(int).tolist()))
+
+        if self.metadata:
+            return doc, self.meta[docno]
+
+        return doc
+
+    def __iter__(self):
+        for docno in range(len(self)):
+            yield self[docno]
+
+    @staticmethod
+    def save_corpus(fname, corpus, id2word=None, metadata=False):
+        logger.info('Storing sparse corpus in %s' % fname)
+        writer = SparseCorpusWriter(fname)
+        for doc in corpus:
+            if metadata:
+                doc, meta = doc
+            else:
+                meta = None
+
+            writer.add(doc, meta)
+
+        writer.close()
+
+    @classmethod
+    def serialize(cls, fname, corpus, id2word=None, metadata=False):
+        cls.save_corpus(fname, corpus, id2word=id2word, metadata=metadata)
+
+
+class SparseCorpusWriter(object):
+    """
+    Writes documents to a SparseCorpus one at a time, appending to an
+    existing one if asked to.
+    """
+
+    def __init__(self, fname, append=False):
+        self.fname = fname
+
+        if append and SparseCorpus.exists(fname):
+            offsets = numpy.load(fname + '.offsets.npy')
+            self.offsets = offsets.tolist()
+            mode = 'ab'
+        else:
+            self.offsets = [0]
+            mode = 'wb'
+
+        self.ids = open(fname + '.ids', mode)
+        self.counts = open(fname + '.counts', mode)
+        self.meta = io.open(fname + '.meta', mode[0] + 't', encoding='utf-8')
+
+    def add(self, doc, meta=None):
+        doc = list(doc)
+        numpy.array([word_id for word_id, _ in doc],
+                    dtype=ID_DTYPE).tofile(self.ids)
+        numpy.array([count for _, count in doc],
+                    dtype=COUNT_DTYPE).tofile(self.counts)
+        self.offsets.append(self.offsets[-1] + len(doc))
+
+        if meta is None:
+            meta = (len(self.offsets) - 2, u'en')
+
+        doc_id, lang = meta
+        if not isinstance(doc_id, unicode):
+            doc_id = unicode(str(doc_id), 'utf-8')
+
+        self.meta.write(doc_id + u'\t' + unicode(lang) + u'\n')
+
+    def close(self):
+        self.ids.close()
+        self.counts.close()
+        self.meta.close()
+        numpy.save(self.fname + '.offsets.npy',
+                   numpy.array(self.offsets, dtype=OFFSET_DTYPE))
@@ -2,6 +2,9 @@ import math
 import logging
 import os
 import sys
+import zlib
+
+import numpy
 
 
 logger = logging.getLogger('mct.utils')
@@ -86,18 +89,110 @@ def total_variation_distance(q_dist, p_dist, filter_by=0.001):
     return distance
 
 
+def _kullback_leibler_rows(q, P, filter_by=0.001):
+    keep = (~((q < filter_by) & (P < filter_by)) &
+            (q > 0.0) & (P > 0.0))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        terms = q * numpy.log10(q / P)
+
+    return numpy.where(keep, terms, 0.0).sum(axis=1)
+
+
+def _hellinger_rows(q, P, filter_by=0.001):
+    keep = ~((q < filter_by) & (P < filter_by))
+    inner = numpy.sqrt(q) - numpy.sqrt(P)
+    distance = numpy.where(keep, inner * inner, 0.0).sum(axis=1)
+    return numpy.sqrt(distance / 2)
+
+
+def _cosine_rows(q, P, filter_by=0.001):
+    keep = ~((q < filter_by) & (P < filter_by))
+    numerator = numpy.where(keep, q * P, 0.0).sum(axis=1)
+    denominator_a = numpy.where(keep, q * q, 0.0).sum(axis=1)
+    denominator_b = numpy.where(keep, P * P, 0.0).sum(axis=1)
+
+    denominator = numpy.sqrt(denominator_a) * numpy.sqrt(denominator_b)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        similarity = numerator / denominator
+
+    return 1.0 - similarity
+
+
+def _jensen_shannon_rows(q, P, filter_by=0.001):
+    keep = ~((q < filter_by) & (P < filter_by))
+    Q = numpy.broadcast_to(q, P.shape)
+    M = (Q + P) / 2
+
+    # the divergences against M are always filtered at the default, as in
+    # jensen_shannon_divergence
+    def divergence(D):
+        inner = (keep & ~((D < 0.001) & (M < 0.001)) &
+                 (D > 0.0) & (M > 0.0))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            terms = D * numpy.log10(D / M)
+
+        return numpy.where(inner, terms, 0.0).sum(axis=1)
+
+    return (divergence(Q) / 2) + (divergence(P) / 2)
+
+
+def _total_variation_rows(q, P, filter_by=0.001):
+    keep = ~((q < filter_by) & (P < filter_by))
+    distance = numpy.where(keep, numpy.fabs(q - P), 0.0).sum(axis=1)
+    return distance / 2
+
+
+# vectorized versions of the distance functions above, each computing the
+# distances from one distribution q to every row of a matrix P at once.
+VECTORIZED = {
+    kullback_leibler_divergence: _kullback_leibler_rows,
+    hellinger_distance: _hellinger_rows,
+    cosine_distance: _cosine_rows,
+    jensen_shannon_divergence: _jensen_shannon_rows,
+    total_variation_distance: _total_variation_rows,
+}
+
+
+def pairwise(phi, fn, filter_by=0.001, block_size=2 ** 22):
+    """
+    Returns the K x K matrix of fn(phi[a], phi[b]) over the rows of phi.
+
+    Distance functions with a vectorized version in VECTORIZED are computed
+    with numpy, a block of rows at a time so that no more than `block_size`
+    elements are held per temporary array. Any other callable is called
+    pairwise as fn(phi[a], phi[b]), ignoring `filter_by`.
+    """
+    phi = numpy.asarray(phi, dtype=numpy.float64)
+    num_topics = phi.shape[0]
+    distances = numpy.zeros((num_topics, num_topics))
+
+    rows_fn = VECTORIZED.get(fn)
+    if rows_fn is None:
+        for a in range(num_topics):
+            for b in range(num_topics):
+                distances[a, b] = fn(phi[a], phi[b])
+
+        return distances
+
+    block = max(1, int(block_size // max(1, phi.shape[1])))
+    for a in range(num_topics):
+        for start in range(0, num_topics, block):
+            end = min(num_topics, start + block)
+            distances[a, start:end] = rows_fn(phi[a], phi[start:end],
+                                              filter_by=filter_by)
+
+    return distances
+
+
 def score(model, fn):
     # thomas et al 2011 msr
     #
-    scores = list()
-    for a, topic_a in norm_phi(model):
-        score = 0.0
-        for b, topic_b in norm_phi(model):
-            if a == b:
-                continue
-
-            score += fn(topic_a, topic_b)
+    distances = pairwise(get_phi(model), fn)
+    numpy.fill_diagonal(distances, 0.0)  # a topic is not scored on itself
 
+    scores = list()
+    for a in range(model.num_topics):
+        score = distances[a].sum()
         score *= (1.0 / (model.num_topics - 1))
         logger.debug("topic %d score %f" % (a, score))
         scores.append((a, score))
@@ -105,11 +200,54 @@ def score(model, fn):
     return scores
 
 
+def get_phi(model):
+    topics = model.state.get_lambda()
+    # normalize each topic to a probability dist
+    return topics / topics.sum(axis=1)[:, numpy.newaxis]
+
+
 def norm_phi(model):
+    phi = get_phi(model)
     for topicid in range(model.num_topics):
-        topic = model.state.get_lambda()[topicid]
-        topic = topic / topic.sum()  # normalize to probability dist
-        yield topicid, topic
+        yield topicid, phi[topicid]
+
+
+class CorpusFold(object):
+    """
+    Streams either the held-out documents of one fold of a corpus, or all of
+    the training documents outside of it.
+
+    Each document is put in a fold by hashing its position in the corpus
+    with the seed, so the split is made in a single pass, is the same on
+    every pass, and nothing but the wrapped corpus is kept around. The same
+    corpus can be wrapped once per fold for k-fold evaluation.
+    """
+
+    def __init__(self, corpus, fold=0, folds=10, held_out=True, seed=0):
+        assert 0 <= fold < folds
+        self.corpus = corpus
+        self.fold = fold
+        self.folds = folds
+        self.held_out = held_out
+        self.seed = seed
+        self.length = None
+
+    def in_fold(self, docno):
+        key = '%d:%d' % (self.seed, docno)
+        return (zlib.crc32(key) & 0xffffffff) % self.folds == self.fold
+
+    def __iter__(self):
+        for docno, doc in enumerate(self.corpus):
+            if self.in_fold(docno) == self.held_out:
+                yield doc
+
+    def __len__(self):
+        if self.length is None:
+            self.length = sum(1 for docno in range(len(self.corpus))
+                              if self.in_fold(docno) == self.held_out)
+
+        return self.length
+
 
 # exception handling mkdir -p
 
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+"""
+Code for counting and comparing the word frequencies of whole corpora.
+
+Counts are kept in numpy arrays indexed by term id. Two corpora built with
+different Dictionaries are compared by aligning both onto the sorted union
+of their tokens.
+"""
+
+import numpy
+import scipy.sparse
+
+from sparsecorpus import SparseCorpus
+
+import logging
+logger = logging.getLogger('mct.wordfreq')
+
+
+def count_terms(corpus, num_terms=None, chunksize=2 ** 20):
+    """
+    Returns an array of the total count of each term id over the corpus.
+
+    The array is at least `num_terms` long, which defaults to the size of
+    the corpus' Dictionary. A SparseCorpus is counted straight from its
+    arrays, any other corpus is buffered `chunksize` entries at a time.
+    """
+    if num_terms is None:
+        id2word = getattr(corpus, 'id2word', None)
+        num_terms = max(id2word.keys()) + 1 if id2word else 0
+
+    counts = numpy.zeros(num_terms, dtype=numpy.int64)
+
+    def add(ids, weights):
+        chunk = numpy.bincount(ids, weights=weights, minlength=len(counts))
+        chunk = numpy.rint(chunk).astype(numpy.int64)
+        if len(chunk) > len(counts):
+            chunk[:len(counts)] += counts
+            return chunk
+
+        counts[:] += chunk
+        return counts
+
+    if isinstance(corpus, SparseCorpus):
+        for start in range(0, len(corpus.ids), chunksize):
+            end = start + chunksize
+            counts = add(corpus.ids[start:end], corpus.counts[start:end])
+
+        return counts
+
+    ids, weights = list(), list()
+    for doc in corpus:
+        for word_id, count in doc:
+            ids.append(word_id)
+            weights.append(count)
+
+        if len(ids) >= chunksize:
+            counts = add(ids, weights)
+            ids, weights = list(), list()
+
+    if ids:
+        counts = add(ids, weights)
+
+    return counts
+
+
+def _token_array(id2word):
+    """ Returns the ids and tokens of a Dictionary as two arrays. """
+    items = list(id2word.token2id.items())
+    tokens = numpy.array([token for token, _ in items], dtype=numpy.unicode_)
+    ids = numpy.array([word_id for _, word_id in items], dtype=numpy.int64)
+    return ids, tokens
+
+
+def align(id2word1, id2word2):
+    """
+    Returns the sorted union of the tokens of two Dictionaries, along with
+    an array for each Dictionary mapping its term ids to positions in that
+    union. Ids not used by a Dictionary map to -1.
+    """
+    ids1, tokens1 = _token_array(id2word1)
+    ids2, tokens2 = _token_array(id2word2)
+
+    tokens, inverse = numpy.unique(numpy.concatenate([tokens1, tokens2]),
+                                   return_inverse=True)
+
+    def positions(ids, inverse):
+        size = ids.max() + 1 if len(ids) else 0
+        pos = numpy.empty(size, dtype=numpy.int64)
+        pos.fill(-1)
+        pos[ids] = inverse
+        return pos
+
+    return (tokens,
+            positions(ids1, inverse[:len(ids1)]),
+            positions(ids2, inverse[len(ids1):]))
+
+
+def project(counts, positions, size):
+    """ Moves an array of counts by term id onto the aligned positions
+    returned by `align`, in an array of `size` entries.
+
+    """
+    counts = numpy.asarray(counts)
+    n = min(len(counts), len(positions))
+    pos = positions[:n]
+    used = pos >= 0
+
+    aligned = numpy.zeros(size, dtype=counts.dtype)
+    aligned[pos[used]] = counts[:n][used]
+    return aligned
+
+
+def to_distribution(counts):
+    """ Normalizes counts into a probability distribution, keeping sparse
+    vectors sparse.
+
+    """
+    if scipy.sparse.issparse(counts):
+        counts = scipy.sparse.csr_matrix(counts, dtype=numpy.float64)
+        total = counts.sum()
+        return counts / total if total else counts
+
+    counts = numpy.asarray(counts, dtype=numpy.float64)
+    total = counts.sum()
+    return counts / total if total else counts
+
+
+def random_distribution(size, seed=None):
+    """ Returns a random probability distribution over `size` words, as a
+    baseline to compare corpora against.
+
+    """
+    random = numpy.random.RandomState(seed)
+    return to_distribution(random.random_sample(size))
+
+
+def _as_pair(p, q):
+    # compare sparse against dense as sparse, only the nonzeros matter
+    if scipy.sparse.issparse(p) or scipy.sparse.issparse(q):
+        p = scipy.sparse.csr_matrix(p, dtype=numpy.float64).reshape(1, -1)
+        q = scipy.sparse.csr_matrix(q, dtype=numpy.float64).reshape(1, -1)
+        assert p.shape == q.shape
+        return p, q, True
+
+    p = numpy.asarray(p, dtype=numpy.float64).ravel()
+    q = numpy.asarray(q, dtype=numpy.float64).ravel()
+    assert p.shape == q.shape
+    return p, q, False
+
+
+def hellinger_distance(p, q):
+    """ Hellinger distance between two distributions, dense or sparse. """
+    p, q, sparse = _as_pair(p, q)
+    if sparse:
+        # sum((sqrt(p) - sqrt(q))^2) expands to sum(p) + sum(q) - 2 sum(sqrt(pq))
+        inner = p.sum() + q.sum() - 2 * p.multiply(q).sqrt().sum()
+        return numpy.sqrt(max(inner, 0.0) / 2)
+
+    inner = numpy.sqrt(p) - numpy.sqrt(q)
+    return numpy.sqrt((inner * inner).sum() / 2)
+
+
+def cosine_distance(p, q):
+    """ Cosine distance between two vectors, dense or sparse. """
+    p, q, sparse = _as_pair(p, q)
+    if sparse:
+        numerator = p.multiply(q).sum()
+        denominator = (numpy.sqrt(p.multiply(p).sum()) *
+                       numpy.sqrt(q.multiply(q).sum()))
+    else:
+        numerator = numpy.dot(p, q)
+        denominator = numpy.sqrt(numpy.dot(p, p)) * numpy.sqrt(numpy.dot(q, q))
+
+    return 1.0 - (numerator / denominator)
+
+
+def compare_corpora(corpus1, corpus2, seed=None):
+    """
+    Compares the word distributions of two corpora, and of each against a
+    random distribution over the same words.
+
+    Returns a dict with the 'hellinger' and 'cosine' distances, each a
+    tuple of (corpus1 to corpus2, corpus1 to random, corpus2 to random).
+    """
+    return compare_counts(count_terms(corpus1), corpus1.id2word,
+                          count_terms(corpus2), corpus2.id2word, seed=seed)
+
+
+def compare_counts(counts1, id2word1, counts2, id2word2, seed=None):
+    """ Same as `compare_corpora`, given the term counts of each corpus
+    along with its Dictionary.
+
+    """
+    tokens, pos1, pos2 = align(id2word1, id2word2)
+
+    dist1 = to_distribution(project(counts1, pos1, len(tokens)))
+    dist2 = to_distribution(project(counts2, pos2, len(tokens)))
+    rdist = random_distribution(len(tokens), seed=seed)
+
+    results = dict()
+    for name, fn in [('hellinger', hellinger_distance),
+                     ('cosine', cosine_distance)]:
+        results[name] = (fn(dist1, dist2), fn(dist1, rdist), fn(dist2, rdist))
+
+    return results
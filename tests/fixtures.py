@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+"""
+Code for building the small git repositories the tests run on, straight
+out of dulwich objects.
+"""
+
+import os.path
+from collections import namedtuple
+
+import dulwich.repo
+from dulwich.objects import Blob, Tree, Commit
+
+# a row of projects.csv
+Project = namedtuple('Project', 'name full_name url release commit')
+
+
+def make_repo(path, commits, author=b'Test <test@example.com>'):
+    """ Builds a repository out of (files, parents) pairs, or (files,
+    parents, message) triples, where files maps paths to contents and
+    parents lists indexes of earlier commits. `commits` may be any
+    iterable, so large histories can be generated as they are written.
+    Returns the repo and its commit ids, oldest first. """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    repo = dulwich.repo.Repo.init(path)
+    ids = list()
+    for i, commit_spec in enumerate(commits):
+        files, parents = commit_spec[:2]
+        trees = {b'': Tree()}
+        for fname in sorted(files, reverse=True):
+            blob = Blob.from_string(files[fname])
+            repo.object_store.add_object(blob)
+            dirname, _, basename = fname.rpartition(b'/')
+            trees.setdefault(dirname, Tree()).add(basename, 0o100644, blob.id)
+
+        for dirname in sorted(trees, key=len, reverse=True):
+            repo.object_store.add_object(trees[dirname])
+            if dirname:
+                parent, _, basename = dirname.rpartition(b'/')
+                trees.setdefault(parent, Tree()).add(basename, 0o040000,
+                                                     trees[dirname].id)
+
+        commit = Commit()
+        commit.tree = trees[b''].id
+        commit.parents = [ids[p] for p in parents]
+        commit.author = commit.committer = author
+        commit.commit_time = commit.author_time = 1400000000 + i
+        commit.commit_timezone = commit.author_timezone = 0
+        if len(commit_spec) > 2:
+            commit.message = commit_spec[2]
+        else:
+            commit.message = b'commit number %d' % i
+
+        repo.object_store.add_object(commit)
+        ids.append(commit.id)
+
+    repo.refs[b'refs/heads/master'] = ids[-1]
+    return repo, ids
+
+
+def make_history(path, contents):
+    """ Builds a linear history with a commit per version of a single file,
+    returning the repo and its commit ids, oldest first. """
+    return make_repo(path, [({b'file.txt': content}, [i - 1] if i else [])
+                            for i, content in enumerate(contents)])
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+if __name__ == '__main__':
+    import nose
+    nose.main()
+
+import unittest
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from src.artifacts import ArtifactStore, INFO_FNAME
+from src.main import Config
+from src.corpora import ChangesetCorpus, MultiTextCorpus
+from tests.fixtures import Project
+
+
+class TestArtifactStore(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.store = ArtifactStore(os.path.join(self.tempdir, 'artifacts'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, inputs, size, mtime):
+        fname = self.store.path(inputs, 'data', create=True)
+        with open(fname, 'w') as f:
+            f.write('x' * size)
+
+        artifact = os.path.dirname(fname)
+        os.utime(os.path.join(artifact, INFO_FNAME), (mtime, mtime))
+        return artifact
+
+    def test_path(self):
+        a = self.store.path(dict(kind='a', n=1), 'corpus.mallet')
+        self.assertEqual(a, self.store.path(dict(n=1, kind='a'),
+                                            'corpus.mallet'))
+        self.assertNotEqual(os.path.dirname(a), os.path.dirname(
+            self.store.path(dict(kind='a', n=2), 'corpus.mallet')))
+
+        # looking up leaves nothing behind, only creating does
+        self.assertFalse(os.path.exists(os.path.dirname(a)))
+        self.assertEqual(list(self.store.artifacts()), [])
+        self.assertEqual(a, self.store.path(dict(kind='a', n=1),
+                                            'corpus.mallet', create=True))
+        self.assertTrue(os.path.exists(os.path.join(os.path.dirname(a),
+                                                    INFO_FNAME)))
+
+    def test_find(self):
+        old = self.write(dict(commit='1'), 1, 1000)
+        new = self.write(dict(commit='2'), 1, 2000)
+        self.write(dict(commit='3', other=True), 1, 3000)
+
+        found = self.store.find(lambda inputs, meta: 'other' not in inputs)
+        self.assertEqual(found, [new, old])
+
+    def test_gc(self):
+        old = self.write(dict(n=1), 100, 1000)
+        mid = self.write(dict(n=2), 100, 2000)
+        new = self.write(dict(n=3), 100, 3000)
+
+        # a fresh store has used nothing, so only age matters
+        store = ArtifactStore(self.store.root)
+        self.assertEqual(store.gc(store.size() - 1), 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(mid))
+
+        # artifacts used by this process are kept even over the limit
+        store.path(dict(n=2), 'data')
+        self.assertEqual(store.gc(0), 1)
+        self.assertTrue(os.path.exists(mid))
+        self.assertFalse(os.path.exists(new))
+
+    def test_config_inputs(self):
+        config = Config()
+        config.project = Project('fixture', 'Fixture', '', '', 'abc')
+        config.artifacts = self.store
+
+        fname = config.get_corpus_fname(ChangesetCorpus)
+        self.assertNotEqual(fname, config.get_corpus_fname(MultiTextCorpus))
+
+        model_fname = config.get_model_fname(ChangesetCorpus)
+        config.num_topics = 7
+        self.assertNotEqual(model_fname,
+                            config.get_model_fname(ChangesetCorpus))
+
+        config.corpus_options = dict(config.corpus_options, min_len=1)
+        self.assertNotEqual(fname, config.get_corpus_fname(ChangesetCorpus))
+
+        fname = config.get_corpus_fname(ChangesetCorpus)
+        config.corpus_options['skip_extensions'] = ['.png']
+        self.assertNotEqual(fname, config.get_corpus_fname(ChangesetCorpus))
+
+    def test_model_workers(self):
+        config = Config()
+        config.project = Project('fixture', 'Fixture', '', '', 'abc')
+        config.artifacts = self.store
+
+        # how many processes train a model is not part of what it is
+        model_fname = config.get_model_fname(ChangesetCorpus)
+        config.workers = 4
+        self.assertEqual(model_fname, config.get_model_fname(ChangesetCorpus))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+if __name__ == '__main__':
+    import nose
+    nose.main()
+
+import unittest
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+
+from nose.tools import *
+
+from src.batch import Job, Scheduler
+
+
+def touch(fname, *needs):
+    """ Job function that fails unless the files it needs exist. """
+    for need in needs:
+        if not os.path.exists(need):
+            sys.exit(1)
+
+    open(fname, 'w').close()
+
+
+def exclusive(lock_fname, fname):
+    """ Job function that fails if another one holds the lock. """
+    try:
+        fd = os.open(lock_fname, os.O_CREAT | os.O_EXCL)
+    except OSError:
+        sys.exit(1)
+
+    time.sleep(0.2)
+    os.close(fd)
+    os.remove(lock_fname)
+    open(fname, 'w').close()
+
+
+def fail():
+    sys.exit(1)
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def path(self, name):
+        return os.path.join(self.tempdir, name)
+
+    def test_dependencies(self):
+        a, b, c = self.path('a'), self.path('b'), self.path('c')
+        jobs = [
+            Job('c', touch, (c, a, b), deps=['a', 'b']),
+            Job('b', touch, (b, a), deps=['a']),
+            Job('a', touch, (a,)),
+        ]
+
+        status = Scheduler(jobs, max_jobs=3, poll=0.01).run()
+        self.assertEqual(status, dict(a='done', b='done', c='done'))
+        self.assertTrue(os.path.exists(c))
+
+    def test_skip_existing(self):
+        a, b = self.path('a'), self.path('b')
+        jobs = [
+            Job('a', touch, (a,), outputs=lambda: True),
+            Job('b', touch, (b,), deps=['a']),
+        ]
+
+        status = Scheduler(jobs, poll=0.01).run()
+        self.assertEqual(status, dict(a='skipped', b='done'))
+        self.assertFalse(os.path.exists(a))
+
+    def test_failure(self):
+        b, c = self.path('b'), self.path('c')
+        jobs = [
+            Job('a', fail),
+            Job('b', touch, (b,), deps=['a']),
+            Job('c', touch, (c,)),
+        ]
+
+        status = Scheduler(jobs, max_jobs=2, poll=0.01).run()
+        self.assertEqual(status, dict(a='failed', b='failed', c='done'))
+        self.assertFalse(os.path.exists(b))
+
+    def test_memory_budget(self):
+        lock = self.path('lock')
+        jobs = [Job(name, exclusive, (lock, self.path(name)),
+                    memory=lambda: 60)
+                for name in ['a', 'b', 'c']]
+
+        # only one job fits at a time, even with room for three
+        status = Scheduler(jobs, max_jobs=3, memory=100, poll=0.01).run()
+        self.assertEqual(status, dict(a='done', b='done', c='done'))
+
+    def test_bad_graphs(self):
+        with self.assertRaises(ValueError):
+            Scheduler([Job('a', fail, deps=['missing'])])
+
+        jobs = [Job('a', fail, deps=['b']), Job('b', fail, deps=['a'])]
+        with self.assertRaises(ValueError):
+            Scheduler(jobs).run()
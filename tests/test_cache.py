@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+if __name__ == '__main__':
+    import nose
+    nose.main()
+
+import unittest
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import *
+import dulwich.repo
+
+from src.cache import TokenCache, LRUCache
+from src.corpora import MultiTextCorpus, ChangesetCorpus
+
+# datapath is now a useful function for building paths to test files
+module_path = os.path.dirname(__file__)
+datapath = lambda fname: os.path.join(module_path, u'test_data', fname)
+
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tempdir, 'tokens.db')
+        self.cache = TokenCache(self.fname)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_roundtrip(self):
+        self.cache['a'] = [u'graph', u'minors', u'schrödinger']
+        self.cache['b'] = None
+        self.cache['c'] = []
+
+        self.assertEqual(self.cache['a'], [u'graph', u'minors', u'schrödinger'])
+        self.assertIsNone(self.cache['b'])
+        self.assertEqual(self.cache['c'], [])
+        self.assertRaises(KeyError, lambda: self.cache['d'])
+
+    def test_persistent(self):
+        self.cache['a'] = [u'graph']
+        self.cache.close()
+
+        cache = TokenCache(self.fname)
+        self.assertEqual(cache['a'], [u'graph'])
+        cache.close()
+
+    def test_evicts_least_recently_used(self):
+        self.cache.max_bytes = 100
+        for key in ['a', 'b', 'c']:
+            self.cache[key] = [u'x' * 40]
+            self.cache.sync()
+
+        self.assertNotIn('a', self.cache)
+        self.assertIn('b', self.cache)
+        self.assertIn('c', self.cache)
+
+        self.cache['b']  # b is now more recent than c
+        self.cache['d'] = [u'x' * 40]
+        self.cache.sync()
+
+        self.assertIn('b', self.cache)
+        self.assertNotIn('c', self.cache)
+        self.assertLessEqual(self.cache.size(), 100)
+
+
+class TestCachedCorpus(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = TokenCache(os.path.join(self.tempdir, 'tokens.db'))
+        self.repo = dulwich.repo.Repo(datapath(u'multitext_git/'))
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tempdir)
+
+    def check_same_texts(self, Kind):
+        expected = Kind(self.repo, min_len=0)
+        expected.metadata = True
+        expected = [(list(doc), meta) for doc, meta in expected.get_texts()]
+
+        for _ in range(2):
+            corpus = Kind(self.repo, min_len=0, cache=self.cache)
+            corpus.metadata = True
+            texts = [(list(doc), meta) for doc, meta in corpus.get_texts()]
+            self.assertEqual(texts, expected)
+            self.assertGreater(len(self.cache), 0)
+
+    def test_multitext(self):
+        self.check_same_texts(MultiTextCorpus)
+
+    def test_changeset(self):
+        self.check_same_texts(ChangesetCorpus)
+
+    def test_shared(self):
+        MultiTextCorpus(self.repo, min_len=0, cache=self.cache)
+        size = len(self.cache)
+
+        # files are only ever added in the test repo, so the changesets
+        # reuse every blob from the snapshot
+        ChangesetCorpus(self.repo, min_len=0, cache=self.cache)
+        self.assertEqual(len(self.cache), size)
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache['a'], 1)  # b is now the oldest
+
+        cache['c'] = 3
+        self.assertEqual(len(cache), 2)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+
+    def test_update(self):
+        cache = LRUCache(max_size=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache['a'] = 3  # refreshes a as well
+
+        cache['c'] = 4
+        self.assertEqual(cache.get('a'), 3)
+        self.assertIsNone(cache.get('b'))
+
+    def test_sizeof(self):
+        cache = LRUCache(max_size=5, sizeof=len)
+        cache['a'] = 'xx'
+        cache['b'] = 'xx'
+        cache['c'] = 'xx'  # a goes to make room
+        self.assertEqual(sorted(cache._links), ['b', 'c'])
+        self.assertEqual(cache.size, 4)
+
+        cache['b'] = 'x'
+        self.assertEqual(cache.size, 3)
+
+        cache['d'] = 'xxxxxx'  # larger than the whole cache
+        self.assertNotIn('d', cache)
+        self.assertEqual(len(cache), 2)
@@ -13,17 +13,25 @@ if __name__ == '__main__':
 
 import unittest
 import os.path
+import shutil
+import tempfile
 from io import StringIO
 
 from nose.tools import *
 import dulwich.repo
 
-from src.corpora import MultiTextCorpus, ChangesetCorpus
+from src.cache import TokenCache
+from src.corpora import (MultiTextCorpus, SnapshotCorpus, ChangesetCorpus,
+                         CommitLogCorpus, tag_refs)
+from src.preprocessing import BagOfTokens
+from src.profiling import Profiler
+from tests.fixtures import make_repo
 
 # datapath is now a useful function for building paths to test files
 module_path = os.path.dirname(__file__)
 datapath = lambda fname: os.path.join(module_path, u'test_data', fname)
 
+
 class TestMultitextCorpus(unittest.TestCase):
     def setUp(self):
         self.basepath = datapath(u'multitext_git/')
@@ -422,6 +430,44 @@ class TestChangesetCorpus(unittest.TestCase):
         self.assertGreater(len(corpus.id2word), 0)
 
 
+    def test_parallel(self):
+        corpus = ChangesetCorpus(self.repo,
+                remove_stops=False,
+                lower=True,
+                split=True,
+                min_len=0,
+                processes=2)
+
+        self.corpus.metadata = True
+        corpus.metadata = True
+
+        self.assertEqual(list(corpus.get_texts()),
+                         list(self.corpus.get_texts()))
+        self.assertEqual(len(corpus), len(self.corpus))
+        self.assertEqual(list(corpus), list(self.corpus))
+
+    def test_profiled(self):
+        profiler = Profiler()
+        corpus = ChangesetCorpus(self.repo,
+                remove_stops=False,
+                lower=True,
+                split=True,
+                min_len=0,
+                profiler=profiler)
+
+        self.corpus.metadata = True
+        corpus.metadata = True
+
+        self.assertEqual(list(corpus), list(self.corpus))
+
+        stages = profiler.to_dict()
+        for name in ['read', 'to_unicode', 'tokenize', 'split', 'lower',
+                     'length', 'doc2bow']:
+            self.assertIn(name, stages)
+
+        self.assertEqual(stages['doc2bow']['count'], len(self.corpus))
+        self.assertNotIn('stops', stages)
+
     def test_changeset_get_texts(self):
         documents = [
                 # systems
@@ -593,3 +639,404 @@ class TestChangesetCorpus(unittest.TestCase):
             # term ids ahead of time for testing.
             textdoc = set((unicode(self.corpus.id2word[x[0]]), x[1]) for x in doc)
             self.assertIn(textdoc, documents)
+
+
+class TestChangesetCorpusEdits(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.repo, self.ids = make_repo(self.tempdir, [
+            ({b'a.txt': b'alpha beta\ngamma\n' + b'filler\n' * 10 +
+              b'omega\n'}, []),
+            ({b'a.txt': b'alpha beta\ndelta\n' + b'filler\n' * 10 +
+              b'omega\n'}, [0]),
+            ])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_modified_lines(self):
+        corpus = ChangesetCorpus(self.repo, min_len=0, remove_stops=False)
+        corpus.metadata = True
+        texts = [(sorted(doc), meta) for doc, meta in corpus.get_texts()]
+
+        self.assertEqual(texts, [
+            # only the lines around the edit are in the diff
+            (sorted([u'alpha', u'beta', u'gamma', u'delta'] +
+                    [u'filler'] * 3),
+             (self.ids[1], u'en')),
+            (sorted([u'alpha', u'beta', u'gamma', u'omega'] +
+                    [u'filler'] * 10),
+             (self.ids[0], u'en')),
+            ])
+
+
+class TestChangesetCorpusMerges(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.repo, self.ids = make_repo(self.tempdir, [
+            ({b'a.txt': b'alpha\n'}, []),
+            ({b'a.txt': b'alpha\n', b'b.txt': b'bravo\n'}, [0]),
+            ({b'a.txt': b'alpha\n', b'c.txt': b'charlie\n'}, [0]),
+            # merges both branches, with an edit of its own to a.txt
+            ({b'a.txt': b'alpha\nzulu\n', b'b.txt': b'bravo\n',
+              b'c.txt': b'charlie\n'}, [2, 1]),
+            ])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def texts(self, **kwargs):
+        corpus = ChangesetCorpus(self.repo, min_len=0, remove_stops=False,
+                                 lazy_dict=True, **kwargs)
+        corpus.metadata = True
+        return dict((meta[0], sorted(doc)) for doc, meta in corpus.get_texts())
+
+    def test_all(self):
+        texts = self.texts()
+        self.assertEqual(sorted(texts), sorted(self.ids))
+        self.assertEqual(texts[self.ids[3]],
+                         sorted([u'alpha', u'zulu', u'bravo'] +
+                                [u'alpha', u'zulu', u'charlie']))
+
+    def test_first_parent(self):
+        texts = self.texts(merges='first-parent')
+        self.assertEqual(sorted(texts),
+                         sorted(self.ids[i] for i in [0, 2, 3]))
+        self.assertEqual(texts[self.ids[3]], [u'alpha', u'bravo', u'zulu'])
+
+    def test_combined(self):
+        texts = self.texts(merges='combined')
+        self.assertEqual(sorted(texts), sorted(self.ids))
+        self.assertEqual(texts[self.ids[3]], [u'alpha', u'zulu'])
+
+    def test_skip(self):
+        texts = self.texts(merges='skip')
+        self.assertEqual(sorted(texts), sorted(self.ids[:3]))
+
+        with self.assertRaises(ValueError):
+            self.texts(merges='octopus')
+
+    def test_ref(self):
+        # the walk starts at the ref, not at HEAD
+        texts = self.texts(ref=self.ids[2])
+        self.assertEqual(sorted(texts), sorted([self.ids[0], self.ids[2]]))
+
+        texts = self.texts(ref=self.ids[1], merges='first-parent')
+        self.assertEqual(sorted(texts), sorted(self.ids[:2]))
+
+        corpus = CommitLogCorpus(self.repo, ref=self.ids[1], lazy_dict=True)
+        self.assertEqual(len(list(corpus.get_texts())), 2)
+
+    def test_memo(self):
+        profiler = Profiler()
+        texts = self.texts(profiler=profiler)
+        self.assertEqual(texts, self.texts(diff_cache_size=0))
+
+        # each branch's file is seen again at the merge, as is the edit to
+        # a.txt, which is the same against both parents
+        self.assertEqual(profiler.to_dict()['memo']['count'], 3)
+
+        # changes with more words than the whole memo are not remembered,
+        # so the edit to a.txt is diffed against both parents
+        profiler = Profiler()
+        self.assertEqual(texts, self.texts(profiler=profiler,
+                                           diff_cache_size=1))
+        self.assertEqual(profiler.to_dict()['diff']['count'], 2)
+
+
+class TestChangesetCorpusRenames(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        content = b'alpha\n' + b'filler\n' * 10 + b'omega\n'
+        self.repo, self.ids = make_repo(self.tempdir, [
+            ({b'a.txt': content}, []),
+            # moved, with its last line edited
+            ({b'b.txt': content.replace(b'omega', b'zulu')}, [0]),
+            # copied, with its first line edited
+            ({b'b.txt': content.replace(b'omega', b'zulu'),
+              b'c.txt': content.replace(b'omega', b'zulu')
+                               .replace(b'alpha', b'bravo')}, [1]),
+            ])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def texts(self, **kwargs):
+        corpus = ChangesetCorpus(self.repo, min_len=0, remove_stops=False,
+                                 lazy_dict=True, **kwargs)
+        corpus.metadata = True
+        return dict((meta[0], sorted(doc)) for doc, meta in corpus.get_texts())
+
+    def test_off(self):
+        texts = self.texts()
+        self.assertEqual(texts[self.ids[1]].count(u'filler'), 20)
+        self.assertEqual(texts[self.ids[2]].count(u'filler'), 10)
+
+    def test_renames(self):
+        texts = self.texts(renames=50)
+        self.assertEqual(texts[self.ids[1]],
+                         [u'filler'] * 3 + [u'omega', u'zulu'])
+
+        # the copy's source was not modified, so it is only found when asked
+        self.assertEqual(texts[self.ids[2]].count(u'filler'), 10)
+
+        texts = self.texts(renames=50, copies=True)
+        self.assertEqual(texts[self.ids[2]],
+                         [u'alpha', u'bravo'] + [u'filler'] * 3)
+
+    def test_limit(self):
+        texts = self.texts(renames=50, rename_limit=0)
+        self.assertEqual(texts[self.ids[1]].count(u'filler'), 20)
+
+
+class TestInternTokens(unittest.TestCase):
+    def setUp(self):
+        self.repo = dulwich.repo.Repo(datapath(u'multitext_git/'))
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def check_same(self, Kind, **kwargs):
+        expected = Kind(self.repo, min_len=0, **kwargs)
+        corpus = Kind(self.repo, min_len=0, intern_tokens=True, **kwargs)
+
+        self.assertEqual(list(corpus), list(expected))
+        for attr in ['token2id', 'dfs', 'cfs', 'num_docs', 'num_pos',
+                     'num_nnz']:
+            self.assertEqual(getattr(corpus.id2word, attr),
+                             getattr(expected.id2word, attr))
+
+    def test_kinds(self):
+        for Kind in [MultiTextCorpus, ChangesetCorpus, CommitLogCorpus]:
+            self.check_same(Kind)
+            self.check_same(Kind, lazy_dict=True)
+
+        self.check_same(ChangesetCorpus, profiler=Profiler())
+
+    def test_parallel(self):
+        self.check_same(ChangesetCorpus, processes=2)
+
+    def test_cached(self):
+        cache = TokenCache(os.path.join(self.tempdir, 'tokens.db'))
+        self.check_same(ChangesetCorpus, cache=cache)
+        self.check_same(ChangesetCorpus, cache=cache)  # all from the cache
+        cache.close()
+
+    def test_bags(self):
+        corpus = ChangesetCorpus(self.repo, min_len=0, lazy_dict=True,
+                                 intern_tokens=True)
+        expected = ChangesetCorpus(self.repo, min_len=0, lazy_dict=True)
+
+        for bag, words in zip(corpus.get_texts(), expected.get_texts()):
+            self.assertIsInstance(bag, BagOfTokens)
+            self.assertEqual(sorted(bag.expand(corpus.vocab)), sorted(words))
+
+        # each word is held once, however often it is used
+        self.assertEqual(len(corpus.vocab), len(set(corpus.vocab.words)))
+
+
+class TestChangesetCorpusBudgets(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.repo, self.ids = make_repo(self.tempdir, [
+            ({b'src/a.txt': b'alpha beta\n'}, []),
+            ({b'src/a.txt': b'alpha beta\n',
+              b'vendor/lib.txt': b'vendor words\n' * 50}, [0]),
+            ({b'src/a.txt': b'alpha beta\ngamma\n',
+              b'vendor/lib.txt': b'vendor words\n' * 50,
+              b'src/b.txt': b'delta\n'}, [1]),
+            ])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def texts(self, **kwargs):
+        self.corpus = ChangesetCorpus(self.repo, min_len=0,
+                                      remove_stops=False, lazy_dict=True,
+                                      **kwargs)
+        self.corpus.metadata = True
+        return dict((meta[0], doc) for doc, meta in self.corpus.get_texts())
+
+    def test_paths(self):
+        texts = self.texts(exclude_paths=['vendor/*'])
+        self.assertEqual(sorted(texts), sorted([self.ids[0], self.ids[2]]))
+
+        texts = self.texts(include_paths=['*/b.txt'])
+        self.assertEqual(texts, {self.ids[2]: [u'delta']})
+        self.assertEqual(self.corpus.clipped, dict())
+
+    def test_diff_bytes(self):
+        texts = self.texts(max_diff_bytes=100)
+        self.assertEqual(texts[self.ids[1]], [])
+        self.assertEqual(self.corpus.clipped, {self.ids[1]: ['diff-bytes']})
+
+    def test_tokens(self):
+        texts = self.texts(max_file_tokens=10)
+        self.assertEqual(len(texts[self.ids[1]]), 10)
+        self.assertEqual(self.corpus.clipped, {self.ids[1]: ['file-tokens']})
+
+        texts = self.texts(max_commit_tokens=3)
+        self.assertEqual(len(texts[self.ids[2]]), 3)
+        self.assertEqual(sorted(self.corpus.clipped),
+                         sorted([self.ids[1], self.ids[2]]))
+
+        bags = self.texts(max_commit_tokens=3, intern_tokens=True)
+        self.assertEqual([bag.total() for bag in bags.values()],
+                         [len(text) for text in texts.values()])
+
+    def test_interned_order(self):
+        # zulu is interned first, from the newer commit, but comes last in
+        # the file of the older one
+        repo, ids = make_repo(os.path.join(self.tempdir, 'order'), [
+            ({b'a.txt': b'alpha zulu\n'}, []),
+            ({b'a.txt': b'alpha zulu\n', b'b.txt': b'zulu\n'}, [0]),
+            ])
+
+        cache = TokenCache(os.path.join(self.tempdir, 'tokens.db'))
+        ChangesetCorpus(repo, min_len=0, cache=cache)  # fills the cache
+
+        for kwargs in [dict(max_file_tokens=1), dict(max_commit_tokens=1),
+                       dict(max_file_tokens=1, cache=cache)]:
+            plain = ChangesetCorpus(repo, min_len=0, lazy_dict=True, **kwargs)
+            interned = ChangesetCorpus(repo, min_len=0, lazy_dict=True,
+                                       intern_tokens=True, **kwargs)
+
+            texts = list(plain.get_texts())
+            bags = list(interned.get_texts())
+            self.assertEqual([sorted(bag.expand(interned.vocab))
+                              for bag in bags], [sorted(t) for t in texts])
+            self.assertEqual(interned.clipped, plain.clipped)
+            self.assertEqual(texts[1], [u'alpha'])
+
+        cache.close()
+
+    def test_parallel(self):
+        self.texts(max_file_tokens=10)
+        clipped = self.corpus.clipped
+
+        self.texts(max_file_tokens=10, processes=2)
+        self.assertEqual(self.corpus.clipped, clipped)
+
+
+class TestPrefilter(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        binary = b'\x00\x01binary\x00' * 10
+        self.repo, self.ids = make_repo(self.tempdir, [
+            ({b'a.txt': b'alpha\n', b'img.png': b'png words\n',
+              b'big.txt': b'big words\n' * 100, b'data.bin': binary}, []),
+            ({b'a.txt': b'alpha\nbeta\n', b'img.png': b'png words\n',
+              b'big.txt': b'big words\n' * 100,
+              b'data.bin': binary + b'\x00'}, [0]),
+            ])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def texts(self, Kind, **kwargs):
+        self.profiler = Profiler()
+        corpus = Kind(self.repo, min_len=0, remove_stops=False,
+                      lazy_dict=True, profiler=self.profiler, **kwargs)
+        return sorted(set(word for text in corpus.get_texts()
+                          for word in text))
+
+    def test_multitext(self):
+        # the png is skipped for its extension, unread
+        self.assertEqual(self.texts(MultiTextCorpus),
+                         [u'alpha', u'beta', u'big', u'words'])
+        self.assertEqual(self.profiler.to_dict()['read']['count'], 3)
+
+        self.assertEqual(self.texts(MultiTextCorpus, max_blob_bytes=100),
+                         [u'alpha', u'beta'])
+        self.assertEqual(self.texts(MultiTextCorpus, skip_extensions=[]),
+                         [u'alpha', u'beta', u'big', u'png', u'words'])
+        self.assertEqual(self.texts(MultiTextCorpus,
+                                    text_extensions=['.PNG']),
+                         [u'png', u'words'])
+
+    def test_binary_verdict(self):
+        corpus = ChangesetCorpus(self.repo, lazy_dict=True)
+        list(corpus.get_texts())
+
+        # the binary file was read when added, its change is then skipped
+        blob = self.repo[self.repo[self.ids[0]].tree][b'data.bin'][1]
+        self.assertTrue(corpus._binary[blob])
+        self.assertEqual(corpus._prefilter(b'data.bin', 0o100644, blob),
+                         'binary')
+
+
+class TestSnapshotCorpus(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.repo, self.ids = make_repo(self.tempdir, [
+            ({b'a.txt': b'alpha beta\n', b'b.txt': b'gamma\n'}, []),
+            ({b'a.txt': b'alpha beta\n', b'b.txt': b'gamma delta\n'}, [0]),
+            ({b'a.txt': b'alpha beta\n', b'b.txt': b'gamma delta\n',
+              b'c.txt': b'alpha alpha\n'}, [1]),
+            ])
+        for i, commit_id in enumerate(self.ids):
+            self.repo.refs[b'refs/tags/v%d' % i] = commit_id
+
+        self.refs = [b'v0', b'v1', b'v2']
+        self.profiler = Profiler()
+        self.corpus = SnapshotCorpus(self.repo, self.refs, min_len=0,
+                                     remove_stops=False,
+                                     profiler=self.profiler)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def words(self, corpus, docs):
+        return sorted(sorted((corpus.id2word[i], count) for i, count in doc)
+                      for doc in docs)
+
+    def test_shared_blobs(self):
+        docs = list(self.corpus)
+        self.assertEqual(len(docs), 7)
+        self.assertEqual(len(self.corpus), 7)
+
+        # a.txt is the same blob in every snapshot, b.txt changes once
+        self.assertEqual(self.profiler.to_dict()['read']['count'], 4)
+        self.assertEqual(self.profiler.to_dict()['reuse']['count'], 3)
+
+    def test_matches_multitext(self):
+        self.corpus.metadata = True
+        docs = list(self.corpus)
+        self.assertEqual(docs[-1][1], (b'v2:c.txt', u'en'))
+
+        for ref in self.refs:
+            expected = MultiTextCorpus(self.repo, ref=b'refs/tags/' + ref,
+                                       min_len=0, remove_stops=False)
+            got = [doc for doc, (name, _) in docs
+                   if name.startswith(ref + b':')]
+            self.assertEqual(self.words(self.corpus, got),
+                             self.words(expected, expected))
+
+        # the statistics are as if every document was counted on its own
+        dictionary = self.corpus.id2word
+        self.assertEqual(dictionary.num_docs, 7)
+        self.assertEqual(dictionary.dfs[dictionary.token2id[u'alpha']], 4)
+        self.assertEqual(dictionary.cfs[dictionary.token2id[u'alpha']], 5)
+
+    def test_iter_ref(self):
+        self.corpus.metadata = True
+        docs = list(self.corpus.iter_ref(b'v1'))
+        self.assertEqual([meta for _, meta in docs],
+                         [(b'a.txt', u'en'), (b'b.txt', u'en')])
+        self.assertEqual(len(self.corpus), 2)
+
+        list(self.corpus.iter_ref(b'v0'))
+        self.assertEqual(self.profiler.to_dict()['read']['count'], 3)
+
+    def test_parallel(self):
+        corpus = SnapshotCorpus(self.repo, self.refs, min_len=0,
+                                remove_stops=False, processes=2)
+        corpus.metadata = self.corpus.metadata = True
+        self.assertEqual(list(corpus), list(self.corpus))
+        self.assertEqual(corpus.id2word.token2id,
+                         self.corpus.id2word.token2id)
+        self.assertEqual(corpus.id2word.dfs, self.corpus.id2word.dfs)
+
+    def test_tag_refs(self):
+        self.assertEqual(tag_refs(self.repo), self.refs)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+if __name__ == '__main__':
+    import nose
+    nose.main()
+
+import unittest
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import *
+import numpy
+from dulwich.objects import Commit, Tag
+from gensim.corpora import Dictionary
+from gensim.models import LdaModel
+
+from src import doctopic
+from src.corpora import ChangesetCorpus
+from tests.fixtures import make_history
+
+
+def reference_first_shared(topics1, topics2, maximum=101):
+    minimum = maximum
+    for i, topic in enumerate(topics1):
+        if topic in topics2:
+            minimum = min(minimum, max(i, topics2.index(topic)))
+
+    return minimum
+
+
+def ranked(theta, minimum_probability):
+    # what reversed(sorted(model[doc])) gives, by topic id only
+    topics = [(t, p) for t, p in enumerate(theta) if p >= minimum_probability]
+    return [t for t, _ in reversed(sorted(topics, key=lambda x: x[1]))]
+
+
+class TestFirstShared(unittest.TestCase):
+    def setUp(self):
+        random = numpy.random.RandomState(0)
+        self.theta1 = random.dirichlet([0.1] * 20, size=50)
+        self.theta2 = random.dirichlet([0.1] * 20, size=50)
+        self.theta1[0] = self.theta2[0] = 1.0 / 20  # all tied
+
+    def test_topic_ranks(self):
+        ranks = doctopic.topic_ranks(self.theta1, 0.01)
+        for row, theta in zip(ranks, self.theta1):
+            for rank, topic in enumerate(ranked(theta, 0.01)):
+                self.assertEqual(row[topic], rank)
+
+            self.assertEqual((row >= 0).sum(), len(ranked(theta, 0.01)))
+
+    def test_first_shared(self):
+        ranks = doctopic.first_shared(self.theta1, self.theta2, 0.01)
+        for rank, theta1, theta2 in zip(ranks, self.theta1, self.theta2):
+            self.assertEqual(rank, reference_first_shared(
+                ranked(theta1, 0.01), ranked(theta2, 0.01)))
+
+    def test_nothing_shared(self):
+        theta1 = numpy.array([[0.5, 0.5, 0.0, 0.0]])
+        theta2 = numpy.array([[0.0, 0.0, 0.5, 0.5]])
+        self.assertEqual(doctopic.first_shared(theta1, theta2).tolist(), [101])
+
+
+class CountingModel(object):
+    def __init__(self, model):
+        self.model = model
+        self.num_topics = model.num_topics
+        self.inferred = 0
+
+    def inference(self, chunk):
+        self.inferred += len(chunk)
+        return self.model.inference(chunk)
+
+
+class Corpus(list):
+    metadata = False
+
+    def __iter__(self):
+        for i, doc in enumerate(list.__iter__(self)):
+            if self.metadata:
+                yield doc, (u'commit%d' % i, u'en')
+            else:
+                yield doc
+
+
+class TestDocTopicStore(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        texts = [[u'graph', u'node', u'edge'], [u'tree', u'leaf', u'node'],
+                 [u'graph', u'edge', u'edge'], [u'leaf', u'root', u'tree']]
+        self.id2word = Dictionary(texts)
+        self.corpus = Corpus(self.id2word.doc2bow(text) for text in texts)
+
+        self.model_fname = os.path.join(self.tempdir, 'model.lda')
+        lda = LdaModel(self.corpus, id2word=self.id2word, num_topics=3,
+                       random_state=1)
+        lda.save(self.model_fname)
+        self.model = CountingModel(lda)
+        self.fname = self.model_fname + '.theta.npz'
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_update(self):
+        store = doctopic.DocTopicStore(self.fname, self.model_fname)
+        ids, theta = store.update(self.model, self.corpus)
+        self.assertEqual(ids, [u'commit%d' % i for i in range(4)])
+        self.assertEqual(theta.shape, (4, 3))
+        numpy.testing.assert_allclose(theta.sum(axis=1), 1.0, rtol=1e-5)
+        self.assertEqual(self.model.inferred, 4)
+
+        # reopened, only the new document is inferred
+        self.corpus.append(self.id2word.doc2bow([u'root', u'node']))
+        store = doctopic.DocTopicStore(self.fname, self.model_fname)
+        ids2, theta2 = store.update(self.model, self.corpus)
+        self.assertEqual(self.model.inferred, 5)
+        self.assertEqual(ids2[:4], ids)
+        numpy.testing.assert_array_equal(theta2[:4], theta)
+
+    def test_model_changed(self):
+        store = doctopic.DocTopicStore(self.fname, self.model_fname)
+        store.update(self.model, self.corpus)
+
+        # a model saved again invalidates the store
+        stat = os.stat(self.model_fname)
+        os.utime(self.model_fname, (stat.st_atime, stat.st_mtime + 10))
+
+        store = doctopic.DocTopicStore(self.fname, self.model_fname)
+        self.assertEqual(store.ids, [])
+        store.update(self.model, self.corpus)
+        self.assertEqual(self.model.inferred, 8)
+
+
+class TestInferCommits(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.repo, self.ids = make_history(self.tempdir, [
+            b'graph node edge\n',
+            b'graph node edge\ntree leaf root\n',
+            b'graph node edge\ntree leaf root\ngraph edge edge\n',
+            b'tree leaf root\ngraph edge edge\n',
+        ])
+
+        self.corpus = ChangesetCorpus(self.repo, remove_stops=False)
+        self.model = LdaModel(self.corpus, id2word=self.corpus.id2word,
+                              num_topics=2, random_state=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_resolve_commits(self):
+        ids = self.ids
+        self.assertEqual(doctopic.resolve_commits(self.repo, [ids[2]]),
+                         [ids[2]])
+        self.assertEqual(doctopic.resolve_commits(
+            self.repo, [ids[0] + '..' + ids[2]]), ids[1:3])
+        self.assertEqual(doctopic.resolve_commits(
+            self.repo, [ids[3], ids[1] + '..HEAD']), [ids[3], ids[2]])
+
+    def test_resolve_names(self):
+        ids = self.ids
+        resolve = lambda *revisions: doctopic.resolve_commits(self.repo,
+                                                              revisions)
+        self.assertEqual(resolve('master', ids[1][:7]), [ids[3], ids[1]])
+        self.assertEqual(resolve('HEAD~2', 'master^', 'HEAD^0'),
+                         [ids[1], ids[2], ids[3]])
+
+        tag = Tag()
+        tag.name = b'v1'
+        tag.object = (Commit, ids[1])
+        tag.tagger = b'Test <test@example.com>'
+        tag.tag_time = 1400000000
+        tag.tag_timezone = 0
+        tag.message = b'release 1'
+        self.repo.object_store.add_object(tag)
+        self.repo.refs[b'refs/tags/v1'] = tag.id
+
+        # annotated tags are peeled, at either end of a range
+        self.assertEqual(resolve('refs/tags/v1'), [ids[1]])
+        self.assertEqual(resolve('v1..HEAD'), ids[2:])
+        self.assertEqual(resolve('..v1', 'HEAD~3..v1'), [ids[1]])
+
+        for revision in ['nope', 'HEAD~4', 'master^2', 'nope..HEAD']:
+            with self.assertRaises(KeyError):
+                resolve(revision)
+
+    def test_infer_commits(self):
+        batches = list(doctopic.infer_commits(self.model, self.corpus,
+                                              self.ids, batch_size=3))
+        self.assertEqual([len(ids) for ids, _ in batches], [3, 1])
+        self.assertEqual(sum((ids for ids, _ in batches), []), self.ids)
+
+        for ids, theta in batches:
+            self.assertEqual(theta.shape, (len(ids), 2))
+            numpy.testing.assert_allclose(theta.sum(axis=1), 1.0, rtol=1e-5)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+if __name__ == '__main__':
+    import nose
+    nose.main()
+
+import unittest
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from nose.tools import *
+from gensim.corpora import MalletCorpus, Dictionary
+from gensim.models import LdaMulticore
+
+from src.main import (Config, set_filenames, create_corpus, extend_corpus,
+                      run_kinds, train_model)
+from src.corpora import ChangesetCorpus, CommitLogCorpus, MultiTextCorpus
+from src.sparsecorpus import SparseCorpus
+from tests.fixtures import Project, make_repo
+
+module_path = os.path.dirname(__file__)
+root_path = os.path.join(module_path, os.path.pardir)
+
+HEAVY_MODULES = ['gensim', 'numpy', 'scipy', 'dulwich', 'src.corpora']
+
+SCRIPT = '''
+import sys
+import src.main
+print(' '.join(name for name in %r if name in sys.modules))
+''' % HEAVY_MODULES
+
+
+class TestStartup(unittest.TestCase):
+    def run_script(self, script):
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         cwd=root_path)
+        return output.decode('utf-8').splitlines()
+
+    def test_import_is_light(self):
+        loaded, = self.run_script(SCRIPT)
+        self.assertEqual(loaded.split(), [])
+
+    def test_stops_read_lazily(self):
+        script = ('import src.corpora as c; '
+                  'print(c._stops is None); '
+                  'print(len(c.get_stops()) > 0)')
+        self.assertEqual(self.run_script(script), ['True', 'True'])
+
+
+class FailingCorpus(ChangesetCorpus):
+    """ Changeset corpus that fails after its first document. """
+
+    def __iter__(self):
+        for doc in super(FailingCorpus, self).__iter__():
+            yield doc
+            raise RuntimeError('interrupted')
+
+
+class TestIncrementalCorpus(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.repo, self.ids = make_repo(
+            os.path.join(self.tempdir, 'fixture'), [
+                ({b'a.txt': b'graph node edge\n'}, []),
+                ({b'a.txt': b'graph node edge\ntree leaf\n'}, [0]),
+                ({b'a.txt': b'graph node edge\ntree leaf\n',
+                  b'b.txt': b'stack queue heap\n'}, [1]),
+                ({b'a.txt': b'tree leaf root\n',
+                  b'b.txt': b'stack queue heap\n'}, [2]),
+            ])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def config(self, commit, path):
+        config = Config()
+        config.path = os.path.join(self.tempdir, path) + '/'
+        if not os.path.isdir(config.path):
+            os.mkdir(config.path)
+
+        config.project = Project('fixture', 'Fixture', '', '', commit)
+        config.repo = self.repo
+        config.corpus_options.update(min_len=0, remove_stops=False)
+        set_filenames(config)
+        return config
+
+    def read(self, corpus_fname):
+        """ Returns the documents of both formats of a built corpus, as
+        words and counts by document id, and its Dictionary.
+
+        """
+        id2word = Dictionary.load(corpus_fname + '.dict')
+
+        mallet = MalletCorpus(corpus_fname, id2word=id2word)
+        mallet.metadata = True
+        sparse = SparseCorpus(corpus_fname, id2word=id2word)
+        sparse.metadata = True
+
+        formats = list()
+        for corpus in [[mallet[i] for i in range(len(mallet))], sparse]:
+            formats.append(dict(
+                (meta[0], sorted((id2word[i], count) for i, count in doc))
+                for doc, meta in corpus))
+
+        self.assertEqual(formats[0], formats[1])
+        return formats[0], id2word
+
+    def test_extend(self):
+        # the history is walked from HEAD, as in a clone pulled later on
+        self.repo.refs[b'refs/heads/master'] = self.ids[1]
+        old = self.config(self.ids[1], 'incremental')
+        create_corpus(old, ChangesetCorpus)
+        old_fname = old.get_corpus_fname(ChangesetCorpus)
+
+        self.repo.refs[b'refs/heads/master'] = self.ids[3]
+        new = self.config(self.ids[3], 'incremental')
+        create_corpus(new, ChangesetCorpus, incremental=True)
+        new_fname = new.get_corpus_fname(ChangesetCorpus)
+        self.assertNotEqual(old_fname, new_fname)
+
+        fresh = self.config(self.ids[3], 'fresh')
+        create_corpus(fresh, ChangesetCorpus)
+
+        docs, id2word = self.read(new_fname)
+        fresh_docs, fresh_id2word = self.read(
+            fresh.get_corpus_fname(ChangesetCorpus))
+        self.assertEqual(sorted(docs), sorted(self.ids))
+        self.assertEqual(docs, fresh_docs)
+
+        self.assertEqual(id2word.num_docs, fresh_id2word.num_docs)
+        self.assertEqual(
+            dict((word, id2word.dfs[i])
+                 for word, i in id2word.token2id.items()),
+            dict((word, fresh_id2word.dfs[i])
+                 for word, i in fresh_id2word.token2id.items()))
+
+        # the previous build is copied, not changed
+        self.assertEqual(sorted(self.read(old_fname)[0]), self.ids[:2])
+
+    def test_failure(self):
+        self.repo.refs[b'refs/heads/master'] = self.ids[1]
+        config = self.config(self.ids[1], 'incremental')
+        create_corpus(config, ChangesetCorpus)
+        corpus_fname = config.get_corpus_fname(ChangesetCorpus)
+        self.repo.refs[b'refs/heads/master'] = self.ids[3]
+
+        def contents():
+            return dict((fname, open(os.path.join(config.path, fname),
+                                     'rb').read())
+                        for fname in os.listdir(config.path))
+
+        before = contents()
+        config = self.config(self.ids[3], 'incremental')
+        with self.assertRaises(RuntimeError):
+            extend_corpus(config, FailingCorpus, corpus_fname)
+
+        # neither format took the document written before the failure
+        self.assertEqual(contents(), before)
+
+
+def record_workers(config, Kind):
+    """ Kind function noting the workers it was given in a file. """
+    with open(os.path.join(config.path, Kind.__name__), 'w') as f:
+        f.write(str(config.workers))
+
+    if Kind is CommitLogCorpus and config.fail:
+        sys.exit(1)
+
+
+class TestWorkers(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.config = Config()
+        self.config.path = self.tempdir
+        self.config.fail = False
+        self.kinds = [MultiTextCorpus, ChangesetCorpus, CommitLogCorpus]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def workers(self):
+        return dict((Kind, int(open(os.path.join(self.tempdir,
+                                                 Kind.__name__)).read()))
+                    for Kind in self.kinds)
+
+    def test_train_model(self):
+        corpus = [[(0, 2), (1, 1)], [(1, 1), (2, 3)], [(0, 1), (2, 1)]]
+        id2word = dict(enumerate(['graph', 'node', 'edge']))
+        self.config.num_topics = 2
+        self.config.passes = 1
+
+        model = train_model(self.config, corpus, id2word)
+        self.assertFalse(isinstance(model, LdaMulticore))
+
+        # the master process works as well
+        self.config.workers = 3
+        model = train_model(self.config, corpus, id2word)
+        self.assertTrue(isinstance(model, LdaMulticore))
+        self.assertEqual(model.workers, 2)
+
+    def test_split(self):
+        run_kinds(self.config, record_workers, self.kinds)
+        self.assertEqual(set(self.workers().values()), set([1]))
+
+        # the worker left over goes to the first kind
+        self.config.workers = 7
+        run_kinds(self.config, record_workers, self.kinds)
+        self.assertEqual([self.workers()[Kind] for Kind in self.kinds],
+                         [3, 2, 2])
+
+        self.config.workers = 2
+        run_kinds(self.config, record_workers, self.kinds)
+        self.assertEqual(set(self.workers().values()), set([1]))
+
+    def test_failure(self):
+        self.config.fail = True
+        for workers in [1, 4]:
+            self.config.workers = workers
+            with self.assertRaises(SystemExit) as raised:
+                run_kinds(self.config, record_workers, self.kinds)
+
+            self.assertNotEqual(raised.exception.code, 0)
+
+        # the other kinds still ran
+        self.assertEqual(len(self.workers()), 3)
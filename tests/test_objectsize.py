@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+if __name__ == '__main__':
+    import nose
+    nose.main()
+
+import unittest
+import shutil
+import tempfile
+
+from nose.tools import *
+import dulwich.repo
+from dulwich.object_store import MemoryObjectStore
+from dulwich.objects import Blob
+from dulwich.pack import write_pack_objects
+
+from src.objectsize import object_size
+
+
+def make_blobs():
+    """ Blobs similar enough to one another to be packed as deltas. """
+    base = b''.join(b'line number %d\n' % i for i in range(500))
+    return [Blob.from_string(base),
+            Blob.from_string(base + b'one more line\n'),
+            Blob.from_string(base.replace(b'number 7', b'NUMBER 7')),
+            Blob.from_string(b''),
+            Blob.from_string(b'x' * 100000)]
+
+
+class TestObjectSize(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.repo = dulwich.repo.Repo.init(self.tempdir)
+        self.blobs = make_blobs()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def check_sizes(self, store):
+        for blob in self.blobs:
+            self.assertEqual(object_size(store, blob.id), len(blob.data))
+
+    def test_loose(self):
+        for blob in self.blobs:
+            self.repo.object_store.add_object(blob)
+
+        self.check_sizes(self.repo.object_store)
+
+    def test_packed(self):
+        for deltify in [False, True]:
+            f, commit, abort = self.repo.object_store.add_pack()
+            write_pack_objects(f, [(blob, None) for blob in self.blobs],
+                               deltify=deltify)
+            commit()
+
+            self.check_sizes(self.repo.object_store)
+
+    def test_unknown(self):
+        store = MemoryObjectStore()
+        store.add_object(self.blobs[0])
+        self.assertIsNone(object_size(store, self.blobs[0].id))
+        self.assertIsNone(object_size(self.repo.object_store,
+                                      self.blobs[0].id))
@@ -19,7 +19,8 @@ from io import StringIO
 
 from nose.tools import *
 
-from src.preprocessing import split, remove_stops
+from src.preprocessing import (split, split_reference, split_token,
+                               remove_stops, StopFilter)
 from src.corpora import GitCorpus
 
 # datapath is now a useful function for building paths to test files
@@ -104,14 +105,15 @@ class PreprocessTests(unittest.TestCase):
             u'Erwin_Schrödinger': ('Erwin', '_', u'Schrödinger')
             })
 
-        for term, expected in cases.items():
-            result = split([term])
-            self.assertEqual(tuple(result), expected)
+        for splitter in [split, split_reference]:
+            for term, expected in cases.items():
+                result = splitter([term])
+                self.assertEqual(tuple(result), expected)
 
-        terms = cases.keys()
-        expected = sum(list(map(list, cases.values())), [])
-        result = split(terms)
-        self.assertEqual(list(result), expected)
+            terms = cases.keys()
+            expected = sum(list(map(list, cases.values())), [])
+            result = splitter(terms)
+            self.assertEqual(list(result), expected)
 
     def test_split_random_punct(self):
         for i in range(1, 100):
@@ -124,6 +126,21 @@ class PreprocessTests(unittest.TestCase):
             result = split([word])
             self.assertEqual(list(result), list(word))
 
+    def test_split_matches_reference(self):
+        alphabet = (u'abcXYZ019' + string.punctuation[:8] + u' \n' +
+                    u'\u00e9\u00c9\u01c5\u4e2d\u0663')
+        tokens = [u'abc\n', u'Abc\n', u'A\n', u'\n', u'abc\n\n']
+        for i in range(2000):
+            r = random.randint(1, 12)
+            tokens.append(u''.join(random.choice(alphabet)
+                                   for _ in range(r)))
+
+        for token in tokens:
+            expected = list(split_reference([token]))
+            self.assertEqual(list(split_token(token)), expected)
+            self.assertEqual(list(split([token])), expected)
+            self.assertEqual(list(split([token])), expected)  # memoized
+
     def test_split_creates_generator(self):
         """ Split tokens creates a generator """
         result = split('butts')
@@ -137,6 +154,27 @@ class PreprocessTests(unittest.TestCase):
         result = remove_stops(inputs, stops)
         self.assertEqual(list(result), expected)
 
+    def test_stop_filter(self):
+        stops = set(['the'])
+        stop_filter = StopFilter(stops)
+        self.assertEqual(stops, set(['the']))  # left as it was
+
+        inputs = ['test', 'the', '123', '-4', '1.5', '0x1f', '12ab', '',
+                  u'\u0663\u0664', u'\u00b2']
+        # the same as dropping whatever int() parses
+        expected = list()
+        for word in inputs:
+            try:
+                int(word)
+            except ValueError:
+                if word not in ['the', '']:
+                    expected.append(word)
+
+        self.assertEqual(list(stop_filter(inputs)), expected)
+        self.assertEqual(list(remove_stops(inputs, stops)), expected)
+        self.assertIn('123', stop_filter)
+        self.assertNotIn('test', stop_filter)
+
     def test_stops_creates_generator(self):
         """ Remove stops creates a generator """
         inputs = ['test', 'the']
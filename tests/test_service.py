@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+if __name__ == '__main__':
+    import nose
+    nose.main()
+
+import unittest
+import json
+import os.path
+import shutil
+import tempfile
+import threading
+import urllib2
+
+from nose.tools import *
+
+from src import service
+from src.artifacts import ArtifactStore
+from src.main import Config, set_filenames, create_corpus, create_model
+from src.corpora import MultiTextCorpus, ChangesetCorpus
+from tests.fixtures import Project, make_history
+
+
+class TestTopicService(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.repo, self.ids = make_history(
+            os.path.join(self.tempdir, 'fixture'), [
+                b'graph node edge\n',
+                b'graph node edge\ntree leaf root\n',
+                b'graph node edge\ntree leaf root\ngraph edge edge\n',
+                b'tree leaf root\ngraph edge edge\n',
+            ])
+
+        config = Config()
+        config.path = self.tempdir + '/'
+        config.project = Project('fixture', 'Fixture', '', '', self.ids[-1])
+        config.repo = self.repo
+        config.num_topics = 2
+        config.passes = 1
+        set_filenames(config)
+        self.config = config
+
+        for Kind in [MultiTextCorpus, ChangesetCorpus]:
+            create_corpus(config, Kind)
+
+        create_model(config, ChangesetCorpus)
+
+        self.loaded = list()
+        self.service = service.TopicService(self.load, max_projects=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def load(self, name):
+        if name not in ['fixture', 'other']:
+            raise service.ServiceError(404, 'No such project')
+
+        self.loaded.append(name)
+        return service.ProjectState(self.config, self.repo)
+
+    def test_infer(self):
+        status, answer = self.service.handle(
+            '/projects/fixture/infer', dict(rev=[self.ids[0] + '..HEAD']))
+        self.assertEqual(status, 200)
+        self.assertEqual([commit['id'] for commit in answer['commits']],
+                         self.ids[1:])
+
+        for commit in answer['commits']:
+            probabilities = [p for _, p in commit['topics']]
+            self.assertEqual(probabilities, sorted(probabilities,
+                                                   reverse=True))
+
+        status, answer = self.service.handle('/projects/fixture/infer',
+                                             dict(rev=['nonsense']))
+        self.assertEqual(status, 404)
+
+    def test_topics(self):
+        status, answer = self.service.handle('/projects/fixture/topics',
+                                             dict(words=['3']))
+        self.assertEqual(status, 200)
+        self.assertEqual(len(answer['topics']), 2)
+        for topic in answer['topics']:
+            self.assertEqual(len(topic['words']), 3)
+
+        status, answer = self.service.handle('/projects/fixture/topics',
+                                             dict(kind=['MultiTextCorpus']))
+        self.assertEqual(status, 404)
+
+    def test_similarity(self):
+        status, answer = self.service.handle('/projects/fixture/similarity',
+                                             dict())
+        self.assertEqual(status, 200)
+        self.assertEqual(sorted(answer), ['cosine', 'hellinger'])
+        self.assertEqual(self.service.handle('/projects/fixture/similarity',
+                                             dict()), (status, answer))
+
+    def test_cache(self):
+        for name in ['fixture', 'fixture', 'other', 'fixture']:
+            self.service.handle('/projects/%s/topics' % name, dict())
+
+        self.assertEqual(self.loaded, ['fixture', 'other', 'fixture'])
+
+        status, answer = self.service.handle('/projects/missing/topics',
+                                             dict())
+        self.assertEqual(status, 404)
+        self.assertEqual(self.service.handle('/elsewhere', dict())[0], 404)
+
+    def test_artifacts(self):
+        # the service trains nothing, so reads models of default parameters
+        store = ArtifactStore(os.path.join(self.tempdir, 'artifacts'))
+        config = Config()
+        config.project = self.config.project
+        config.repo = self.repo
+        config.artifacts = store
+        create_corpus(config, ChangesetCorpus)
+        create_model(config, ChangesetCorpus)
+
+        projects_fname = os.path.join(self.tempdir, 'projects.csv')
+        with open(projects_fname, 'w') as f:
+            f.write('name,full_name,url,release,commit\n')
+            f.write('fixture,Fixture,,,%s\n' % self.ids[-1])
+
+        # the files outside the store are not what is loaded
+        os.remove(self.config.model_fname % 'ChangesetCorpus')
+        state = service.load_project('fixture', self.tempdir, projects_fname,
+                                     artifacts=store)
+        self.assertEqual(state.model(ChangesetCorpus).num_topics,
+                         config.num_topics)
+
+        state = service.load_project('fixture', self.tempdir, projects_fname)
+        with self.assertRaises(service.ServiceError):
+            state.model(ChangesetCorpus)
+
+    def test_http(self):
+        server = service.make_server(self.service, port=0)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        try:
+            url = ('http://127.0.0.1:%d/projects/fixture/topics?words=2' %
+                   server.server_address[1])
+            answer = json.load(urllib2.urlopen(url))
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.assertEqual(len(answer['topics']), 2)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+if __name__ == '__main__':
+    import nose
+    nose.main()
+
+import unittest
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import *
+import dulwich.repo
+
+from src.corpora import ChangesetCorpus
+from src.sparsecorpus import SparseCorpus, SparseCorpusWriter
+
+# datapath is now a useful function for building paths to test files
+module_path = os.path.dirname(__file__)
+datapath = lambda fname: os.path.join(module_path, u'test_data', fname)
+
+class TestSparseCorpus(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tempdir, 'corpus.mallet')
+
+        repo = dulwich.repo.Repo(datapath(u'multitext_git/'))
+        self.corpus = ChangesetCorpus(repo, min_len=0)
+        self.corpus.metadata = True
+        self.docs = list(self.corpus)
+
+        SparseCorpus.serialize(self.fname, self.docs, metadata=True)
+        self.sparse = SparseCorpus(self.fname, id2word=self.corpus.id2word)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_length(self):
+        self.assertEqual(len(self.sparse), 5)
+
+    def test_iter(self):
+        self.assertEqual(list(self.sparse), [doc for doc, _ in self.docs])
+
+    def test_metadata(self):
+        self.sparse.metadata = True
+        self.assertEqual(list(self.sparse), self.docs)
+
+    def test_random_access(self):
+        self.assertEqual(self.sparse[3], self.docs[3][0])
+        self.assertEqual(self.sparse[-1], self.docs[-1][0])
+        self.assertRaises(IndexError, lambda: self.sparse[5])
+
+    def test_append(self):
+        writer = SparseCorpusWriter(self.fname, append=True)
+        writer.add(self.docs[0][0], (u'new', u'en'))
+        writer.add([], (u'empty', u'en'))
+        writer.close()
+
+        sparse = SparseCorpus(self.fname)
+        sparse.metadata = True
+        self.assertEqual(len(sparse), 7)
+        self.assertEqual(sparse[5], (self.docs[0][0], (u'new', u'en')))
+        self.assertEqual(sparse[6], ([], (u'empty', u'en')))
+        self.assertEqual(list(sparse)[:5], self.docs)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+if __name__ == '__main__':
+    import nose
+    nose.main()
+
+import unittest
+
+from nose.tools import *
+import numpy
+
+from src import utils
+
+
+class FakeState(object):
+    def __init__(self, topics):
+        self.topics = topics
+
+    def get_lambda(self):
+        return self.topics
+
+
+class FakeModel(object):
+    def __init__(self, topics):
+        self.num_topics = len(topics)
+        self.state = FakeState(topics)
+
+
+class TestDistances(unittest.TestCase):
+    def setUp(self):
+        random = numpy.random.RandomState(1)
+        topics = random.random_sample((6, 50)) ** 4
+        topics[:, :5] = 0.0  # words never seen
+        topics[2, 10:20] = 0.0
+        self.model = FakeModel(topics)
+        self.phi = utils.get_phi(self.model)
+
+    def check_pairwise(self, fn, filter_by=0.001):
+        distances = utils.pairwise(self.phi, fn, filter_by=filter_by)
+        self.assertEqual(distances.shape, (6, 6))
+
+        for a, topic_a in enumerate(self.phi):
+            for b, topic_b in enumerate(self.phi):
+                expected = fn(list(topic_a), list(topic_b),
+                              filter_by=filter_by)
+                self.assertAlmostEqual(distances[a, b], expected)
+
+    def test_kullback_leibler(self):
+        self.check_pairwise(utils.kullback_leibler_divergence)
+        self.check_pairwise(utils.kullback_leibler_divergence, 0.0)
+
+    def test_hellinger(self):
+        self.check_pairwise(utils.hellinger_distance)
+        self.check_pairwise(utils.hellinger_distance, 0.0)
+
+    def test_cosine(self):
+        self.check_pairwise(utils.cosine_distance)
+        self.check_pairwise(utils.cosine_distance, 0.0)
+
+    def test_jensen_shannon(self):
+        self.check_pairwise(utils.jensen_shannon_divergence)
+        self.check_pairwise(utils.jensen_shannon_divergence, 0.0)
+
+    def test_total_variation(self):
+        self.check_pairwise(utils.total_variation_distance)
+        self.check_pairwise(utils.total_variation_distance, 0.0)
+
+    def test_blocks(self):
+        expected = utils.pairwise(self.phi, utils.hellinger_distance)
+        distances = utils.pairwise(self.phi, utils.hellinger_distance,
+                                   block_size=1)
+        self.assertTrue(numpy.allclose(distances, expected))
+
+    def test_score(self):
+        fn = utils.kullback_leibler_divergence
+        scores = utils.score(self.model, fn)
+
+        for a, score in scores:
+            expected = sum(fn(self.phi[a], self.phi[b])
+                           for b in range(6) if a != b) / 5.0
+            self.assertAlmostEqual(score, expected)
+
+    def test_score_fallback(self):
+        fn = lambda q, p: utils.total_variation_distance(q, p)
+        self.assertEqual(
+            [(a, round(score, 10)) for a, score in utils.score(self.model, fn)],
+            [(a, round(score, 10)) for a, score in
+             utils.score(self.model, utils.total_variation_distance)])
+
+
+class TestCorpusFold(unittest.TestCase):
+    def setUp(self):
+        self.corpus = [[(i, 1)] for i in range(200)]
+
+    def test_partition(self):
+        seen = list()
+        for fold in range(5):
+            held_out = utils.CorpusFold(self.corpus, fold, 5, held_out=True)
+            training = utils.CorpusFold(self.corpus, fold, 5, held_out=False)
+
+            self.assertEqual(len(held_out) + len(training), 200)
+            self.assertEqual(len(list(held_out)), len(held_out))
+            self.assertEqual(sorted(list(held_out) + list(training)),
+                             self.corpus)
+            seen.extend(held_out)
+
+        self.assertEqual(sorted(seen), self.corpus)
+
+    def test_repeatable(self):
+        fold = utils.CorpusFold(self.corpus, 1, 10, seed=3)
+        self.assertEqual(list(fold), list(fold))
+        self.assertGreater(len(fold), 0)
+
+        other = utils.CorpusFold(self.corpus, 1, 10, seed=4)
+        self.assertNotEqual(list(fold), list(other))
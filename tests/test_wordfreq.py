@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# [The "New BSD" license]
+# Copyright (c) 2014 The Board of Trustees of The University of Alabama
+# All rights reserved.
+#
+# See LICENSE for details.
+
+if __name__ == '__main__':
+    import nose
+    nose.main()
+
+import unittest
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import *
+import numpy
+import scipy.sparse
+from gensim.corpora import Dictionary
+
+from src import utils, wordfreq
+from src.sparsecorpus import SparseCorpus
+
+
+class TestWordFreq(unittest.TestCase):
+    def setUp(self):
+        self.texts1 = [[u'graph', u'node', u'node'],
+                       [u'tree', u'node'],
+                       [u'graph', u'edge', u'edge', u'edge']]
+        self.texts2 = [[u'tree', u'leaf'],
+                       [u'node', u'leaf', u'root']]
+
+        self.id2word1 = Dictionary(self.texts1)
+        self.id2word2 = Dictionary(self.texts2)
+        self.corpus1 = [self.id2word1.doc2bow(text) for text in self.texts1]
+        self.corpus2 = [self.id2word2.doc2bow(text) for text in self.texts2]
+
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_count_terms(self):
+        counts = wordfreq.count_terms(self.corpus1, chunksize=2)
+        expected = dict(graph=2, node=3, tree=1, edge=3)
+        for word, count in expected.items():
+            self.assertEqual(counts[self.id2word1.token2id[word]], count)
+
+        self.assertEqual(counts.sum(), 9)
+
+    def test_count_terms_sparse(self):
+        fname = os.path.join(self.tempdir, 'corpus')
+        SparseCorpus.serialize(fname, self.corpus1)
+        corpus = SparseCorpus(fname, id2word=self.id2word1)
+
+        self.assertEqual(wordfreq.count_terms(corpus, chunksize=3).tolist(),
+                         wordfreq.count_terms(self.corpus1).tolist())
+
+    def test_align(self):
+        tokens, pos1, pos2 = wordfreq.align(self.id2word1, self.id2word2)
+        self.assertEqual(tokens.tolist(), sorted(set(self.id2word1.token2id) |
+                                                 set(self.id2word2.token2id)))
+
+        for id2word, pos in [(self.id2word1, pos1), (self.id2word2, pos2)]:
+            for token, word_id in id2word.token2id.items():
+                self.assertEqual(tokens[pos[word_id]], token)
+
+        counts1 = wordfreq.count_terms(self.corpus1)
+        aligned = wordfreq.project(counts1, pos1, len(tokens))
+        self.assertEqual(aligned[tokens.tolist().index(u'node')], 3)
+        self.assertEqual(aligned[tokens.tolist().index(u'leaf')], 0)
+
+    def test_distances(self):
+        random = numpy.random.RandomState(0)
+        p = wordfreq.to_distribution(random.random_sample(50) ** 4)
+        q = wordfreq.to_distribution(random.random_sample(50) ** 4)
+        p[:10] = 0.0
+
+        for fn, scalar in [
+                (wordfreq.hellinger_distance, utils.hellinger_distance),
+                (wordfreq.cosine_distance, utils.cosine_distance)]:
+            expected = scalar(p, q, filter_by=0.0)
+            self.assertAlmostEqual(fn(p, q), expected)
+            self.assertAlmostEqual(fn(scipy.sparse.csr_matrix(p),
+                                      scipy.sparse.csr_matrix(q)), expected)
+            self.assertAlmostEqual(fn(p, p), 0.0)
+
+    def test_compare_corpora(self):
+        class Corpus(list):
+            pass
+
+        corpus1 = Corpus(self.corpus1)
+        corpus1.id2word = self.id2word1
+        corpus2 = Corpus(self.corpus2)
+        corpus2.id2word = self.id2word2
+
+        results = wordfreq.compare_corpora(corpus1, corpus2, seed=1)
+        self.assertEqual(sorted(results), ['cosine', 'hellinger'])
+        self.assertEqual(results, wordfreq.compare_corpora(corpus1, corpus2,
+                                                           seed=1))
+
+        res = results['hellinger'][0]
+        self.assertGreater(res, 0.0)
+        self.assertLess(res, 1.0)